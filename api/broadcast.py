@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from redis.exceptions import RedisError
+
+from core.utils.redis_client import get_redis
+from .latest import get_all_latest
+from .payloads import SENSOR_DATA_PAYLOADS
+
+logger = logging.getLogger(__name__)
+
+# Every socket subscribed to all readings joins this group
+ALL_SENSORS_GROUP = 'sensors'
+SEQUENCE_PREFIX = 'sensors:seq:'
+REPLAY_PREFIX = 'sensors:replay:'
+SOCKET_STATS_KEY = 'sensors:ws:stats'
+REPLAY_MAXLEN = 500  # Frames kept per group for reconnecting sockets
+REPLAY_TTL = 3600  # Seconds a replay stream outlives its last frame
+HEARTBEAT_INTERVAL = 15  # Seconds between heartbeats of an idle socket
+
+# Number, encode and log one delta frame per group, returning (seq, frame)
+# pairs. The stream entry id is the sequence number, so replays read only the
+# missed range; a stream ahead of its counter, which was reset, is dropped.
+# KEYS: (sequence counter, replay stream) per group. ARGV: maxlen, ttl,
+# (group, readings JSON) per group.
+_PUBLISH_SCRIPT = """
+local frames = {}
+for n = 1, #KEYS / 2 do
+    local seq = redis.call('INCR', KEYS[2 * n - 1])
+    local frame = '{"event": "delta", "group": "' .. ARGV[1 + 2 * n] .. '", "seq": ' .. seq
+        .. ', "readings": ' .. ARGV[2 + 2 * n] .. '}'
+    local added = redis.pcall('XADD', KEYS[2 * n], 'MAXLEN', '~', ARGV[1], seq .. '-0', 'frame', frame)
+    if type(added) == 'table' and added.err then
+        redis.call('DEL', KEYS[2 * n])
+        redis.call('XADD', KEYS[2 * n], 'MAXLEN', '~', ARGV[1], seq .. '-0', 'frame', frame)
+    end
+    redis.call('EXPIRE', KEYS[2 * n], ARGV[2])
+    frames[n] = {seq, frame}
+end
+return frames
+"""
+_publish_script = None
+
+
+def type_group(kind):
+    return f"sensors.type.{kind}"
+
+
+def sensor_group(sensor_id):
+    return f"sensors.sensor.{sensor_id}"
+
+
+def fan_out(readings):
+    """
+    Return ``{group: readings}`` with the readings each group subscribes to.
+    """
+    groups = {ALL_SENSORS_GROUP: readings}
+    for reading in readings:
+        groups.setdefault(type_group(reading['type']), []).append(reading)
+        groups.setdefault(sensor_group(reading['sensor_id']), []).append(reading)
+    return groups
+
+
+def publish_frames(groups):
+    """
+    Return ``{group: (seq, frame)}`` with the sequence number and encoded
+    ``delta`` frame of every group.
+
+    Each frame gets the group's next sequence number, which lets a client
+    notice a missed frame, and is appended to the group's replay stream.
+    Both happen in one script call. Without Redis the frames carry no
+    sequence number, which clients treat as unknown.
+    """
+    global _publish_script
+    keys = []
+    args = [REPLAY_MAXLEN, REPLAY_TTL]
+    for group, readings in groups.items():
+        keys.extend([f"{SEQUENCE_PREFIX}{group}", f"{REPLAY_PREFIX}{group}"])
+        args.extend([group, encode_frame(readings)])
+    try:
+        if _publish_script is None:
+            _publish_script = get_redis().register_script(_PUBLISH_SCRIPT)
+        return {group: tuple(frame) for group, frame in zip(groups, _publish_script(keys=keys, args=args))}
+    except RedisError as e:
+        logger.warning("Could not sequence broadcast frames: %s", e)
+        return {
+            group: (None, encode_frame({'event': 'delta', 'group': group, 'seq': None, 'readings': readings}))
+            for group, readings in groups.items()
+        }
+
+
+def replay_frames(group, last_seq):
+    """
+    Return the frames of ``group`` after ``last_seq``, oldest first, or
+    ``None`` when some of them are no longer in the replay stream.
+    """
+    try:
+        client = get_redis()
+        current = int(client.get(f"{SEQUENCE_PREFIX}{group}") or 0)
+        # A counter behind the client was reset, a gap longer than the stream was trimmed
+        if current < last_seq or current - last_seq > REPLAY_MAXLEN:
+            return None
+        if current == last_seq:
+            return []
+        entries = client.xrange(f"{REPLAY_PREFIX}{group}", min=last_seq + 1, max=current, count=current - last_seq)
+    except RedisError as e:
+        logger.warning("Could not read the replay stream of %s: %s", group, e)
+        return None
+
+    if not entries or entries[0][0] != f"{last_seq + 1}-0":
+        return None
+    return [fields['frame'] for _, fields in entries]
+
+
+def current_sequences(groups):
+    """
+    Return ``{group: seq}`` with the last sequence number sent to every group.
+    """
+    groups = sorted(groups)
+    try:
+        values = get_redis().mget([f"{SEQUENCE_PREFIX}{group}" for group in groups]) if groups else []
+    except RedisError as e:
+        logger.warning("Could not read broadcast sequence numbers: %s", e)
+        return dict.fromkeys(groups)
+    return {group: int(value or 0) for group, value in zip(groups, values)}
+
+
+def snapshot_readings(groups):
+    """
+    Return the latest reading of every sensor covered by ``groups``.
+    """
+    readings = []
+    for kind, payload in SENSOR_DATA_PAYLOADS.items():
+        if ALL_SENSORS_GROUP in groups or type_group(kind) in groups:
+            instances = get_all_latest(kind).values()
+        else:
+            instances = [
+                instance for sensor_id, instance in get_all_latest(kind).items() if sensor_group(sensor_id) in groups
+            ]
+        readings.extend(payload(instance) for instance in instances)
+    return sorted(readings, key=lambda reading: reading['time'])
+
+
+def encode_frame(data):
+    return json.dumps(data)
+
+
+async def _group_send(channel_layer, groups):
+    # Frames are encoded once per group here instead of once per socket in
+    # every consumer, and travel through the channel layer as a plain string
+    # next to the sequence number the consumers order them by
+    await asyncio.gather(*(
+        channel_layer.group_send(group, {'type': 'sensor_frame', 'group': group, 'seq': seq, 'text': frame})
+        for group, (seq, frame) in groups.items()
+    ))
+
+
+def broadcast_sensor_data(data):
+    """
+    Broadcast sensor data to the all-sensors group and to the groups of
+    every type and sensor it contains.
+
+    Every group gets one ``delta`` frame with its readings and the group's
+    next sequence number, also kept in the group's replay stream.
+    """
+    frames = publish_frames(fan_out(data if isinstance(data, list) else [data]))
+    async_to_sync(_group_send)(get_channel_layer(), frames)
+
+
+def record_socket_stats(counts):
+    """
+    Add the per-process socket counters in ``counts`` to the shared totals.
+    """
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        for name, value in counts.items():
+            pipeline.hincrby(SOCKET_STATS_KEY, name, value)
+        pipeline.execute()
+    except RedisError as e:
+        logger.warning("Could not record socket counters: %s", e)
+
+
+def socket_stats():
+    return {name: int(value) for name, value in get_redis().hgetall(SOCKET_STATS_KEY).items()}
@@ -0,0 +1,48 @@
+import hashlib
+
+from django.utils.cache import get_conditional_response, patch_cache_control, quote_etag
+from django.utils.http import http_date
+
+from .latest import latest_times
+
+
+def content_etag(parts):
+    return quote_etag(hashlib.md5(repr(parts).encode(), usedforsecurity=False).hexdigest())
+
+
+def series_validators(request, kinds, sensor_id=None, extra=()):
+    """
+    Return ``(etag, last_modified)`` of a response built from readings of
+    ``kinds``, or ``(None, None)`` when the latest store cannot tell.
+
+    The ETag covers the request path, its ``Accept`` header, the newest
+    reading time of every type and ``extra``. Only Redis is read.
+    """
+    times = latest_times(kinds, sensor_id)
+    if times is None:
+        return None, None
+    parts = [request.get_full_path(), request.headers.get('Accept', ''), *(t.timestamp() for t in times), *extra]
+    return content_etag(parts), int(max(times).timestamp())
+
+
+def conditional_response(request, etag, last_modified, respond):
+    """
+    Answer 304 when the client's validators match, otherwise call ``respond``.
+
+    Mirrors ``django.views.decorators.http.condition`` for validators that
+    are computed together, and asks browsers to revalidate every time.
+    """
+    if etag is None:
+        return respond()
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = respond()
+        if response.status_code != 200:
+            return response
+    if request.method in ('GET', 'HEAD'):
+        response.headers.setdefault('ETag', etag)
+        if last_modified is not None:
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+    patch_cache_control(response, no_cache=True)
+    return response
@@ -1,16 +1,340 @@
+import asyncio
 import json
+import time
+from collections import Counter
+from urllib.parse import parse_qs
 
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from core.models import SENSOR_DATA_MODELS
+from core.registry import sensor_registry
+from .broadcast import (
+    ALL_SENSORS_GROUP,
+    HEARTBEAT_INTERVAL,
+    current_sequences,
+    record_socket_stats,
+    replay_frames,
+    sensor_group,
+    snapshot_readings,
+    type_group,
+)
+
+MAX_SUBSCRIPTIONS = 100
+
+# Send counters of this process, added to the shared totals with every heartbeat
+stats = Counter()
 
 
 class SensorsDataConsumer(AsyncWebsocketConsumer):
+    """
+    Stream readings to a WebSocket client.
+
+    A socket receives every reading unless it narrows its subscription, either
+    with ``?sensor=<id>&type=<type>`` on the URL or by sending
+    ``{"action": "subscribe"|"unsubscribe", "sensors": [...], "types": [...]}``.
+    The first narrowing subscription replaces the all-sensors one, and
+    ``{"action": "subscribe", "all": true}`` restores it. A sensor whose type
+    is also subscribed would receive every reading twice, so that overlap is
+    rejected. Every action is answered with the resulting subscriptions.
+
+    The client first gets a ``snapshot`` with the latest reading of every
+    subscribed sensor and the current sequence number of every group, then a
+    ``delta`` per broadcast carrying its group's next sequence number, and a
+    ``heartbeat`` with the sequence numbers every ``HEARTBEAT_INTERVAL``
+    seconds. A gap in the numbers means frames were lost; the client can ask
+    for a new snapshot with ``{"action": "snapshot"}``.
+
+    A reconnecting client passes its last sequence numbers as
+    ``?resume={"<group>": <seq>}`` and is sent the missed frames from the
+    replay streams; groups whose frames were trimmed get a snapshot.
+
+    Concurrent broadcasts can reach the consumer out of order. Frames are sent
+    in sequence order per group: a frame ahead of the next number is preceded
+    by the frames it overtook, read from the replay stream, and frames already
+    sent or covered by a snapshot are dropped.
+
+    While a send to the socket is in progress, incoming frames are conflated
+    into a buffer holding only the newest reading per sensor, sent as one
+    ``conflated`` delta per group once the socket catches up. See
+    ``WEBSOCKET_BACKPRESSURE`` for the limits of that buffer.
+    """
+
     async def connect(self):
-        await self.channel_layer.group_add("sensors", self.channel_name)
+        self.subscribed = set()
+        self.sequences = {}
+        self.heartbeat = None
+        self.pending = {}
+        self.pending_count = 0
+        self.sender = None
+        self.send_started = None
+        self.over_since = None
+        self.closing = False
+        query = parse_qs(self.scope.get('query_string', b'').decode())
         await self.accept()
+        try:
+            groups = await self._groups(query.get('sensor', []), query.get('type', []))
+            if len(groups) > MAX_SUBSCRIPTIONS:
+                raise ValueError("too many subscriptions")
+            await self._check_overlaps(groups)
+        except ValueError as e:
+            await self.send(text_data=json.dumps({'event': 'error', 'error': str(e)}))
+            await self.close()
+            return
+        await self._subscribe(groups or {ALL_SENSORS_GROUP})
+        missed = await self._replay(query.get('resume', [''])[0])
+        if missed:
+            await self._send_snapshot(missed)
+        self.heartbeat = asyncio.create_task(self._send_heartbeats())
 
     async def disconnect(self, close_code):
-        await self.channel_layer.group_discard("sensors", self.channel_name)
+        self.closing = True
+        for task in (self.heartbeat, self.sender):
+            if task is not None:
+                task.cancel()
+        self.pending = {}
+        for group in self.subscribed:
+            await self.channel_layer.group_discard(group, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            message = json.loads(text_data or '')
+            action = message.get('action')
+            if action == 'snapshot':
+                await self._send_snapshot(self.subscribed)
+                return
+            if action not in ('subscribe', 'unsubscribe'):
+                raise ValueError("action must be subscribe, unsubscribe or snapshot")
+            groups = await self._groups(message.get('sensors', []), message.get('types', []))
+            if message.get('all'):
+                groups.add(ALL_SENSORS_GROUP)
+            elif action == 'subscribe':
+                await self._check_overlaps((self.subscribed - {ALL_SENSORS_GROUP}) | groups)
+        except (ValueError, AttributeError) as e:
+            await self.send(text_data=json.dumps({'event': 'error', 'error': str(e)}))
+            return
+
+        if action == 'subscribe':
+            if ALL_SENSORS_GROUP in groups:
+                await self._unsubscribe(self.subscribed - {ALL_SENSORS_GROUP})
+                groups = {ALL_SENSORS_GROUP}
+            elif len((self.subscribed - {ALL_SENSORS_GROUP}) | groups) > MAX_SUBSCRIPTIONS:
+                await self.send(text_data=json.dumps({'event': 'error', 'error': 'too many subscriptions'}))
+                return
+            else:
+                await self._unsubscribe({ALL_SENSORS_GROUP})
+            added = groups - self.subscribed
+            await self._subscribe(groups)
+            await self.send(text_data=json.dumps(self._subscriptions()))
+            if added:
+                await self._send_snapshot(added)
+        else:
+            await self._unsubscribe(groups)
+            await self.send(text_data=json.dumps(self._subscriptions()))
+
+    async def _replay(self, resume):
+        """
+        Send the frames missed since the sequence numbers in ``resume`` and
+        return the groups that need a snapshot instead.
+        """
+        try:
+            last = json.loads(resume) if resume else {}
+            if not isinstance(last, dict):
+                raise ValueError
+        except ValueError:
+            last = {}
+        missed = set()
+        for group in self.subscribed:
+            frames = None
+            if isinstance(last.get(group), int):
+                frames = await sync_to_async(replay_frames, thread_sensitive=False)(group, last[group])
+            if frames is None:
+                missed.add(group)
+                continue
+            for frame in frames:
+                await self.send(text_data=frame)
+            self.sequences[group] = last[group] + len(frames)
+        return missed
+
+    async def _send_snapshot(self, groups):
+        # Sequence numbers are read after joining the groups and before the
+        # readings, so a frame is never missed, at worst also in the snapshot
+        sequences = await sync_to_async(current_sequences, thread_sensitive=False)(groups)
+        readings = await database_sync_to_async(snapshot_readings)(groups)
+        self.sequences.update(sequences)
+        await self.send(text_data=json.dumps({
+            'event': 'snapshot',
+            'seq': sequences,
+            'heartbeat': HEARTBEAT_INTERVAL,
+            'readings': readings,
+        }))
 
+    async def _send_heartbeats(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            if stats:
+                counts = dict(stats)
+                stats.clear()
+                await sync_to_async(record_socket_stats, thread_sensitive=False)(counts)
+            if self.send_started is not None:
+                continue  # Frames are on their way, a heartbeat would only queue behind them
+            sequences = await sync_to_async(current_sequences, thread_sensitive=False)(set(self.subscribed))
+            await self.send(text_data=json.dumps({'event': 'heartbeat', 'seq': sequences}))
+
+    async def _groups(self, sensor_ids, kinds):
+        if not isinstance(sensor_ids, list) or not isinstance(kinds, list):
+            raise ValueError("sensors and types must be lists")
+        groups = set()
+        for kind in kinds:
+            if kind not in SENSOR_DATA_MODELS:
+                raise ValueError(f"invalid type: {kind}")
+            groups.add(type_group(kind))
+        for sensor_id in sensor_ids:
+            try:
+                sensor_id = int(sensor_id)
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid sensor: {sensor_id}")
+            if not await database_sync_to_async(sensor_registry.__contains__)(sensor_id):
+                raise ValueError(f"invalid sensor: {sensor_id}")
+            groups.add(sensor_group(sensor_id))
+        return groups
+
+    async def _check_overlaps(self, groups):
+        prefix = sensor_group('')
+        kinds = {kind for kind in SENSOR_DATA_MODELS if type_group(kind) in groups}
+        for group in sorted(groups):
+            if not kinds or not group.startswith(prefix):
+                continue
+            sensor_id = int(group[len(prefix):])
+            kind = await database_sync_to_async(sensor_registry.get_type)(sensor_id)
+            if kind in kinds:
+                raise ValueError(f"sensor {sensor_id} is already covered by the {kind} subscription")
+
+    async def _subscribe(self, groups):
+        for group in groups - self.subscribed:
+            await self.channel_layer.group_add(group, self.channel_name)
+        self.subscribed |= groups
+
+    async def _unsubscribe(self, groups):
+        for group in groups & self.subscribed:
+            await self.channel_layer.group_discard(group, self.channel_name)
+            self.sequences.pop(group, None)
+        self.subscribed -= groups
+
+    def _subscriptions(self):
+        prefix = sensor_group('')
+        return {
+            'event': 'subscriptions',
+            'all': ALL_SENSORS_GROUP in self.subscribed,
+            'sensors': sorted(int(group[len(prefix):]) for group in self.subscribed if group.startswith(prefix)),
+            'types': sorted(kind for kind in SENSOR_DATA_MODELS if type_group(kind) in self.subscribed),
+        }
+
+    async def _in_order(self, event):
+        """
+        Return the frames to send for ``event``, oldest first.
+        """
+        group, seq = event.get('group'), event.get('seq')
+        last = self.sequences.get(group)
+        if seq is None or last is None or seq == last + 1:
+            self.sequences[group] = seq
+            return [event['text']]
+        if seq == last:
+            return []
+        if seq < last:
+            # Already sent, unless the counter was reset and starts over
+            current = (await sync_to_async(current_sequences, thread_sensitive=False)({group}))[group]
+            if current is None or current >= last:
+                return []
+            self.sequences[group] = seq
+            return [event['text']]
+        # The frames this one overtook are already in the replay stream
+        frames = await sync_to_async(replay_frames, thread_sensitive=False)(group, last)
+        if not frames:
+            # Trimmed: the client sees the gap and asks for a snapshot
+            self.sequences[group] = seq
+            return [event['text']]
+        self.sequences[group] = last + len(frames)
+        return frames
+
+    async def sensor_frame(self, event):
+        if self.closing:
+            return
+        frames = await self._in_order(event)
+        if not frames or self.closing:
+            return
+        if self.send_started is None:
+            # The socket keeps up: forward the frames encoded by the broadcaster unchanged
+            self.send_started = time.monotonic()
+            self.sender = asyncio.create_task(self._send_frames(frames))
+            return
+
+        for frame in frames:
+            self._conflate(json.loads(frame))
+        limits = settings.WEBSOCKET_BACKPRESSURE
+        now = time.monotonic()
+        if self.pending_count < limits['MAX_PENDING']:
+            self.over_since = None
+        elif self.over_since is None:
+            self.over_since = now
+        stalled = now - self.send_started
+        if max(stalled, now - (self.over_since or now)) > limits['STALL_TIMEOUT']:
+            stats['disconnected'] += 1
+            self.closing = True
+            # The blocked send would hold up the close frame and the buffer
+            self.sender.cancel()
+            self.pending = {}
+            await self.close(code=4008)
+
+    def _conflate(self, frame):
+        pending = self.pending.setdefault(frame.get('group'), {'seq': None, 'readings': {}, 'lossy': False})
+        if frame.get('seq') is not None:
+            pending['seq'] = max(pending['seq'] or 0, frame['seq'])
+        for reading in frame['readings']:
+            key = (reading['type'], reading['sensor_id'])
+            current = pending['readings'].get(key)
+            if current is not None:
+                stats['conflated'] += 1
+                if current['time'] > reading['time']:
+                    continue
+            elif self.pending_count >= settings.WEBSOCKET_BACKPRESSURE['MAX_PENDING']:
+                # Without the flag the client sees a sequence gap and resyncs
+                stats['dropped'] += 1
+                pending['lossy'] = True
+                continue
+            else:
+                self.pending_count += 1
+            pending['readings'][key] = reading
+
+    async def _send_frames(self, frames):
+        try:
+            for frame in frames:
+                await self.send(text_data=frame)
+                stats['forwarded'] += 1
+            while self.pending and not self.closing:
+                pending, self.pending, self.pending_count = self.pending, {}, 0
+                self.send_started = time.monotonic()
+                for group, entry in pending.items():
+                    await self.send(text_data=json.dumps({
+                        'event': 'delta',
+                        'group': group,
+                        'seq': entry['seq'],
+                        'readings': sorted(entry['readings'].values(), key=lambda reading: reading['time']),
+                        'conflated': not entry['lossy'],
+                    }))
+                    stats['conflated_frames'] += 1
+        finally:
+            self.send_started = None
+
+    # Messages of publishers from before delta frames, kept while both run
     async def sensor_update(self, event):
-        # Send the sensor data to the WebSocket
-        await self.send(text_data=json.dumps(event['data']))
+        await self.send(text_data=json.dumps({
+            'event': 'delta', 'group': None, 'seq': None, 'readings': [event['data']],
+        }))
+
+    async def sensor_batch(self, event):
+        await self.send(text_data=json.dumps({
+            'event': 'delta', 'group': None, 'seq': None, 'readings': event['data'],
+        }))
@@ -0,0 +1,68 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+LTTB_POOL_THRESHOLD = 50000  # Points per series above which metrics run on the pool
+
+_lttb_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix='lttb')
+
+
+def lttb(x, y, threshold):
+    """
+    Largest-Triangle-Three-Buckets: indices of ``threshold`` points of
+    ``(x, y)`` that keep the visual shape of the series, peaks included.
+
+    ``x`` must be increasing. Points where ``y`` is NaN are never picked.
+    """
+    valid = np.flatnonzero(~np.isnan(y))
+    n = len(valid)
+    if threshold >= n or threshold < 3:
+        return valid
+    x = x[valid]
+    y = y[valid]
+
+    # Bucket boundaries of the n - 2 inner points and every bucket's mean,
+    # from cumulative sums so they are computed in one pass
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    cum_x = np.concatenate(([0.0], np.cumsum(x)))
+    cum_y = np.concatenate(([0.0], np.cumsum(y)))
+    counts = np.maximum(edges[1:] - edges[:-1], 1)
+    mean_x = (cum_x[edges[1:]] - cum_x[edges[:-1]]) / counts
+    mean_y = (cum_y[edges[1:]] - cum_y[edges[:-1]]) / counts
+    # The last bucket's successor is the last point
+    mean_x = np.append(mean_x, x[-1])
+    mean_y = np.append(mean_y, y[-1])
+
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], max(edges[i + 1], edges[i] + 1)
+        bx = x[start:end]
+        by = y[start:end]
+        area = np.abs((x[a] - mean_x[i + 1]) * (by - y[a]) - (x[a] - bx) * (mean_y[i + 1] - y[a]))
+        a = start + int(np.argmax(area))
+        selected[i + 1] = a
+    return valid[selected]
+
+
+def lttb_indices(x, columns, threshold):
+    """
+    Sorted row indices of at most ``threshold`` points keeping the shape of
+    every column.
+
+    The points are shared between the columns: each keeps the LTTB selection
+    of ``threshold // len(columns)`` points, so every metric keeps its own
+    peaks. Below three points per column only the first one is selected on.
+    """
+    if not columns:
+        return np.arange(0)
+    per_column = threshold // len(columns)
+    if per_column < 3:
+        return lttb(x, columns[0], threshold)
+    if len(x) > LTTB_POOL_THRESHOLD and len(columns) > 1:
+        selections = list(_lttb_executor.map(lambda y: lttb(x, y, per_column), columns))
+    else:
+        selections = [lttb(x, y, per_column) for y in columns]
+    return np.unique(np.concatenate(selections))
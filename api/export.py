@@ -0,0 +1,177 @@
+import csv
+import io
+import json
+import zlib
+
+import pyarrow
+import pyarrow.parquet
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
+from rest_framework.exceptions import ValidationError
+
+from core.models import SENSOR_DATA_MODELS
+from .filters import filter_readings
+
+EXPORT_CHUNK_SIZE = 2000  # Rows fetched per round trip of the server-side cursor
+EXPORT_BUFFER_SIZE = 64 * 1024  # Bytes per streamed chunk for text formats
+PARQUET_ROW_GROUP_SIZE = 50000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def _csv_chunks(columns, rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_BUFFER_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _ndjson_chunks(columns, rows):
+    lines = []
+    size = 0
+    for row in rows:
+        line = json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder)
+        lines.append(line)
+        size += len(line) + 1
+        if size >= EXPORT_BUFFER_SIZE:
+            yield ('\n'.join(lines) + '\n').encode('utf-8')
+            lines = []
+            size = 0
+    if lines:
+        yield ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class _ParquetSink:
+    """
+    Write-only file object collecting the bytes written by ``ParquetWriter``.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _parquet_type(field):
+    internal_type = field.get_internal_type()
+    if field.attname == 'time':
+        return pyarrow.timestamp('us', tz='UTC')
+    if internal_type == 'FloatField':
+        return pyarrow.float64()
+    if internal_type == 'IntegerField':
+        return pyarrow.int32()
+    return pyarrow.int64()
+
+
+def _parquet_chunks(fields, rows):
+    schema = pyarrow.schema([
+        pyarrow.field(field.attname, _parquet_type(field), nullable=field.null) for field in fields
+    ])
+    sink = _ParquetSink()
+    writer = pyarrow.parquet.ParquetWriter(pyarrow.PythonFile(sink, mode='w'), schema)
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= PARQUET_ROW_GROUP_SIZE:
+            writer.write_table(pyarrow.Table.from_pylist([dict(zip(schema.names, r)) for r in batch], schema))
+            batch = []
+            yield sink.drain()
+    if batch:
+        writer.write_table(pyarrow.Table.from_pylist([dict(zip(schema.names, r)) for r in batch], schema))
+    writer.close()
+    yield sink.drain()
+
+
+def _gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=31)  # gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def _async_chunks(chunks):
+    """
+    Pull a sync generator from the ASGI event loop without buffering it.
+
+    Every step runs in the same thread, so the server-side cursor keeps
+    using one database connection.
+    """
+    sentinel = object()
+    while True:
+        chunk = await sync_to_async(next, thread_sensitive=True)(chunks, sentinel)
+        if chunk is sentinel:
+            break
+        yield chunk
+
+
+@require_GET
+def export_data(request, kind):
+    """
+    Stream the raw readings of one hypertable as CSV, NDJSON or Parquet.
+
+    Rows are read through a server-side cursor, so memory use does not grow
+    with the size of the export. Takes the ``sensor_id``, ``start`` and
+    ``end`` filters of the list endpoints and an optional ``gzip=1``.
+    """
+    model = SENSOR_DATA_MODELS.get(kind)
+    if model is None:
+        return JsonResponse({'error': 'invalid sensor data type'}, status=404)
+
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in CONTENT_TYPES:
+        return JsonResponse({'error': f"invalid format, use one of: {', '.join(CONTENT_TYPES)}"}, status=400)
+
+    try:
+        queryset = filter_readings(model.objects.all(), request.GET)
+    except ValidationError as e:
+        return JsonResponse(e.detail, status=400)
+
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    columns = [field.attname for field in fields]
+    rows = queryset.order_by('time').values_list(*columns).iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+    if fmt == 'parquet':
+        chunks = _parquet_chunks(fields, rows)
+    elif fmt == 'ndjson':
+        chunks = _ndjson_chunks(columns, rows)
+    else:
+        chunks = _csv_chunks(columns, rows)
+
+    filename = f"{model._meta.db_table}.{fmt}"
+    content_type = CONTENT_TYPES[fmt]
+    if request.GET.get('gzip') in ('1', 'true'):
+        chunks = _gzip_chunks(chunks)
+        filename += '.gz'
+        content_type = 'application/gzip'
+
+    response = StreamingHttpResponse(_async_chunks(chunks), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,67 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import ValidationError
+
+
+def parse_time_param(params, name):
+    """
+    Parse an ISO 8601 query parameter, naive values use the current timezone.
+    """
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        parsed = parse_datetime(value)
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValidationError({name: ["Expected an ISO 8601 datetime."]})
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def parse_sensor_id(params, name='sensor_id'):
+    value = params.get(name)
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValidationError({name: ["A valid integer is required."]})
+
+
+def filter_readings(queryset, params):
+    """
+    Apply the ``sensor_id``, ``start`` and ``end`` query parameters.
+
+    ``start`` is inclusive and ``end`` exclusive. Both are plain bounds on the
+    ``time`` column so TimescaleDB can skip chunks outside the window.
+    """
+    sensor_id = parse_sensor_id(params)
+    start = parse_time_param(params, 'start')
+    end = parse_time_param(params, 'end')
+    if start and end and start >= end:
+        raise ValidationError({'end': ["Must be after start."]})
+
+    if sensor_id is not None:
+        queryset = queryset.filter(sensor_id=sensor_id)
+    if start is not None:
+        queryset = queryset.filter(time__gte=start)
+    if end is not None:
+        queryset = queryset.filter(time__lt=end)
+    return queryset
+
+
+def parse_fields(params, available):
+    """
+    Parse the ``fields`` projection parameter against the available names.
+    """
+    value = params.get('fields')
+    if not value:
+        return None
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise ValidationError({'fields': [f"Unknown field(s): {', '.join(unknown)}."]})
+    return fields
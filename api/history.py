@@ -0,0 +1,401 @@
+import logging
+import re
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.utils import timezone
+
+from core.models import SENSOR_DATA_MODELS
+from core.timescale import bucket_start, interval_seconds, pick_aggregate
+from .downsample import lttb_indices
+
+logger = logging.getLogger(__name__)
+
+HISTORY_DIRTY_CACHE_TTL = 1800  # Seconds to cache buckets while a late reading awaits the aggregate refresh
+HISTORY_LATE_TTL = 86400  # Longest refresh schedule of the continuous aggregates
+HISTORY_MAX_SERIES = 16
+HISTORY_MAX_POINTS = 5000  # Upper bound of max_points for arbitrary windows
+LTTB_MAX_POINTS = 5000
+LTTB_FETCH_SIZE = 10000  # Raw rows fetched per round trip of the server-side cursor
+
+# Chart series of the dashboard: reading type and sensor id (None for all)
+HISTORY_SERIES = {
+    'outdoor': ('air', None),
+    'indoor': ('indoor', None),
+    'temp1': ('temperature', 1),
+    'temp2': ('temperature', 2),
+}
+
+# Metrics of every reading type: response key, column and rounding digits
+HISTORY_METRICS = {
+    'air': [
+        ('temperature', 'temperature', 2),
+        ('humidity', 'humidity', 2),
+        ('pressure', 'pressure', 2),
+        ('pm10', 'p1', 2),
+        ('pm25', 'p2', 2),
+    ],
+    'indoor': [
+        ('aqi', 'aqi', 1),
+        ('tvoc', 'tvoc', 1),
+        ('eco2', 'eco2', 1),
+    ],
+    'temperature': [
+        ('temperature', 'temperature', 2),
+        ('humidity', 'humidity', 2),
+        ('pressure', 'pressure', 2),
+    ],
+}
+
+# Statistics besides the average that the continuous aggregates can merge;
+# ``p<percentile>`` (e.g. ``p95``) is accepted as well and reads raw rows
+HISTORY_STATS = ['count', 'min', 'max', 'stddev']
+
+# Bucket widths for arbitrary windows, all nest in a continuous aggregate or are finer
+BUCKET_WIDTHS = [
+    '1 minute', '5 minutes', '15 minutes', '30 minutes',
+    '1 hour', '3 hours', '6 hours', '12 hours',
+    '1 day', '1 week', '2 weeks', '4 weeks',
+]
+
+# Range parameter to (window, bucket width)
+HISTORY_RANGES = {
+    '1d': ('1 day',    '1 hour'),
+    '1w': ('7 days',   '6 hours'),
+    '1m': ('30 days',  '1 day'),
+    '6m': ('180 days', '1 week'),
+    '1y': ('365 days', '2 weeks'),
+}
+
+
+def resolve_metrics(kind, names=None):
+    """
+    Return the ``HISTORY_METRICS`` entries of ``kind`` named in ``names``.
+    """
+    metrics = HISTORY_METRICS[kind]
+    if names is None:
+        return metrics
+    unknown = set(names) - {key for key, _, _ in metrics}
+    if not names or unknown:
+        raise ValueError(f"invalid metrics: {', '.join(sorted(unknown)) or '(none)'}")
+    return [metric for metric in metrics if metric[0] in names]
+
+
+def _aligned_buckets(start, end, width):
+    # time_bucket aligns to BUCKET_ORIGIN, so an unaligned start or end adds a partial bucket
+    first = bucket_start(start, width)
+    last = bucket_start(end, width)
+    if last < end:
+        last += timedelta(seconds=width)
+    return first, last
+
+
+def choose_bucket(start, end, max_points):
+    """
+    Return the narrowest of ``BUCKET_WIDTHS`` giving at most ``max_points``
+    buckets between ``start`` and ``end``, raising ``ValueError`` when even
+    the widest gives more.
+    """
+    for width in BUCKET_WIDTHS:
+        seconds = interval_seconds(width)
+        first, last = _aligned_buckets(start, end, seconds)
+        if (last - first).total_seconds() // seconds <= max_points:
+            return width
+    raise ValueError(f"window too long for {max_points} points of {BUCKET_WIDTHS[-1]}")
+
+
+def parse_stats(names):
+    """
+    Validate a list of ``HISTORY_STATS`` names and ``p<percentile>`` entries.
+    """
+    for name in names:
+        if name in HISTORY_STATS:
+            continue
+        match = re.fullmatch(r'p(\d{1,2}(?:\.\d+)?)', name)
+        if match is None or not 0 < float(match.group(1)) < 100:
+            raise ValueError(f"invalid stat: {name}")
+    return list(dict.fromkeys(names))
+
+
+def _select_list(metrics, stats, aggregated):
+    """
+    Return ``(expression, params, key, digits)`` for every selected value.
+
+    On a continuous aggregate every statistic is merged from the stored
+    per-bucket sums, counts, extremes and sums of squares; percentiles are
+    not mergeable and always read the raw table.
+    """
+    selects = []
+    for key, column, digits in metrics:
+        count = f"SUM({column}_count)" if aggregated else f"COUNT({column})"
+        if aggregated:
+            selects.append((f"SUM({column}_sum) / NULLIF({count}, 0)", [], key, digits))
+        else:
+            selects.append((f"AVG({column})", [], key, digits))
+        for stat in stats:
+            params = []
+            if stat == 'count':
+                expression = count
+            elif stat in ('min', 'max'):
+                expression = f"{stat.upper()}({column}_{stat})" if aggregated else f"{stat.upper()}({column})"
+            elif stat == 'stddev':
+                if aggregated:
+                    expression = (
+                        f"sqrt(GREATEST(SUM({column}_sumsq) - SUM({column}_sum) ^ 2 / NULLIF({count}, 0), 0)"
+                        f" / NULLIF({count} - 1, 0))"
+                    )
+                else:
+                    expression = f"STDDEV_SAMP({column})"
+            else:
+                expression = f"percentile_cont(%s) WITHIN GROUP (ORDER BY {column})"
+                params = [float(stat[1:]) / 100]
+            selects.append((expression, params, f"{key}_{stat}", None if stat == 'count' else digits))
+    return selects
+
+
+def _history_sql(kind, sensor_id, selects, bucket, start, end=None, aggregate=None):
+    """
+    Build the bucketed statistics query. Only identifiers are formatted into
+    the text; the bucket width, bounds and sensor id are bind parameters.
+    """
+    if aggregate is None:
+        time_column = 'time'
+        source = SENSOR_DATA_MODELS[kind]._meta.db_table
+    else:
+        # Re-bucket the aggregate's closed and real-time buckets into the
+        # requested width, weighting every bucket by its row count
+        time_column = 'bucket'
+        source, _ = aggregate
+
+    params = [timedelta(seconds=interval_seconds(bucket))]
+    for _, select_params, _, _ in selects:
+        params.extend(select_params)
+    conditions = [f"{time_column} >= %s"]
+    params.append(start)
+    if end is not None:
+        conditions.append(f"{time_column} < %s")
+        params.append(end)
+    if sensor_id is not None:
+        conditions.append("sensor_id = %s")
+        params.append(sensor_id)
+
+    columns = ', '.join(f"({expression})::float8" for expression, _, _, _ in selects)
+    return f"""
+        SELECT time_bucket(%s, {time_column}) AS b, {columns}
+        FROM {source}
+        WHERE {' AND '.join(conditions)}
+        GROUP BY b ORDER BY b
+    """, params
+
+
+def _query_buckets(kind, sensor_id, metrics, bucket, start, end=None, stats=()):
+    """
+    Return ``(bucket start, row)`` pairs between ``start`` and ``end`` (or now).
+    """
+    table = SENSOR_DATA_MODELS[kind]._meta.db_table
+    percentiles = any(stat not in HISTORY_STATS for stat in stats)
+    aggregate = None if percentiles else pick_aggregate(table, bucket)
+    selects = _select_list(metrics, stats, aggregate is not None)
+    sql, params = _history_sql(kind, sensor_id, selects, bucket, start, end, aggregate)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [(row[0], {
+            'time': row[0].isoformat(),
+            'type': kind,
+            **{
+                key: _round(value, digits)
+                for (_, _, key, digits), value in zip(selects, row[1:])
+            },
+        }) for row in cursor.fetchall()]
+
+
+def _round(value, digits):
+    if value is None:
+        return None
+    if digits is None:
+        return int(value)
+    return round(value, digits)
+
+
+def window_rows(kind, sensor_id, start, end, bucket, metrics=None, stats=()):
+    """
+    Return bucketed statistics for an arbitrary window, widened to whole
+    buckets of ``bucket`` (see ``choose_bucket``).
+    """
+    first, last = _aligned_buckets(start, end, interval_seconds(bucket))
+    buckets = _query_buckets(kind, sensor_id, resolve_metrics(kind, metrics), bucket, first, last, stats)
+    return [row for _, row in buckets]
+
+
+def _version(kind):
+    try:
+        return cache.get(f"history:version:{kind}", 0)
+    except Exception as e:
+        logger.warning("History cache read failed: %s", e)
+        return None
+
+
+def history_rows(kind, sensor_id, range_param, metrics=None, stats=()):
+    """
+    Return the bucketed averages, and ``stats``, of a series for one of ``HISTORY_RANGES``.
+
+    The window starts on a bucket boundary, so every bucket but the open one
+    is final. Closed buckets are cached per series and only the buckets that
+    closed since the last call, plus the open one, are queried.
+    """
+    interval, bucket = HISTORY_RANGES[range_param]
+    width = interval_seconds(bucket)
+    window = interval_seconds(interval)
+    now = timezone.now()
+    open_start = bucket_start(now, width)
+    window_start = bucket_start(now - timedelta(seconds=window), width)
+
+    selected = resolve_metrics(kind, metrics)
+    version = _version(kind)
+    key = (
+        f"history:{kind}:{sensor_id}:{range_param}:{','.join(key for key, _, _ in selected)}"
+        f":{','.join(stats)}:v{version}"
+    )
+    cached = None
+    if version is not None:
+        try:
+            cached = cache.get(key)
+        except Exception as e:
+            logger.warning("History cache read failed: %s", e)
+
+    if cached is not None and window_start <= cached['open_start'] <= open_start:
+        closed = [(start, row) for start, row in cached['buckets'] if start >= window_start]
+        buckets = _query_buckets(kind, sensor_id, selected, bucket, cached['open_start'], stats=stats)
+    else:
+        closed = []
+        buckets = _query_buckets(kind, sensor_id, selected, bucket, window_start, stats=stats)
+    closed += [(start, row) for start, row in buckets if start < open_start]
+    tail = [(start, row) for start, row in buckets if start >= open_start]
+
+    if version is not None:
+        # A reading that lands in a closed bucket is only visible once the
+        # aggregate refresh picked it up, so keep entries short until then
+        try:
+            dirty = cache.get(f"history:late:{kind}") is not None
+            timeout = HISTORY_DIRTY_CACHE_TTL if dirty else window + width
+            cache.set(key, {'open_start': open_start, 'buckets': closed}, timeout)
+        except Exception as e:
+            logger.warning("History cache write failed: %s", e)
+
+    return [row for _, row in closed + tail]
+
+
+def history_state(kind, range_param=None):
+    """
+    Return what besides new readings changes the history of ``kind``: the
+    invalidation version and, for a range, the start of its open bucket.
+    """
+    if range_param is None:
+        return (_version(kind),)
+    _, bucket = HISTORY_RANGES[range_param]
+    return _version(kind), bucket_start(timezone.now(), interval_seconds(bucket))
+
+
+def invalidate_history(kind, earliest):
+    """
+    Drop the cached buckets of ``kind`` when a reading lands in a closed one.
+    """
+    finest = min(interval_seconds(bucket) for _, bucket in HISTORY_RANGES.values())
+    if earliest >= bucket_start(timezone.now(), finest):
+        return
+    try:
+        version_key = f"history:version:{kind}"
+        cache.add(version_key, 0, None)
+        cache.incr(version_key)
+        cache.set(f"history:late:{kind}", 1, HISTORY_LATE_TTL)
+    except Exception as e:
+        logger.warning("History cache invalidation failed: %s", e)
+
+
+def downsampled_rows(kind, sensor_id, range_param, points, metrics=None):
+    """
+    Return raw readings of a series reduced with LTTB to at most ``points``
+    readings per sensor, shared between the metrics (see ``lttb_indices``).
+
+    A series of every sensor of the type is split by sensor first, since
+    the readings of several sensors do not form one line. The raw window is
+    read through a server-side cursor straight into float arrays, so only
+    those, not the fetched rows, are held for the whole window.
+    """
+    interval, _ = HISTORY_RANGES[range_param]
+    start = timezone.now() - timedelta(seconds=interval_seconds(interval))
+    table = SENSOR_DATA_MODELS[kind]._meta.db_table
+    metrics = resolve_metrics(kind, metrics)
+    columns = ', '.join(f"{column}::float8" for _, column, _ in metrics)
+    sensor_filter = "AND sensor_id = %s" if sensor_id is not None else ""
+    params = [start] + ([sensor_id] if sensor_id is not None else [])
+
+    chunks = []
+    with connection.chunked_cursor() as cursor:
+        cursor.execute(f"""
+            SELECT sensor_id::float8, EXTRACT(EPOCH FROM time)::float8, {columns}
+            FROM {table}
+            WHERE time >= %s
+            {sensor_filter}
+            ORDER BY sensor_id, time
+        """, params)
+        while rows := cursor.fetchmany(LTTB_FETCH_SIZE):
+            chunks.append(np.array(rows, dtype=float))
+    data = np.concatenate(chunks) if chunks else np.empty((0, len(metrics) + 2))
+
+    # Rows are ordered by sensor, so every sensor is one contiguous slice
+    _, starts = np.unique(data[:, 0], return_index=True)
+    selected = []
+    for first, last in zip(starts, [*starts[1:], len(data)]):
+        part = data[first:last]
+        selected.append(first + lttb_indices(part[:, 1], [part[:, i] for i in range(2, len(metrics) + 2)], points))
+    indices = np.concatenate(selected) if selected else np.arange(0)
+    indices = indices[np.argsort(data[indices, 1], kind='stable')]
+
+    return [{
+        'time': datetime.fromtimestamp(data[i, 1], tz=dt_timezone.utc).isoformat(),
+        'type': kind,
+        'sensor_id': int(data[i, 0]),
+        **{
+            key: None if np.isnan(value) else round(float(value), digits)
+            for (key, _, digits), value in zip(metrics, data[i, 2:])
+        },
+    } for i in indices]
+
+
+def parse_series(spec):
+    """
+    Parse a series name from ``HISTORY_SERIES`` or ``type:sensor_id[:metric,...]``.
+
+    ``sensor_id`` may be ``*`` for every sensor of the type. Returns
+    ``(kind, sensor_id, metrics)`` and raises ``ValueError`` when invalid.
+    """
+    if spec in HISTORY_SERIES:
+        kind, sensor_id = HISTORY_SERIES[spec]
+        return kind, sensor_id, None
+
+    parts = spec.split(':')
+    if len(parts) not in (2, 3) or parts[0] not in HISTORY_METRICS:
+        raise ValueError(f"invalid series: {spec}")
+    kind = parts[0]
+    sensor_id = None if parts[1] == '*' else int(parts[1])
+    metrics = None
+    if len(parts) == 3:
+        metrics = parts[2].split(',')
+        resolve_metrics(kind, metrics)
+    return kind, sensor_id, metrics
+
+
+def history_batch(series, range_param, stats=()):
+    """
+    Return ``{spec: rows}`` for several parsed series.
+
+    The series are read one after another on the request's connection.
+    Their closed buckets come from the cache, so each is one short query.
+    """
+    return {
+        spec: history_rows(kind, sensor_id, range_param, metrics, stats)
+        for spec, (kind, sensor_id, metrics) in series.items()
+    }
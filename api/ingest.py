@@ -0,0 +1,287 @@
+import csv
+import io
+import json
+
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import SENSOR_DATA_MODELS
+from core.registry import sensor_registry
+from core.timescale import refresh_aggregates
+from .history import invalidate_history
+from .latest import record_latest
+from .snapshot import invalidate_snapshot
+
+BULK_INSERT_BATCH_SIZE = 1000
+COPY_MAX_REJECTED_LINES = 100
+COPY_MAX_LINE_LENGTH = 64 * 1024
+
+
+class LineTooLong(Exception):
+    pass
+
+
+def latest_per_sensor(instances):
+    """
+    Keep only the newest instance for every sensor, ordered by time.
+    """
+    latest = {}
+    for instance in instances:
+        current = latest.get(instance.sensor_id)
+        if current is None or instance.time > current.time:
+            latest[instance.sensor_id] = instance
+    return sorted(latest.values(), key=lambda instance: instance.time)
+
+
+def validate_readings(serializer_class, items, context=None):
+    """
+    Validate a list of readings, including the sensor id.
+
+    Returns ``(valid, errors)`` where ``valid`` holds the validated data of
+    the accepted items and ``errors`` one ``{'index': ..., 'errors': ...}``
+    entry per rejected item.
+    """
+    valid = []
+    errors = []
+    for index, item in enumerate(items):
+        serializer = serializer_class(data=item, context=context)
+        if not serializer.is_valid():
+            errors.append({'index': index, 'errors': serializer.errors})
+        elif serializer.validated_data['sensor_id'] not in sensor_registry:
+            errors.append({'index': index, 'errors': {'sensor_id': ['Invalid sensor ID.']}})
+        else:
+            valid.append(serializer.validated_data)
+    return valid, errors
+
+
+def insert_readings(model, items):
+    """
+    Store validated readings with one batched INSERT in one transaction.
+    """
+    instances = [model(**data) for data in items]
+    if instances:
+        with transaction.atomic():
+            model.objects.bulk_create(instances, batch_size=BULK_INSERT_BATCH_SIZE)
+    return instances
+
+
+def readings_stored(kind, instances, earliest=None):
+    """
+    Update the derived stores after readings of ``kind`` were committed.
+
+    ``earliest`` is the oldest stored time when ``instances`` is only a
+    subset of the stored readings.
+    """
+    record_latest(kind, instances)
+    invalidate_snapshot()
+    if earliest is None and instances:
+        earliest = min(instance.time for instance in instances)
+    if earliest is not None:
+        invalidate_history(kind, earliest)
+
+
+def bulk_create_readings(serializer_class, items, context=None):
+    """
+    Validate a list of readings and store the valid ones in one transaction.
+
+    Returns ``(instances, errors)``, see ``validate_readings``.
+    """
+    valid, errors = validate_readings(serializer_class, items, context)
+    return insert_readings(serializer_class.Meta.model, valid), errors
+
+
+class CopyResult:
+    """
+    Row counts and a bounded sample of rejected lines for one COPY ingest.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.accepted = 0
+        self.rejected = 0
+        self.rejected_lines = []
+        self.latest = {}
+        self.earliest = None
+        self.newest = None
+
+    def accept(self, values):
+        self.accepted += 1
+        if self.earliest is None or values['time'] < self.earliest:
+            self.earliest = values['time']
+        if self.newest is None or values['time'] > self.newest:
+            self.newest = values['time']
+        current = self.latest.get(values['sensor_id'])
+        if current is None or values['time'] > current['time']:
+            self.latest[values['sensor_id']] = values
+
+    def reject(self, line, error):
+        self.rejected += 1
+        if len(self.rejected_lines) < COPY_MAX_REJECTED_LINES:
+            self.rejected_lines.append({'line': line, 'error': str(error)[:200]})
+
+    def as_dict(self):
+        return {
+            'table': self.table,
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'rejected_lines': self.rejected_lines,
+        }
+
+
+class _CopySource:
+    """
+    Read-only file object that psycopg2 pulls ``COPY FROM STDIN`` data from.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._buffer = b''
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    def readline(self, size=-1):
+        if size < 0:
+            size = COPY_MAX_LINE_LENGTH
+        while b'\n' not in self._buffer[:size] and len(self._buffer) < size:
+            try:
+                self._buffer += next(self._chunks)
+            except StopIteration:
+                break
+        end = self._buffer.find(b'\n', 0, size)
+        return self.read(size if end < 0 else end + 1)
+
+
+def read_lines(body, max_length=COPY_MAX_LINE_LENGTH):
+    """
+    Yield the lines of a file object without ever buffering more than
+    ``max_length`` bytes of one, raising ``LineTooLong`` for a longer line.
+    """
+    for line_number, line in enumerate(iter(lambda: body.readline(max_length + 1), b''), 1):
+        if len(line.rstrip(b'\r\n')) > max_length:
+            raise LineTooLong(f"Line {line_number} is longer than {max_length} bytes.")
+        yield line
+
+
+def _ndjson_records(lines):
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, None, e
+            continue
+        if not isinstance(record, dict):
+            yield line_number, None, "Expected a JSON object."
+            continue
+        yield line_number, record, None
+
+
+def _csv_records(lines):
+    undecodable = set()
+
+    def decoded():
+        for line_number, line in enumerate(lines, 1):
+            try:
+                yield line.decode('utf-8')
+            except UnicodeDecodeError:
+                undecodable.add(line_number)
+                yield line.decode('utf-8', 'replace')
+
+    reader = csv.DictReader(decoded())
+    for record in reader:
+        # The header is line 1, so line_num already points at the data line
+        if reader.line_num in undecodable:
+            yield reader.line_num, None, "Line is not valid UTF-8."
+            continue
+        if None in record:
+            yield reader.line_num, None, "Too many values."
+            continue
+        yield reader.line_num, record, None
+
+
+def _clean_record(fields, record, sensor_ids):
+    """
+    Convert a parsed record into a row of values, raising ``ValidationError``.
+    """
+    row = []
+    for field in fields:
+        value = record.get(field.attname)
+        if value in (None, ''):
+            if not field.null:
+                raise ValidationError(f"{field.attname}: This field is required.")
+            row.append(None)
+            continue
+        try:
+            value = field.to_python(value)
+        except ValidationError as e:
+            raise ValidationError(f"{field.attname}: {e.messages[0]}")
+        if field.attname == 'time' and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        if field.attname == 'sensor_id' and value not in sensor_ids:
+            raise ValidationError("sensor_id: Invalid sensor ID.")
+        row.append(value)
+    return row
+
+
+def _copy_rows(records, fields, sensor_ids, result):
+    """
+    Validate records as they are read and yield the accepted ones as CSV.
+
+    Runs while the connection is in COPY state, so nothing here may query
+    the database.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for line_number, record, error in records:
+        if record is not None:
+            try:
+                row = _clean_record(fields, record, sensor_ids)
+            except (ValidationError, TypeError, ValueError) as e:
+                error = e.messages[0] if isinstance(e, ValidationError) else e
+        if error is not None:
+            result.reject(line_number, error)
+            continue
+        writer.writerow(row)
+        result.accept(dict(zip([field.attname for field in fields], row)))
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def copy_readings(kind, lines, fmt):
+    """
+    Stream NDJSON or CSV lines into the hypertable with ``COPY FROM STDIN``.
+
+    Records are validated one at a time while psycopg2 pulls data, so memory
+    stays bounded by the COPY buffer whatever the size of the input.
+    """
+    model = SENSOR_DATA_MODELS[kind]
+    fields = [field for field in model._meta.concrete_fields if not field.primary_key]
+    records = _ndjson_records(lines) if fmt == 'ndjson' else _csv_records(lines)
+    result = CopyResult(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    sql = f"COPY {connection.ops.quote_name(model._meta.db_table)} ({columns}) FROM STDIN WITH (FORMAT csv)"
+    sensor_ids = sensor_registry.ids()
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.copy_expert(sql, _CopySource(_copy_rows(records, fields, sensor_ids, result)))
+    if result.accepted:
+        # Backfills may be older than the refresh policies look back
+        refresh_aggregates(model._meta.db_table, result.earliest, result.newest)
+        readings_stored(kind, [model(**values) for values in result.latest.values()], result.earliest)
+    return result
@@ -0,0 +1,204 @@
+import json
+import logging
+import os
+import socket
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, close_old_connections
+from django.utils.dateparse import parse_datetime
+from redis.exceptions import ResponseError
+
+from core.models import SENSOR_DATA_MODELS
+from core.utils.redis_client import get_redis
+from .broadcast import broadcast_sensor_data
+from .ingest import insert_readings, latest_per_sensor, readings_stored
+from .payloads import SENSOR_DATA_PAYLOADS
+
+logger = logging.getLogger(__name__)
+
+
+# Append readings only while the stream has room for all of them. The flusher
+# deletes what it acknowledged, so the length counts readings not yet stored.
+# KEYS: stream. ARGV: maximum length, then one JSON reading per entry.
+_ENQUEUE_SCRIPT = """
+if redis.call('XLEN', KEYS[1]) + #ARGV - 1 > tonumber(ARGV[1]) then
+    return 0
+end
+for i = 2, #ARGV do
+    redis.call('XADD', KEYS[1], '*', 'data', ARGV[i])
+end
+return 1
+"""
+_enqueue_script = None
+
+
+class QueueFull(Exception):
+    pass
+
+
+def stream_key(kind):
+    return f"{settings.INGEST_QUEUE['STREAM_PREFIX']}{kind}"
+
+
+def _dump(data):
+    # DjangoJSONEncoder cuts times to milliseconds
+    return json.dumps({**data, 'time': data['time'].isoformat()}, cls=DjangoJSONEncoder)
+
+
+def enqueue_readings(kind, items):
+    """
+    Append validated readings to the Redis stream of their type.
+
+    Raises ``QueueFull`` without queuing any of them when the stream holds
+    ``INGEST_QUEUE['MAXLEN']`` unflushed readings, since trimming would drop
+    readings that were already accepted.
+    """
+    global _enqueue_script
+    if not items:
+        return
+    if _enqueue_script is None:
+        _enqueue_script = get_redis().register_script(_ENQUEUE_SCRIPT)
+    if not _enqueue_script(keys=[stream_key(kind)], args=[settings.INGEST_QUEUE['MAXLEN'], *map(_dump, items)]):
+        raise QueueFull(f"The {kind} ingest queue is full.")
+
+
+def queue_depth():
+    """
+    Return the length, pending and not yet delivered entries of every stream.
+    """
+    client = get_redis()
+    depth = {}
+    for kind in SENSOR_DATA_MODELS:
+        key = stream_key(kind)
+        info = {'length': client.xlen(key), 'pending': 0, 'lag': None}
+        try:
+            for group in client.xinfo_groups(key):
+                if group['name'] == settings.INGEST_QUEUE['GROUP']:
+                    info['pending'] = group['pending']
+                    info['lag'] = group.get('lag')
+        except ResponseError:
+            pass  # The stream does not exist yet
+        depth[kind] = info
+    return depth
+
+
+class IngestFlusher:
+    """
+    Drain the ingest streams into TimescaleDB in size or time bounded batches.
+
+    Entries are acknowledged only after their batch is committed, so a crash
+    between the INSERT and the XACK redelivers them (at-least-once).
+    """
+
+    def __init__(self, batch_size=None, max_wait_ms=None, claim_idle_ms=60000):
+        self.client = get_redis()
+        self.group = settings.INGEST_QUEUE['GROUP']
+        self.consumer = f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size or settings.INGEST_QUEUE['BATCH_SIZE']
+        self.max_wait_ms = max_wait_ms or settings.INGEST_QUEUE['MAX_WAIT_MS']
+        self.claim_idle_ms = claim_idle_ms
+        self.streams = {stream_key(kind): kind for kind in SENSOR_DATA_MODELS}
+
+    def setup(self):
+        for key in self.streams:
+            try:
+                self.client.xgroup_create(key, self.group, id='0', mkstream=True)
+            except ResponseError as e:
+                if 'BUSYGROUP' not in str(e):
+                    raise
+
+    def run(self):
+        self.setup()
+        self.recover()
+        last_report = time.monotonic()
+        while True:
+            failed = False
+            for key, entries in self.collect().items():
+                if entries and not self.flush(key, entries):
+                    failed = True
+            if failed:
+                self.recover()
+            if time.monotonic() - last_report >= 60:
+                self.log_depth()
+                last_report = time.monotonic()
+
+    def recover(self):
+        """
+        Flush entries left pending by this consumer or by one that died.
+        """
+        for key in self.streams:
+            # Take over entries another consumer read but never acknowledged
+            self.client.xautoclaim(
+                key, self.group, self.consumer, self.claim_idle_ms, start_id='0-0', count=self.batch_size
+            )
+            while True:
+                response = self.client.xreadgroup(self.group, self.consumer, {key: '0'}, count=self.batch_size)
+                entries = [entry for _, pending in response for entry in pending]
+                if not entries or not self.flush(key, entries):
+                    break
+        self.log_depth()
+
+    def log_depth(self):
+        for kind, info in queue_depth().items():
+            logger.info("Ingest queue %s: length=%s pending=%s", kind, info['length'], info['pending'])
+
+    def collect(self):
+        """
+        Read new entries until a batch is full or ``max_wait_ms`` has passed.
+        """
+        batches = {key: [] for key in self.streams}
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while True:
+            remaining = int((deadline - time.monotonic()) * 1000)
+            if remaining <= 0:
+                return batches
+            response = self.client.xreadgroup(
+                self.group, self.consumer, {key: '>' for key in self.streams},
+                count=self.batch_size, block=remaining,
+            )
+            for key, entries in response or []:
+                batches[key].extend(entries)
+            if any(len(entries) >= self.batch_size for entries in batches.values()):
+                return batches
+
+    def flush(self, key, entries):
+        """
+        Insert a batch, then acknowledge it. Returns ``False`` to retry later.
+        """
+        kind = self.streams[key]
+        model = SENSOR_DATA_MODELS[kind]
+        items = []
+        for _, fields in entries:
+            try:
+                data = json.loads(fields['data'])
+                data['time'] = parse_datetime(data['time'])
+                items.append(data)
+            except (KeyError, TypeError, ValueError) as e:
+                logger.error("Dropping malformed %s queue entry: %s", kind, e)
+
+        close_old_connections()
+        try:
+            instances = insert_readings(model, items)
+        except IntegrityError:
+            # One bad row fails the whole batch, so fall back to row by row
+            instances = []
+            for data in items:
+                try:
+                    instances.extend(insert_readings(model, [data]))
+                except IntegrityError as e:
+                    logger.error("Dropping %s reading for sensor %s: %s", kind, data.get('sensor_id'), e)
+        except Exception:
+            logger.exception("Could not flush %d %s readings, they will be retried", len(items), kind)
+            time.sleep(1)
+            return False
+
+        self.client.xack(key, self.group, *[entry_id for entry_id, _ in entries])
+        self.client.xdel(key, *[entry_id for entry_id, _ in entries])
+        if instances:
+            readings_stored(kind, instances)
+            payload = SENSOR_DATA_PAYLOADS[kind]
+            broadcast_sensor_data([payload(instance) for instance in latest_per_sensor(instances)])
+        logger.info("Flushed %d %s readings", len(instances), kind)
+        return True
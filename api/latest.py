@@ -0,0 +1,174 @@
+import json
+import logging
+from datetime import datetime, timezone
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.dateparse import parse_datetime
+from redis.exceptions import RedisError
+
+from core.models import SENSOR_DATA_MODELS
+from core.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Keep the newer of the stored and the given reading for every sensor.
+# KEYS: readings hash, times hash. ARGV: (sensor_id, epoch, reading) triples.
+_UPDATE_SCRIPT = """
+for i = 1, #ARGV, 3 do
+    local current = redis.call('HGET', KEYS[2], ARGV[i])
+    if not current or tonumber(current) <= tonumber(ARGV[i + 1]) then
+        redis.call('HSET', KEYS[2], ARGV[i], ARGV[i + 1])
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 2])
+    end
+end
+"""
+_update_script = None
+
+
+def _keys(kind):
+    return f"sensors:latest:{kind}", f"sensors:latest:{kind}:time"
+
+
+def _dump(instance):
+    return json.dumps(
+        {field.attname: getattr(instance, field.attname) for field in instance._meta.concrete_fields},
+        cls=DjangoJSONEncoder,
+    )
+
+
+def _load(kind, value):
+    data = json.loads(value)
+    data['time'] = parse_datetime(data['time'])
+    return SENSOR_DATA_MODELS[kind](**data)
+
+
+def record_latest(kind, instances):
+    """
+    Store the newest of ``instances`` per sensor unless a newer one is stored.
+    """
+    global _update_script
+    args = []
+    for instance in instances:
+        args.extend([instance.sensor_id, instance.time.timestamp(), _dump(instance)])
+    if not args:
+        return
+    try:
+        if _update_script is None:
+            _update_script = get_redis().register_script(_UPDATE_SCRIPT)
+        _update_script(keys=_keys(kind), args=args)
+    except RedisError as e:
+        logger.warning("Could not update latest %s readings: %s", kind, e)
+
+
+def get_latest(kind, sensor_id=None):
+    """
+    Return the latest reading of a sensor, or of any sensor of this type.
+
+    Readings are served from Redis. On a miss the hypertable is queried once
+    and the result is stored for the next caller.
+    """
+    if sensor_id is None:
+        latest = get_all_latest(kind).values()
+        return max(latest, key=lambda instance: instance.time, default=None)
+
+    readings_key, _ = _keys(kind)
+    try:
+        value = get_redis().hget(readings_key, sensor_id)
+        if value is not None:
+            return _load(kind, value)
+    except RedisError as e:
+        logger.warning("Could not read latest %s readings: %s", kind, e)
+
+    instance = SENSOR_DATA_MODELS[kind].objects.filter(sensor_id=sensor_id).order_by('-time').first()
+    if instance is not None:
+        record_latest(kind, [instance])
+    return instance
+
+
+def get_all_latest(kind):
+    """
+    Return ``{sensor_id: reading}`` with the latest reading of every sensor.
+
+    The hash only answers once it has been filled from the hypertable, since
+    before that it may hold just the sensors that reported since startup.
+    """
+    readings_key, _ = _keys(kind)
+    warm_key = f"{readings_key}:warm"
+    try:
+        client = get_redis()
+        if client.exists(warm_key):
+            values = client.hgetall(readings_key)
+            return {int(sensor_id): _load(kind, value) for sensor_id, value in values.items()}
+    except RedisError as e:
+        logger.warning("Could not read latest %s readings: %s", kind, e)
+
+    instances = list(SENSOR_DATA_MODELS[kind].objects.order_by('sensor_id', '-time').distinct('sensor_id'))
+    warm_latest(kind, instances)
+    return {instance.sensor_id: instance for instance in instances}
+
+
+def warm_latest(kind, instances):
+    """
+    Store the latest reading of every sensor and mark the hash as complete.
+    """
+    record_latest(kind, instances)
+    try:
+        get_redis().set(f"{_keys(kind)[0]}:warm", 1)
+    except RedisError:
+        pass
+
+
+def latest_times(kinds, sensor_id=None):
+    """
+    Return the newest stored reading time of every type in ``kinds``, for one
+    sensor or for all sensors of the type, in one round trip.
+
+    ``None`` is returned when the store cannot tell, i.e. on Redis errors,
+    for a sensor not stored yet or for a type whose hash is not complete.
+    """
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        for kind in kinds:
+            readings_key, times_key = _keys(kind)
+            if sensor_id is None:
+                pipeline.exists(f"{readings_key}:warm")
+                pipeline.hvals(times_key)
+            else:
+                pipeline.hget(times_key, sensor_id)
+        results = pipeline.execute()
+    except RedisError as e:
+        logger.warning("Could not read latest reading times: %s", e)
+        return None
+
+    if sensor_id is None:
+        epochs = []
+        for warm, values in zip(results[::2], results[1::2]):
+            if not warm or not values:
+                return None
+            epochs.append(max(float(value) for value in values))
+    else:
+        if None in results:
+            return None
+        epochs = [float(value) for value in results]
+    return [datetime.fromtimestamp(epoch, tz=timezone.utc) for epoch in epochs]
+
+
+def stored_sensor_ids(kinds):
+    """
+    Return ``{kind: sensor ids}`` of the sensors with readings of every type
+    in ``kinds``, or ``None`` for a type whose hash is not complete.
+    """
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        for kind in kinds:
+            readings_key, times_key = _keys(kind)
+            pipeline.exists(f"{readings_key}:warm")
+            pipeline.hkeys(times_key)
+        results = pipeline.execute()
+    except RedisError as e:
+        logger.warning("Could not read latest sensor ids: %s", e)
+        return dict.fromkeys(kinds)
+    return {
+        kind: [int(sensor_id) for sensor_id in ids] if warm else None
+        for kind, warm, ids in zip(kinds, results[::2], results[1::2])
+    }
@@ -0,0 +1,108 @@
+import asyncio
+import statistics
+import time
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import DEFAULT_CHANNEL_LAYER, channel_layers
+from channels.testing import WebsocketCommunicator
+from channels_redis.core import RedisChannelLayer
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from api.broadcast import ALL_SENSORS_GROUP, encode_frame
+from api.consumers import SensorsDataConsumer, stats
+from api.payloads import air_payload
+from core.models import SensorDataAir
+
+BENCHMARK_PREFIX = 'asgi-benchmark'
+
+
+class Command(BaseCommand):
+    help = (
+        "Time one broadcast from group_send through the Redis channel layer to every connected consumer, "
+        "when every consumer encodes the readings itself and when the broadcaster sends a pre-encoded frame. "
+        "The consumers use a channel layer with its own prefix, so live sockets never see the benchmark."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=1000, help="Connected sockets.")
+        parser.add_argument('--readings', type=int, default=20, help="Readings per broadcast.")
+        parser.add_argument('--rounds', type=int, default=20, help="Broadcasts measured.")
+
+    def handle(self, *args, **options):
+        config = settings.CHANNEL_LAYERS[DEFAULT_CHANNEL_LAYER]
+        if config['BACKEND'] != 'channels_redis.core.RedisChannelLayer':
+            raise CommandError("The benchmark needs the Redis channel layer.")
+        layer = RedisChannelLayer(**{**config.get('CONFIG', {}), 'prefix': BENCHMARK_PREFIX})
+        previous = channel_layers.set(DEFAULT_CHANNEL_LAYER, layer)
+        try:
+            async_to_sync(self.benchmark)(layer, options)
+        finally:
+            channel_layers.set(DEFAULT_CHANNEL_LAYER, previous)
+            # The benchmark's forwards are not real traffic
+            stats.clear()
+
+    async def benchmark(self, layer, options):
+        now = timezone.now()
+        data = [
+            air_payload(SensorDataAir(
+                sensor_id=i, time=now - timedelta(seconds=i), temperature=21.5, humidity=48.25,
+                pressure=1013.2, p1=12.4, p2=7.9, signal=-67,
+            ))
+            for i in range(options['readings'])
+        ]
+        messages = {
+            # Publishers from before pre-encoded frames, every consumer encodes the readings
+            'per-socket encoding': {'type': 'sensor_batch', 'data': data},
+            'pre-encoded frame': {
+                'type': 'sensor_frame', 'group': ALL_SENSORS_GROUP, 'seq': None,
+                'text': encode_frame({'event': 'delta', 'group': ALL_SENSORS_GROUP, 'seq': None, 'readings': data}),
+            },
+        }
+
+        # Real consumers, each joined to the all-sensors group of the benchmark layer
+        application = SensorsDataConsumer.as_asgi()
+        communicators = [WebsocketCommunicator(application, '/ws/sensor_data/') for _ in range(options['sockets'])]
+        await asyncio.gather(*(communicator.connect(timeout=30) for communicator in communicators))
+        # The snapshot
+        await asyncio.gather(*(communicator.receive_from(timeout=30) for communicator in communicators))
+        try:
+            results = {}
+            for name, message in messages.items():
+                latencies = []
+                started = time.process_time()
+                for _ in range(options['rounds']):
+                    latencies.extend(await self.broadcast(layer, communicators, message))
+                results[name] = (time.process_time() - started) * 1000 / options['rounds']
+                p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+                self.stdout.write(
+                    f"{name:<20} {results[name]:8.2f} ms CPU per broadcast to {options['sockets']} sockets, "
+                    f"delivered p50 {statistics.median(latencies):.2f} ms, p95 {p95:.2f} ms,"
+                    f" max {max(latencies):.2f} ms"
+                )
+        finally:
+            await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+            await layer.flush()
+
+        before, after = results.values()
+        saved = (1 - after / before) * 100 if before else 0
+        self.stdout.write(f"saved {before - after:.2f} ms CPU per broadcast ({saved:.0f}%)")
+
+    async def broadcast(self, layer, communicators, message):
+        """
+        Send ``message`` to the group and return the milliseconds until each
+        socket had the frame.
+        """
+        started = time.perf_counter()
+
+        async def delivered(communicator):
+            # Heartbeats of a long run may arrive in between
+            while '"delta"' not in await communicator.receive_from(timeout=30):
+                pass
+            return (time.perf_counter() - started) * 1000
+
+        waiting = [asyncio.create_task(delivered(communicator)) for communicator in communicators]
+        await layer.group_send(ALL_SENSORS_GROUP, message)
+        return await asyncio.gather(*waiting)
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api.ingest_queue import IngestFlusher
+
+
+class Command(BaseCommand):
+    help = "Drain the write-behind ingest queue into TimescaleDB and broadcast the readings."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help="Maximum readings per INSERT.")
+        parser.add_argument('--max-wait-ms', type=int, help="Maximum time to wait for a batch to fill.")
+
+    def handle(self, *args, **options):
+        flusher = IngestFlusher(batch_size=options['batch_size'], max_wait_ms=options['max_wait_ms'])
+        self.stdout.write(f"Flushing ingest queue as consumer {flusher.consumer}")
+        try:
+            flusher.run()
+        except KeyboardInterrupt:
+            self.stdout.write("Flusher stopped")
@@ -0,0 +1,73 @@
+import base64
+import binascii
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class TimeKeysetPagination(PageNumberPagination):
+    """
+    Page number pagination with an opt-in ``(time, id)`` keyset mode.
+
+    Passing ``?cursor=`` (empty for the first page) switches to keyset mode:
+    there is no ``COUNT(*)`` and every page is an index range scan starting
+    at the cursor, so deep pages cost the same as the first one.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by('-time', '-id')
+        position = self.decode_cursor(request.query_params[self.cursor_query_param])
+        if position is not None:
+            time, pk = position
+            # The plain upper bound on time lets TimescaleDB exclude chunks
+            queryset = queryset.filter(Q(time__lt=time) | Q(time=time, id__lt=pk), time__lte=time)
+
+        rows = list(queryset[:page_size + 1])
+        page = rows[:page_size]
+        self.next_position = (page[-1].time, page[-1].pk) if len(rows) > page_size else None
+        return page
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def encode_cursor(self, position):
+        time, pk = position
+        return base64.urlsafe_b64encode(f"{time.isoformat()}|{pk}".encode()).decode()
+
+    def decode_cursor(self, encoded):
+        if not encoded:
+            return None
+        try:
+            time, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            time = parse_datetime(time)
+            pk = int(pk)
+        except (TypeError, ValueError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if time is None:
+            raise NotFound(self.invalid_cursor_message)
+        return time, pk
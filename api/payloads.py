@@ -0,0 +1,41 @@
+def temp_payload(instance):
+    return {
+        'sensor_id': instance.sensor_id,
+        'type': 'temperature',
+        'temperature': instance.temperature,
+        'humidity': instance.humidity,
+        'pressure': instance.pressure,
+        'time': instance.time.isoformat(),
+    }
+
+
+def air_payload(instance):
+    return {
+        'sensor_id': instance.sensor_id,
+        'type': 'air',
+        'pm10': instance.p1,
+        'pm25': instance.p2,
+        'temperature': instance.temperature,
+        'humidity': instance.humidity,
+        'pressure': instance.pressure,
+        'signal': instance.signal,
+        'time': instance.time.isoformat(),
+    }
+
+
+def indoor_payload(instance):
+    return {
+        'sensor_id': instance.sensor_id,
+        'type': 'indoor',
+        'aqi': instance.aqi,
+        'tvoc': instance.tvoc,
+        'eco2': instance.eco2,
+        'time': instance.time.isoformat(),
+    }
+
+
+SENSOR_DATA_PAYLOADS = {
+    'temperature': temp_payload,
+    'air': air_payload,
+    'indoor': indoor_payload,
+}
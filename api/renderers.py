@@ -0,0 +1,75 @@
+import msgpack
+from django.http import HttpResponse, JsonResponse
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+COLUMNAR_MEDIA_TYPE = 'application/vnd.sensors.columnar+json'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+
+def to_columns(data):
+    """
+    Turn a list of rows into ``{key: [values...]}``.
+
+    Paginated responses keep their envelope with ``results`` converted, and
+    anything that is not a list of dicts (errors, single objects) is returned
+    unchanged.
+    """
+    if isinstance(data, dict) and isinstance(data.get('results'), list):
+        return {**data, 'results': to_columns(data['results'])}
+    if not isinstance(data, list) or not all(isinstance(row, dict) for row in data):
+        return data
+    keys = list(data[0]) if data else []
+    return {key: [row.get(key) for row in data] for key in keys}
+
+
+class ColumnarJSONRenderer(JSONRenderer):
+    """
+    JSON with one array per field instead of one object per row.
+    """
+    media_type = COLUMNAR_MEDIA_TYPE
+    format = 'columnar'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return super().render(to_columns(data), accepted_media_type, renderer_context)
+
+
+class MessagePackRenderer(BaseRenderer):
+    """
+    Columnar layout encoded as MessagePack for machine consumers.
+    """
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return msgpack.packb(to_columns(data), use_bin_type=True)
+
+
+def response_format(request):
+    """
+    Pick ``json``, ``columnar`` or ``msgpack`` from ``?format=`` or Accept.
+    """
+    fmt = request.GET.get('format')
+    if fmt in ('json', 'columnar', 'msgpack'):
+        return fmt
+    accept = request.headers.get('Accept', '')
+    if MSGPACK_MEDIA_TYPE in accept:
+        return 'msgpack'
+    if COLUMNAR_MEDIA_TYPE in accept:
+        return 'columnar'
+    return 'json'
+
+
+def rows_response(request, rows):
+    """
+    Render a list of row dicts for plain Django views in the negotiated format.
+    """
+    fmt = response_format(request)
+    if fmt == 'msgpack':
+        return HttpResponse(msgpack.packb(to_columns(rows), use_bin_type=True), content_type=MSGPACK_MEDIA_TYPE)
+    if fmt == 'columnar':
+        return JsonResponse(to_columns(rows), content_type=COLUMNAR_MEDIA_TYPE)
+    return JsonResponse(rows, safe=False)
@@ -1,6 +1,19 @@
 from rest_framework import serializers
 
 from core.models import Sensor, SensorDataTemp, SensorDataAir, SensorDataIndoor
+from core.registry import sensor_registry
+
+
+class DynamicFieldsMixin:
+    """
+    Restrict the serialized output to the names given in ``fields``.
+    """
+
+    def __init__(self, *args, fields=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
 
 
 class SensorSerializer(serializers.ModelSerializer):
@@ -10,7 +23,7 @@ class SensorSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class SensorDataTempSerializer(serializers.ModelSerializer):
+class SensorDataTempSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     sensor_id = serializers.IntegerField(write_only=True)
 
     class Meta:
@@ -18,16 +31,12 @@ class SensorDataTempSerializer(serializers.ModelSerializer):
         fields = ['time', 'sensor_id', 'temperature', 'humidity', 'pressure']
 
     def create(self, validated_data):
-        sensor_id = validated_data.pop('sensor_id')
-        try:
-            sensor = Sensor.objects.get(id=sensor_id)
-        except Sensor.DoesNotExist:
+        if validated_data['sensor_id'] not in sensor_registry:
             raise serializers.ValidationError({"sensor_id": "Invalid sensor ID."})
-        validated_data['sensor'] = sensor
         return SensorDataTemp.objects.create(**validated_data)
 
 
-class SensorDataAirSerializer(serializers.ModelSerializer):
+class SensorDataAirSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     sensor_id = serializers.IntegerField(write_only=True)
 
     class Meta:
@@ -35,16 +44,12 @@ class SensorDataAirSerializer(serializers.ModelSerializer):
         fields = ['time', 'sensor_id', 'temperature', 'humidity', 'pressure', 'p1', 'p2', 'signal']
 
     def create(self, validated_data):
-        sensor_id = validated_data.pop('sensor_id')
-        try:
-            sensor = Sensor.objects.get(id=sensor_id)
-        except Sensor.DoesNotExist:
+        if validated_data['sensor_id'] not in sensor_registry:
             raise serializers.ValidationError({"sensor_id": "Invalid sensor ID."})
-        validated_data['sensor'] = sensor
         return SensorDataAir.objects.create(**validated_data)
 
 
-class SensorDataIndoorSerializer(serializers.ModelSerializer):
+class SensorDataIndoorSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     sensor_id = serializers.IntegerField(write_only=True)
 
     class Meta:
@@ -52,10 +57,6 @@ class SensorDataIndoorSerializer(serializers.ModelSerializer):
         fields = ['time', 'sensor_id', 'aqi', 'tvoc', 'eco2']
 
     def create(self, validated_data):
-        sensor_id = validated_data.pop('sensor_id')
-        try:
-            sensor = Sensor.objects.get(id=sensor_id)
-        except Sensor.DoesNotExist:
+        if validated_data['sensor_id'] not in sensor_registry:
             raise serializers.ValidationError({"sensor_id": "Invalid sensor ID."})
-        validated_data['sensor'] = sensor
         return SensorDataIndoor.objects.create(**validated_data)
@@ -0,0 +1,145 @@
+import json
+import logging
+
+from django.core.cache import cache
+from django.db import connection
+from django.utils.dateparse import parse_datetime
+
+from core.models import SENSOR_DATA_MODELS
+from .conditional import content_etag
+from .history import HISTORY_SERIES
+from .latest import stored_sensor_ids, warm_latest
+from .payloads import SENSOR_DATA_PAYLOADS
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_HISTORY = 60  # Readings per sensor for the initial charts
+SNAPSHOT_CACHE_TTL = 60  # Bounds a snapshot built concurrently with an ingest
+SNAPSHOT_KEY = 'snapshot:home:v2'
+SNAPSHOT_LATEST_KEY = 'snapshot:latest:v2'
+
+# Dashboard keys of every series in HISTORY_SERIES: latest reading and history
+DASHBOARD_KEYS = {
+    'outdoor': ('outdoorSensor', 'outdoorHistory'),
+    'indoor': ('indoorSensor', 'indoorHistory'),
+    'temp1': ('tempSensor1', 'temp1History'),
+    'temp2': ('tempSensor2', 'temp2History'),
+}
+
+
+def recent_readings(limit=SNAPSHOT_HISTORY):
+    """
+    Return ``{kind: {sensor_id: [reading, ...]}}``, newest first, in one query.
+
+    Every sensor with readings of a type, as listed by the latest store, gets
+    a LATERAL index scan of its newest ``limit`` readings in that hypertable;
+    while the store is cold every registered sensor is probed. Rows come back
+    as JSON so the three tables can share one UNION ALL.
+    """
+    selects = []
+    params = []
+    for kind, sensor_ids in stored_sensor_ids(list(SENSOR_DATA_MODELS)).items():
+        if sensor_ids == []:
+            continue
+        if sensor_ids is None:
+            sensors = "sensors s"
+            params.append(kind)
+        else:
+            sensors = "unnest(%s::bigint[]) AS s(id)"
+            params.extend([kind, sensor_ids])
+        params.append(limit)
+        selects.append(f"""
+            SELECT %s, row_to_json(d)::text
+            FROM {sensors}
+            CROSS JOIN LATERAL (
+                SELECT * FROM {SENSOR_DATA_MODELS[kind]._meta.db_table}
+                WHERE sensor_id = s.id
+                ORDER BY time DESC
+                LIMIT %s
+            ) d
+        """)
+
+    readings = {kind: {} for kind in SENSOR_DATA_MODELS}
+    if not selects:
+        return readings
+    with connection.cursor() as cursor:
+        cursor.execute(' UNION ALL '.join(selects), params)
+        for kind, value in cursor.fetchall():
+            data = json.loads(value)
+            data['time'] = parse_datetime(data['time'])
+            instance = SENSOR_DATA_MODELS[kind](**data)
+            readings[kind].setdefault(instance.sensor_id, []).append(instance)
+    for sensors in readings.values():
+        for instances in sensors.values():
+            instances.sort(key=lambda instance: instance.time, reverse=True)
+    return readings
+
+
+def build_snapshot():
+    """
+    Return the dashboard's initial data and the latest reading of every sensor.
+    """
+    readings = recent_readings()
+    for kind, by_sensor in readings.items():
+        warm_latest(kind, [instances[0] for instances in by_sensor.values()])
+
+    dashboard = {}
+    for series, (kind, sensor_id) in HISTORY_SERIES.items():
+        sensors = readings[kind]
+        if sensor_id is None:
+            instances = sorted(
+                (instance for instances in sensors.values() for instance in instances),
+                key=lambda instance: instance.time,
+                reverse=True,
+            )[:SNAPSHOT_HISTORY]
+        else:
+            instances = sensors.get(sensor_id, [])
+        latest_key, history_key = DASHBOARD_KEYS[series]
+        payload = SENSOR_DATA_PAYLOADS[kind]
+        dashboard[latest_key] = payload(instances[0]) if instances else None
+        dashboard[history_key] = [payload(instance) for instance in reversed(instances)]
+
+    sensors = {
+        kind: [SENSOR_DATA_PAYLOADS[kind](instances[0]) for _, instances in sorted(by_sensor.items())]
+        for kind, by_sensor in readings.items()
+    }
+    latest = {latest_key: dashboard[latest_key] for latest_key, _ in DASHBOARD_KEYS.values()}
+    return {**dashboard, 'sensors': sensors}, {**latest, 'sensors': sensors}
+
+
+def _entry(data):
+    # Validators are stored with the body they describe; derived from the
+    # latest store, a snapshot cached by a build that raced an ingest would
+    # be revalidated as current until it expired
+    body = json.dumps(data)
+    times = [reading['time'] for readings in data['sensors'].values() for reading in readings]
+    last_modified = int(max(map(parse_datetime, times)).timestamp()) if times else None
+    return body, content_etag(body), last_modified
+
+
+def cached_snapshot(key):
+    """
+    Return ``(body, etag, last_modified)`` of the serialized snapshot stored
+    under ``key``, building it on a miss.
+    """
+    try:
+        value = cache.get(key)
+        if value is not None:
+            return value
+    except Exception as e:
+        logger.warning("Snapshot cache read failed: %s", e)
+
+    initial, latest = build_snapshot()
+    values = {SNAPSHOT_KEY: _entry(initial), SNAPSHOT_LATEST_KEY: _entry(latest)}
+    try:
+        cache.set_many(values, SNAPSHOT_CACHE_TTL)
+    except Exception as e:
+        logger.warning("Snapshot cache write failed: %s", e)
+    return values[key]
+
+
+def invalidate_snapshot():
+    try:
+        cache.delete_many([SNAPSHOT_KEY, SNAPSHOT_LATEST_KEY])
+    except Exception as e:
+        logger.warning("Snapshot cache invalidation failed: %s", e)
@@ -1 +1,1583 @@
-# Create your tests here.
+import asyncio
+import gzip
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+from urllib.parse import quote
+
+import msgpack
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APITestCase, APITransactionTestCase
+
+from core.models import Sensor, SensorDataAir, SensorDataTemp
+from core.registry import sensor_registry
+from core.timescale import bucket_start, interval_seconds, pick_aggregate
+from core.utils.redis_client import get_redis
+from . import broadcast, consumers, export, history, views
+from .broadcast import broadcast_sensor_data, replay_frames
+from .downsample import lttb, lttb_indices
+from .ingest import COPY_MAX_LINE_LENGTH
+from .ingest_queue import IngestFlusher, stream_key
+from .latest import get_all_latest, get_latest, stored_sensor_ids
+from .pagination import TimeKeysetPagination
+from .renderers import COLUMNAR_MEDIA_TYPE, MSGPACK_MEDIA_TYPE, response_format, to_columns
+from .snapshot import build_snapshot, recent_readings
+from .views import MAX_BULK_ITEMS
+from .weather import CachedProxy, CircuitBreaker, UpstreamError
+
+# Keep the tests off the shared cache and channel layer
+TEST_SETTINGS = {
+    'CACHES': {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+}
+
+
+class RedisKeysMixin:
+    """
+    Drop the Redis keys the tests write to before and after every test.
+    """
+    redis_patterns = ['sensors:latest:*', 'sensors:seq:*', 'sensors:replay:*']
+
+    def setUp(self):
+        super().setUp()
+        self._clear_redis()
+        self.addCleanup(self._clear_redis)
+
+    def _clear_redis(self):
+        client = get_redis()
+        for pattern in self.redis_patterns:
+            keys = list(client.scan_iter(pattern))
+            if keys:
+                client.delete(*keys)
+
+
+def temp_reading(sensor_id, time, temperature=20.0):
+    return {'time': time.isoformat(), 'sensor_id': sensor_id, 'temperature': temperature, 'humidity': 50.0}
+
+
+@override_settings(**TEST_SETTINGS)
+class BulkIngestTests(RedisKeysMixin, APITestCase):
+    url = '/api/sensors/temperature/data/'
+
+    def setUp(self):
+        super().setUp()
+        self.sensor = Sensor.objects.create(type='temperature', name='bme280')
+        self.now = timezone.now()
+
+    def test_array_of_valid_readings_is_created(self):
+        response = self.client.post(self.url, [
+            temp_reading(self.sensor.id, self.now - timedelta(minutes=1)),
+            temp_reading(self.sensor.id, self.now),
+        ], format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'created': 2, 'errors': []})
+        self.assertEqual(SensorDataTemp.objects.count(), 2)
+
+    def test_rejected_readings_are_reported_by_index(self):
+        response = self.client.post(self.url, [
+            temp_reading(self.sensor.id, self.now),
+            temp_reading(999999, self.now),
+            {'time': self.now.isoformat(), 'sensor_id': self.sensor.id},
+        ], format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1, 2])
+        self.assertIn('sensor_id', response.data['errors'][0]['errors'])
+        self.assertIn('temperature', response.data['errors'][1]['errors'])
+        self.assertEqual(SensorDataTemp.objects.count(), 1)
+
+    def test_array_without_valid_readings_is_rejected(self):
+        response = self.client.post(self.url, [temp_reading(999999, self.now)], format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['created'], 0)
+        self.assertFalse(SensorDataTemp.objects.exists())
+
+    def test_too_many_readings_are_rejected(self):
+        response = self.client.post(
+            self.url, [temp_reading(self.sensor.id, self.now)] * (MAX_BULK_ITEMS + 1), format='json'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(SensorDataTemp.objects.exists())
+
+    def test_single_reading_is_still_accepted(self):
+        response = self.client.post(self.url, temp_reading(self.sensor.id, self.now), format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(SensorDataTemp.objects.count(), 1)
+
+    def test_newest_reading_per_sensor_is_broadcast_once(self):
+        channel_layer = get_channel_layer()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)('sensors', channel)
+
+        self.client.post(self.url, [
+            temp_reading(self.sensor.id, self.now, temperature=21.0),
+            temp_reading(self.sensor.id, self.now - timedelta(minutes=1), temperature=20.0),
+        ], format='json')
+
+        message = async_to_sync(channel_layer.receive)(channel)
+        self.assertEqual(message['type'], 'sensor_batch')
+        self.assertEqual([reading['temperature'] for reading in message['data']], [21.0])
+
+
+@override_settings(**TEST_SETTINGS)
+class CopyIngestTests(RedisKeysMixin, APITransactionTestCase):
+    # COPY ingests refresh the continuous aggregates, which cannot run in a transaction
+    url = '/api/sensors/temperature/data/copy/'
+
+    def setUp(self):
+        super().setUp()
+        self.sensor = Sensor.objects.create(type='temperature', name='bme280')
+        sensor_registry.invalidate()
+
+    def post(self, body, content_type, url=None):
+        return self.client.generic('POST', url or self.url, body, content_type=content_type)
+
+    def test_csv_lines_are_rejected_one_by_one(self):
+        body = (
+            "time,sensor_id,temperature,humidity,pressure\n"
+            f"2026-01-01T00:00:00Z,{self.sensor.id},20.5,40,1013\n"
+            "2026-01-01T00:01:00Z,999999,20.5,40,1013\n"
+            f"2026-01-01T00:02:00Z,{self.sensor.id},warm,40,1013\n"
+            f"2026-01-01T00:03:00Z,{self.sensor.id},20.5,,1013\n"
+            f"2026-01-01T00:04:00Z,{self.sensor.id},20.5,40,1013,1\n"
+            f"2026-01-01T00:05:00Z,{self.sensor.id},21.5,41,\n"
+        ).encode() + f"2026-01-01T00:06:00Z,{self.sensor.id},20.5,40,\xff\n".encode('latin-1')
+
+        response = self.post(body, 'text/csv')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['accepted'], 2)
+        self.assertEqual(response.data['rejected'], 5)
+        errors = {line['line']: line['error'] for line in response.data['rejected_lines']}
+        self.assertEqual(set(errors), {3, 4, 5, 6, 8})
+        self.assertEqual(errors[3], "sensor_id: Invalid sensor ID.")
+        self.assertTrue(errors[4].startswith("temperature:"))
+        self.assertEqual(errors[5], "humidity: This field is required.")
+        self.assertEqual(errors[6], "Too many values.")
+        self.assertEqual(errors[8], "Line is not valid UTF-8.")
+        self.assertEqual(
+            sorted(SensorDataTemp.objects.values_list('temperature', 'pressure')), [(20.5, 1013.0), (21.5, None)]
+        )
+
+    def test_ndjson_lines_are_rejected_one_by_one(self):
+        body = "\n".join([
+            json.dumps(temp_reading(self.sensor.id, datetime(2026, 1, 1, tzinfo=dt_timezone.utc))),
+            '{"time": ',
+            '[1, 2]',
+        ]).encode()
+
+        response = self.post(body, 'application/x-ndjson')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['accepted'], 1)
+        self.assertEqual([line['line'] for line in response.data['rejected_lines']], [2, 3])
+        self.assertEqual(response.data['rejected_lines'][1]['error'], "Expected a JSON object.")
+
+    def test_body_without_valid_lines_is_rejected(self):
+        body = f"time,sensor_id,temperature,humidity\n2026-01-01T00:00:00Z,{self.sensor.id},warm,1\n".encode()
+
+        response = self.post(body, 'text/csv')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['accepted'], 0)
+        self.assertFalse(SensorDataTemp.objects.exists())
+
+    def test_overlong_line_rejects_the_whole_body(self):
+        body = (
+            f"time,sensor_id,temperature,humidity\n2026-01-01T00:00:00Z,{self.sensor.id},20.5,40\n"
+            + "x" * (COPY_MAX_LINE_LENGTH + 1) + "\n"
+        ).encode()
+
+        response = self.post(body, 'text/csv')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['error'], f"Line 3 is longer than {COPY_MAX_LINE_LENGTH} bytes.")
+        self.assertFalse(SensorDataTemp.objects.exists())
+
+    def test_unsupported_content_type_is_rejected(self):
+        self.assertEqual(self.post(b"{}", 'application/json').status_code, 415)
+
+    def test_unknown_type_is_not_found(self):
+        response = self.post(b"", 'text/csv', url='/api/sensors/wind/data/copy/')
+
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(**TEST_SETTINGS, INGEST_QUEUE={**settings.INGEST_QUEUE, 'STREAM_PREFIX': 'test:ingest:'})
+class IngestQueueTests(RedisKeysMixin, APITransactionTestCase):
+    # The flusher commits its batches, and foreign keys are only checked on commit
+    url = '/api/sensors/temperature/data/'
+
+    def setUp(self):
+        super().setUp()
+        self.sensor = Sensor.objects.create(type='temperature', name='bme280')
+        self.now = timezone.now()
+        self.redis = get_redis()
+        self.key = stream_key('temperature')
+        self.redis.delete(*[stream_key(kind) for kind in ('temperature', 'air', 'indoor')])
+        self.addCleanup(self.redis.delete, *[stream_key(kind) for kind in ('temperature', 'air', 'indoor')])
+
+    def enqueue(self, *readings):
+        with self.settings(INGEST_MODE='queue'):
+            return self.client.post(self.url, list(readings), format='json')
+
+    def pending(self):
+        return self.redis.xpending(self.key, settings.INGEST_QUEUE['GROUP'])['pending']
+
+    def test_queued_readings_are_accepted_without_a_database_write(self):
+        response = self.enqueue(temp_reading(self.sensor.id, self.now), temp_reading(999999, self.now))
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['queued'], 1)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertEqual(self.redis.xlen(self.key), 1)
+        self.assertFalse(SensorDataTemp.objects.exists())
+
+    def test_flushed_batches_are_stored_then_acknowledged(self):
+        self.enqueue(temp_reading(self.sensor.id, self.now), temp_reading(self.sensor.id, self.now))
+        flusher = IngestFlusher(batch_size=10, max_wait_ms=100)
+        flusher.setup()
+
+        entries = flusher.collect()[self.key]
+        self.assertEqual(self.pending(), 2)
+        self.assertTrue(flusher.flush(self.key, entries))
+
+        self.assertEqual(SensorDataTemp.objects.count(), 2)
+        self.assertEqual(self.pending(), 0)
+        self.assertEqual(self.redis.xlen(self.key), 0)
+
+    def test_entries_of_a_dead_consumer_are_claimed(self):
+        self.enqueue(temp_reading(self.sensor.id, self.now))
+        flusher = IngestFlusher(batch_size=10, max_wait_ms=100, claim_idle_ms=0)
+        flusher.setup()
+        # Another flusher read the entry and died before acknowledging it
+        self.redis.xreadgroup(settings.INGEST_QUEUE['GROUP'], 'dead', {self.key: '>'})
+
+        flusher.recover()
+
+        self.assertEqual(SensorDataTemp.objects.count(), 1)
+        self.assertEqual(self.pending(), 0)
+
+    def test_batch_with_a_bad_row_is_stored_row_by_row(self):
+        flusher = IngestFlusher(batch_size=10, max_wait_ms=100)
+        flusher.setup()
+        # The middle reading belongs to a sensor deleted after it was queued
+        for sensor_id in (self.sensor.id, 999999, self.sensor.id):
+            self.redis.xadd(self.key, {'data': json.dumps(temp_reading(sensor_id, self.now))})
+
+        self.assertTrue(flusher.flush(self.key, flusher.collect()[self.key]))
+
+        self.assertEqual(SensorDataTemp.objects.count(), 2)
+        self.assertEqual(self.pending(), 0)
+
+    def test_full_queue_rejects_the_whole_request(self):
+        with self.settings(INGEST_QUEUE={**settings.INGEST_QUEUE, 'STREAM_PREFIX': 'test:ingest:', 'MAXLEN': 2}):
+            self.assertEqual(self.enqueue(temp_reading(self.sensor.id, self.now)).status_code, 202)
+            response = self.enqueue(*[temp_reading(self.sensor.id, self.now)] * 2)
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.headers['Retry-After'], str(settings.INGEST_QUEUE['RETRY_AFTER']))
+        self.assertEqual(self.redis.xlen(self.key), 1)
+
+    def test_queued_times_keep_their_precision(self):
+        time = self.now.replace(microsecond=123456)
+        self.enqueue(temp_reading(self.sensor.id, time))
+        flusher = IngestFlusher(batch_size=10, max_wait_ms=100)
+        flusher.setup()
+
+        flusher.flush(self.key, flusher.collect()[self.key])
+
+        self.assertEqual(SensorDataTemp.objects.get().time, time)
+
+    def test_queue_status_reports_every_stream(self):
+        self.enqueue(temp_reading(self.sensor.id, self.now))
+
+        response = self.client.get('/api/ingest/queue/')
+
+        self.assertEqual(response.data['queues']['temperature']['length'], 1)
+        self.assertEqual(set(response.data['queues']), {'temperature', 'air', 'indoor'})
+
+
+@mock.patch.object(TimeKeysetPagination, 'page_size', 2)
+class KeysetPaginationTests(APITestCase):
+    url = '/api/sensors/temperature/data/'
+
+    def setUp(self):
+        super().setUp()
+        sensor = Sensor.objects.create(type='temperature', name='bme280')
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        # Two readings share a time, so pages must break ties on the id
+        minutes = [0, 1, 1, 2, 3]
+        SensorDataTemp.objects.bulk_create([
+            SensorDataTemp(sensor=sensor, time=start + timedelta(minutes=minute), temperature=float(i), humidity=50.0)
+            for i, minute in enumerate(minutes)
+        ])
+
+    def test_cursor_pages_walk_every_reading_once(self):
+        temperatures = []
+        url = self.url + '?cursor='
+        pages = 0
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(set(response.data), {'next', 'results'})
+            temperatures += [row['temperature'] for row in response.data['results']]
+            url = response.data['next']
+            pages += 1
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(temperatures, [4.0, 3.0, 2.0, 1.0, 0.0])
+
+    def test_page_numbers_remain_the_default(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.data['count'], 5)
+        self.assertEqual([row['temperature'] for row in response.data['results']], [4.0, 3.0])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get(self.url + '?cursor=not-a-cursor')
+
+        self.assertEqual(response.status_code, 404)
+
+
+class ReadingFilterTests(APITestCase):
+    url = '/api/sensors/temperature/data/'
+
+    def setUp(self):
+        super().setUp()
+        self.sensors = [Sensor.objects.create(type='temperature', name=name) for name in ('bme280', 'am2302')]
+        self.start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        SensorDataTemp.objects.bulk_create([
+            SensorDataTemp(
+                sensor=sensor, time=self.start + timedelta(hours=hour), temperature=float(hour), humidity=50.0,
+                pressure=1013.0,
+            )
+            for sensor in self.sensors for hour in range(3)
+        ])
+
+    def get(self, **params):
+        return self.client.get(self.url, params)
+
+    def test_sensor_and_time_range_filters(self):
+        response = self.get(
+            sensor_id=self.sensors[0].id, start='2026-01-01T01:00:00Z', end='2026-01-01T02:00:00Z'
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([row['temperature'] for row in response.data['results']], [1.0])
+
+    def test_naive_times_use_the_current_timezone(self):
+        with self.settings(TIME_ZONE='UTC'):
+            response = self.get(sensor_id=self.sensors[1].id, start='2026-01-01T02:00')
+
+        self.assertEqual([row['temperature'] for row in response.data['results']], [2.0])
+
+    def test_fields_limit_the_response(self):
+        response = self.get(fields='temperature')
+
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual(set(response.data['results'][0]), {'time', 'temperature'})
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in (
+            {'fields': 'temperature,wind'},
+            {'sensor_id': 'first'},
+            {'start': 'yesterday'},
+            {'start': '2026-01-02T00:00:00Z', 'end': '2026-01-01T00:00:00Z'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS)
+class LatestStoreTests(RedisKeysMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.sensor = Sensor.objects.create(type='temperature', name='bme280')
+        self.url = f'/api/sensors/temperature/data/latest/{self.sensor.id}/'
+        self.now = timezone.now()
+
+    def post(self, *readings):
+        response = self.client.post('/api/sensors/temperature/data/', list(readings), format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_latest_reading_is_served_without_a_query(self):
+        self.post(temp_reading(self.sensor.id, self.now - timedelta(minutes=1), 20.0))
+        self.post(temp_reading(self.sensor.id, self.now, 21.0))
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.data['temperature'], 21.0)
+
+    def test_late_reading_does_not_replace_a_newer_one(self):
+        self.post(temp_reading(self.sensor.id, self.now, 21.0))
+        self.post(temp_reading(self.sensor.id, self.now - timedelta(minutes=1), 20.0))
+
+        self.assertEqual(self.client.get(self.url).data['temperature'], 21.0)
+
+    def test_miss_falls_back_to_the_hypertable_once(self):
+        SensorDataTemp.objects.create(sensor=self.sensor, time=self.now, temperature=19.0, humidity=50.0)
+
+        self.assertEqual(get_latest('temperature', self.sensor.id).temperature, 19.0)
+        with self.assertNumQueries(0):
+            self.assertEqual(get_latest('temperature', self.sensor.id).temperature, 19.0)
+
+
+class ColumnarFormatTests(SimpleTestCase):
+    def test_rows_become_one_list_per_key(self):
+        rows = [{'time': 't0', 'temperature': 20.0}, {'time': 't1', 'temperature': None}]
+
+        self.assertEqual(to_columns(rows), {'time': ['t0', 't1'], 'temperature': [20.0, None]})
+        self.assertEqual(to_columns([]), {})
+
+    def test_paginated_envelope_is_kept(self):
+        data = {'count': 1, 'next': None, 'results': [{'time': 't0'}]}
+
+        self.assertEqual(to_columns(data), {'count': 1, 'next': None, 'results': {'time': ['t0']}})
+
+    def test_errors_and_single_objects_are_unchanged(self):
+        self.assertEqual(to_columns({'error': 'invalid range'}), {'error': 'invalid range'})
+        self.assertEqual(to_columns(['a', 'b']), ['a', 'b'])
+
+    def test_format_parameter_wins_over_accept(self):
+        factory = RequestFactory()
+
+        self.assertEqual(response_format(factory.get('/', HTTP_ACCEPT=MSGPACK_MEDIA_TYPE)), 'msgpack')
+        self.assertEqual(response_format(factory.get('/', HTTP_ACCEPT=COLUMNAR_MEDIA_TYPE)), 'columnar')
+        self.assertEqual(response_format(factory.get('/?format=json', HTTP_ACCEPT=MSGPACK_MEDIA_TYPE)), 'json')
+        self.assertEqual(response_format(factory.get('/?format=xml')), 'json')
+
+
+class ColumnarResponseTests(APITestCase):
+    url = '/api/sensors/temperature/data/'
+
+    def setUp(self):
+        super().setUp()
+        sensor = Sensor.objects.create(type='temperature', name='bme280')
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        SensorDataTemp.objects.bulk_create([
+            SensorDataTemp(sensor=sensor, time=start + timedelta(minutes=i), temperature=float(i), humidity=50.0)
+            for i in range(2)
+        ])
+
+    def test_list_endpoint_answers_columnar_json(self):
+        response = self.client.get(self.url + '?format=columnar')
+
+        self.assertEqual(response['Content-Type'], COLUMNAR_MEDIA_TYPE)
+        self.assertEqual(response.json()['results']['temperature'], [1.0, 0.0])
+
+    def test_list_endpoint_answers_msgpack(self):
+        response = self.client.get(self.url, HTTP_ACCEPT=MSGPACK_MEDIA_TYPE)
+
+        self.assertEqual(response['Content-Type'], MSGPACK_MEDIA_TYPE)
+        data = msgpack.unpackb(response.content, raw=False)
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(data['results']['humidity'], [50.0, 50.0])
+
+
+class ExportTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.sensor = Sensor.objects.create(type='temperature', name='bme280')
+        other = Sensor.objects.create(type='temperature', name='am2302')
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        SensorDataTemp.objects.bulk_create([
+            SensorDataTemp(sensor=sensor, time=start + timedelta(minutes=i), temperature=float(i), humidity=50.0)
+            for sensor in (self.sensor, other) for i in range(3)
+        ])
+        self.url = '/api/sensors/temperature/data/export/'
+
+    async def export(self, **params):
+        response = await self.async_client.get(self.url, params)
+        self.assertTrue(response.streaming)
+        return response, b''.join([chunk async for chunk in response.streaming_content])
+
+    async def test_csv_streams_the_filtered_rows_in_time_order(self):
+        response, body = await self.export(sensor_id=self.sensor.id, start='2026-01-01T00:01:00Z')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = body.decode().splitlines()
+        self.assertEqual(lines[0], 'time,sensor_id,temperature,humidity,pressure')
+        self.assertEqual([line.split(',')[2] for line in lines[1:]], ['1.0', '2.0'])
+
+    @mock.patch.object(export, 'EXPORT_BUFFER_SIZE', 1)
+    async def test_ndjson_is_sent_in_chunks(self):
+        response = await self.async_client.get(self.url, {'format': 'ndjson', 'sensor_id': self.sensor.id})
+        chunks = [chunk async for chunk in response.streaming_content]
+
+        self.assertEqual(len(chunks), 3)
+        rows = [json.loads(line) for line in b''.join(chunks).splitlines()]
+        self.assertEqual([row['temperature'] for row in rows], [0.0, 1.0, 2.0])
+
+    async def test_gzip_wraps_any_format(self):
+        response, body = await self.export(format='ndjson', gzip='1')
+
+        self.assertEqual(response['Content-Type'], 'application/gzip')
+        self.assertIn('.ndjson.gz', response['Content-Disposition'])
+        self.assertEqual(len(gzip.decompress(body).splitlines()), 6)
+
+    async def test_parquet_keeps_the_column_types(self):
+        response, body = await self.export(format='parquet', sensor_id=self.sensor.id)
+
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.parquet')
+        table = pa.parquet.read_table(pa.BufferReader(body))
+        self.assertEqual(table.column_names, ['time', 'sensor_id', 'temperature', 'humidity', 'pressure'])
+        self.assertEqual(table.schema.field('time').type, pa.timestamp('us', tz='UTC'))
+        self.assertEqual(table.column('temperature').to_pylist(), [0.0, 1.0, 2.0])
+
+    async def test_invalid_requests_are_rejected(self):
+        self.assertEqual((await self.async_client.get(self.url, {'format': 'xml'})).status_code, 400)
+        self.assertEqual((await self.async_client.get(self.url, {'start': 'yesterday'})).status_code, 400)
+        response = await self.async_client.get('/api/sensors/wind/data/export/')
+        self.assertEqual(response.status_code, 404)
+
+
+def upstream_response(data, status_code=200):
+    return mock.Mock(status_code=status_code, text='', json=mock.Mock(return_value=data))
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def test_opens_after_repeated_failures_and_lets_one_trial_through(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+        breaker.record_failure()
+        self.assertTrue(breaker.allow())
+        breaker.record_failure()
+        self.assertFalse(breaker.allow())
+
+        with mock.patch('api.weather.time.monotonic', return_value=time.monotonic() + 61):
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertTrue(breaker.allow())
+
+
+@override_settings(**TEST_SETTINGS)
+class CachedProxyTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.proxy = CachedProxy('https://upstream.test/', {'appid': 'key'}, ttl=60, stale_ttl=600)
+        self.upstream = mock.patch.object(self.proxy.session, 'get').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def cache_entry(self, data, age):
+        key = 'proxy:https://upstream.test/weather?lat=1'
+        cache.set(key, {'data': data, 'fetched_at': time.time() - age})
+        return key
+
+    def test_fresh_entry_is_served_from_the_cache(self):
+        self.upstream.return_value = upstream_response({'temp': 20})
+
+        self.assertEqual(self.proxy.get('weather', {'lat': 1}), {'temp': 20})
+        self.assertEqual(self.proxy.get('weather', {'lat': 1}), {'temp': 20})
+        self.assertEqual(self.upstream.call_count, 1)
+        self.assertEqual(self.upstream.call_args.kwargs['params'], {'appid': 'key', 'lat': 1})
+
+    def test_stale_entry_is_served_while_it_is_refreshed(self):
+        key = self.cache_entry({'temp': 19}, age=120)
+        self.upstream.return_value = upstream_response({'temp': 20})
+
+        self.assertEqual(self.proxy.get('weather', {'lat': 1}), {'temp': 19})
+        for _ in range(100):
+            if cache.get(key)['data'] == {'temp': 20}:
+                break
+            time.sleep(0.01)
+        self.assertEqual(cache.get(key)['data'], {'temp': 20})
+
+    def test_expired_entry_is_fetched_again(self):
+        self.cache_entry({'temp': 19}, age=3600)
+        self.upstream.return_value = upstream_response({'temp': 20})
+
+        self.assertEqual(self.proxy.get('weather', {'lat': 1}), {'temp': 20})
+
+    def test_concurrent_misses_share_one_upstream_call(self):
+        called = threading.Event()
+        release = threading.Event()
+
+        def slow_upstream(*args, **kwargs):
+            called.set()
+            release.wait(5)
+            return upstream_response({'temp': 20})
+
+        self.upstream.side_effect = slow_upstream
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(self.proxy.get('weather', {'lat': 1})))]
+        threads[0].start()
+        called.wait(5)
+        threads.append(threading.Thread(target=lambda: results.append(self.proxy.get('weather', {'lat': 1}))))
+        threads[1].start()
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(results, [{'temp': 20}, {'temp': 20}])
+        self.assertEqual(self.upstream.call_count, 1)
+
+    def test_upstream_errors_open_the_circuit(self):
+        self.upstream.return_value = upstream_response({}, status_code=502)
+
+        for _ in range(3):
+            with self.assertRaises(UpstreamError):
+                self.proxy.get('weather', {'lat': 1})
+        with self.assertRaises(UpstreamError):
+            self.proxy.get('weather', {'lat': 1})
+        self.assertEqual(self.upstream.call_count, 3)
+
+
+    def test_unexpected_errors_fail_the_flight(self):
+        self.upstream.side_effect = ValueError('bad payload')
+
+        with self.assertLogs('api.weather', 'ERROR'), self.assertRaises(UpstreamError):
+            self.proxy.get('weather', {'lat': 1})
+
+
+@mock.patch.object(views, 'OPENWEATHERMAP_API_KEY', 'key')
+class WeatherViewTests(SimpleTestCase):
+    async def test_upstream_data_is_returned(self):
+        with mock.patch.object(views.openweathermap, 'get', return_value={'temp': 20}) as get:
+            response = await self.async_client.get('/api/weather/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'temp': 20})
+        self.assertEqual(get.call_args.args[0], 'weather')
+
+    async def test_upstream_errors_are_reported_in_the_body(self):
+        with mock.patch.object(views.openweathermap, 'get', side_effect=UpstreamError('timeout')):
+            response = await self.async_client.get('/api/weather/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'error': 'Failed to fetch weather data: timeout'})
+
+class AggregateChoiceTests(SimpleTestCase):
+    def test_interval_literals(self):
+        self.assertEqual(interval_seconds('1 minute'), 60)
+        self.assertEqual(interval_seconds('6 hours'), 21600)
+        self.assertEqual(interval_seconds('2 weeks'), 1209600)
+        with self.assertRaises(ValueError):
+            interval_seconds('1 month')
+
+    def test_coarsest_nesting_aggregate_is_picked(self):
+        self.assertEqual(pick_aggregate('sensor_data_air', '1 hour'), ('sensor_data_air_1h', '1 hour'))
+        self.assertEqual(pick_aggregate('sensor_data_air', '12 hours'), ('sensor_data_air_6h', '6 hours'))
+        self.assertEqual(pick_aggregate('sensor_data_air', '1 day'), ('sensor_data_air_1d', '1 day'))
+        self.assertEqual(pick_aggregate('sensor_data_air', '2 weeks'), ('sensor_data_air_1w', '1 week'))
+        self.assertIsNone(pick_aggregate('sensor_data_air', '30 minutes'))
+
+
+def air_reading(sensor, time, value):
+    return SensorDataAir(
+        sensor=sensor, time=time, temperature=value, humidity=value, pressure=1000 + value, p1=value, p2=value,
+        signal=-60,
+    )
+
+
+@override_settings(**TEST_SETTINGS)
+class HistoryEndpointTests(APITestCase):
+    url = '/api/history/'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.sensors = [Sensor.objects.create(type='air', name=name) for name in ('airrohr', 'sds011')]
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        # Real-time aggregation covers the readings, nothing is materialized yet
+        SensorDataAir.objects.bulk_create([
+            air_reading(self.sensors[0], self.hour, 10.0),
+            air_reading(self.sensors[1], self.hour, 20.0),
+            air_reading(self.sensors[0], self.hour - timedelta(hours=2), 5.0),
+        ])
+
+    def test_buckets_average_every_sensor_of_the_series(self):
+        response = self.client.get(self.url, {'sensor': 'outdoor', 'range': '1d'})
+
+        self.assertEqual(response.status_code, 200)
+        rows = response.json()
+        self.assertEqual([row['pm10'] for row in rows], [5.0, 15.0])
+        self.assertEqual(rows[-1]['time'], self.hour.isoformat())
+        self.assertEqual(rows[-1]['type'], 'air')
+
+    def test_invalid_parameters_are_rejected(self):
+        self.assertEqual(self.client.get(self.url, {'range': '2d'}).status_code, 400)
+        self.assertEqual(self.client.get(self.url, {'sensor': 'garage'}).status_code, 400)
+
+
+class BucketStartTests(SimpleTestCase):
+    def test_buckets_align_to_the_time_bucket_origin(self):
+        moment = datetime(2026, 1, 1, 0, 30, tzinfo=dt_timezone.utc)
+
+        self.assertEqual(bucket_start(moment, 3600), datetime(2026, 1, 1, tzinfo=dt_timezone.utc))
+        # Weekly buckets start on Mondays like time_bucket's default origin
+        self.assertEqual(bucket_start(moment, 604800), datetime(2025, 12, 29, tzinfo=dt_timezone.utc))
+
+
+@override_settings(**TEST_SETTINGS)
+class HistoryCacheTests(APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.sensor = Sensor.objects.create(type='air', name='airrohr')
+        self.now = timezone.now()
+        self.open_start = bucket_start(self.now, 3600)
+        SensorDataAir.objects.bulk_create([
+            air_reading(self.sensor, self.open_start - timedelta(hours=1), 10.0),
+            air_reading(self.sensor, self.open_start, 20.0),
+        ])
+        self.queries = mock.patch.object(history, '_query_buckets', wraps=history._query_buckets).start()
+        self.addCleanup(mock.patch.stopall)
+
+    def query_starts(self):
+        return [call.args[4] for call in self.queries.call_args_list]
+
+    def test_closed_buckets_are_served_from_the_cache(self):
+        first = history.history_rows('air', None, '1d')
+        second = history.history_rows('air', None, '1d')
+
+        self.assertEqual(first, second)
+        self.assertEqual([row['pm10'] for row in second], [10.0, 20.0])
+        window_start = bucket_start(self.now - timedelta(days=1), 3600)
+        self.assertEqual(self.query_starts(), [window_start, self.open_start])
+
+    def test_open_bucket_is_always_recomputed(self):
+        history.history_rows('air', None, '1d')
+        air_reading(self.sensor, self.now, 30.0).save()
+        history.invalidate_history('air', self.now)
+
+        self.assertEqual([row['pm10'] for row in history.history_rows('air', None, '1d')], [10.0, 25.0])
+        self.assertEqual(self.query_starts()[-1], self.open_start)
+
+    def test_reading_in_a_closed_bucket_drops_the_cached_series(self):
+        history.history_rows('air', None, '1d')
+        history.invalidate_history('air', self.open_start - timedelta(minutes=30))
+        history.history_rows('air', None, '1d')
+
+        self.assertEqual(self.query_starts()[-1], bucket_start(self.now - timedelta(days=1), 3600))
+        self.assertIsNotNone(cache.get('history:late:air'))
+
+
+class SeriesSpecTests(SimpleTestCase):
+    def test_dashboard_names_and_explicit_series(self):
+        self.assertEqual(history.parse_series('outdoor'), ('air', None, None))
+        self.assertEqual(history.parse_series('temperature:3'), ('temperature', 3, None))
+        self.assertEqual(history.parse_series('air:*:pm10,pm25'), ('air', None, ['pm10', 'pm25']))
+
+    def test_invalid_series_are_rejected(self):
+        for spec in ('garage', 'wind:1', 'air:first', 'air:1:p1', 'air:1:pm10:x'):
+            with self.subTest(spec=spec), self.assertRaises(ValueError):
+                history.parse_series(spec)
+
+
+@override_settings(**TEST_SETTINGS)
+class HistoryBatchTests(APITestCase):
+    url = '/api/history/batch/'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.sensors = [Sensor.objects.create(type='air', name=name) for name in ('airrohr', 'sds011')]
+        hour = bucket_start(timezone.now(), 3600)
+        SensorDataAir.objects.bulk_create([
+            air_reading(self.sensors[0], hour, 10.0),
+            air_reading(self.sensors[1], hour, 20.0),
+        ])
+
+    def test_several_series_in_one_response(self):
+        spec = f'air:{self.sensors[1].id}:pm10'
+        response = self.client.get(self.url, {'range': '1d', 'series': ['outdoor', spec]})
+
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['range'], '1d')
+        self.assertEqual([row['pm10'] for row in data['series']['outdoor']], [15.0])
+        time = data['series']['outdoor'][0]['time']
+        self.assertEqual(data['series'][spec], [{'time': time, 'type': 'air', 'pm10': 20.0}])
+
+    def test_cached_series_only_query_their_open_bucket(self):
+        params = {'range': '1d', 'series': ['outdoor', 'indoor', 'temp1']}
+        self.client.get(self.url, params)
+
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get(self.url, params).status_code, 200)
+
+    def test_invalid_requests_are_rejected(self):
+        for params in (
+            {'range': '1d'},
+            {'range': '2d', 'series': 'outdoor'},
+            {'range': '1d', 'series': 'garage'},
+            {'range': '1d', 'series': ['outdoor'] * (history.HISTORY_MAX_SERIES + 1)},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class LTTBTests(SimpleTestCase):
+    def setUp(self):
+        self.x = np.arange(100, dtype=float)
+        self.y = np.zeros(100)
+        self.y[37] = 50.0
+
+    def test_keeps_the_ends_and_the_spike(self):
+        indices = lttb(self.x, self.y, 10)
+
+        self.assertEqual(len(indices), 10)
+        self.assertEqual(indices[0], 0)
+        self.assertEqual(indices[-1], 99)
+        self.assertIn(37, indices)
+        self.assertTrue(np.all(np.diff(indices) > 0))
+
+    def test_short_series_are_returned_whole(self):
+        self.assertEqual(list(lttb(self.x[:5], self.y[:5], 10)), [0, 1, 2, 3, 4])
+
+    def test_missing_values_are_never_picked(self):
+        self.y[10:20] = np.nan
+
+        indices = lttb(self.x, self.y, 10)
+
+        self.assertFalse(set(range(10, 20)) & set(indices))
+        self.assertIn(37, indices)
+
+    def test_metrics_share_the_points(self):
+        other = np.zeros(100)
+        other[73] = -50.0
+
+        indices = lttb_indices(self.x, [self.y, other], 10)
+
+        self.assertLessEqual(len(indices), 10)
+        self.assertIn(37, indices)
+        self.assertIn(73, indices)
+        self.assertEqual(list(indices), sorted(set(indices)))
+
+    def test_too_few_points_to_share_select_on_the_first_metric(self):
+        other = np.zeros(100)
+        other[73] = -50.0
+
+        indices = lttb_indices(self.x, [self.y, other], 4)
+
+        self.assertEqual(len(indices), 4)
+        self.assertIn(37, indices)
+
+
+class DownsampleEndpointTests(APITestCase):
+    url = '/api/history/'
+
+    def setUp(self):
+        super().setUp()
+        self.sensor = Sensor.objects.create(type='air', name='airrohr')
+        start = timezone.now() - timedelta(hours=1)
+        SensorDataAir.objects.bulk_create([
+            air_reading(self.sensor, start + timedelta(minutes=i), 80.0 if i == 20 else 10.0) for i in range(50)
+        ])
+
+    def test_spikes_survive_downsampling(self):
+        response = self.client.get(self.url, {'sensor': 'outdoor', 'range': '1d', 'downsample': 'lttb', 'points': 5})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(80.0, [row['pm10'] for row in response.json()])
+
+    def test_every_sensor_is_downsampled_on_its_own(self):
+        sensor = Sensor.objects.create(type='air', name='sds011')
+        start = timezone.now() - timedelta(hours=1, seconds=30)
+        SensorDataAir.objects.bulk_create([
+            air_reading(sensor, start + timedelta(minutes=i), 90.0 if i == 30 else 10.0) for i in range(50)
+        ])
+
+        response = self.client.get(
+            self.url, {'sensor': 'outdoor', 'range': '1d', 'downsample': 'lttb', 'points': 5, 'metrics': 'pm10'}
+        )
+
+        rows = response.json()
+        self.assertEqual(len(rows), 10)
+        self.assertEqual(rows, sorted(rows, key=lambda row: row['time']))
+        peaks = {row['sensor_id']: row['pm10'] for row in rows if row['pm10'] > 10.0}
+        self.assertEqual(peaks, {self.sensor.id: 80.0, sensor.id: 90.0})
+
+    def test_points_are_bounded(self):
+        for points in ('2', 'many', '100000'):
+            with self.subTest(points=points):
+                response = self.client.get(self.url, {'sensor': 'outdoor', 'downsample': 'lttb', 'points': points})
+                self.assertEqual(response.status_code, 400)
+
+
+class BucketSizingTests(SimpleTestCase):
+    def test_aligned_window_uses_the_narrowest_width(self):
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+
+        self.assertEqual(history.choose_bucket(start, start + timedelta(days=1), 24), '1 hour')
+        self.assertEqual(history.choose_bucket(start, start + timedelta(days=1), 23), '3 hours')
+        self.assertEqual(history.choose_bucket(start, start + timedelta(hours=1), 500), '1 minute')
+
+    def test_unaligned_window_counts_the_partial_buckets(self):
+        start = datetime(2026, 1, 1, 0, 30, tzinfo=dt_timezone.utc)
+
+        # 24 hours starting at half past span 25 hour buckets
+        self.assertEqual(history.choose_bucket(start, start + timedelta(days=1), 24), '3 hours')
+        self.assertEqual(history.choose_bucket(start, start + timedelta(days=1), 25), '1 hour')
+
+    def test_window_too_long_for_the_widest_bucket_is_rejected(self):
+        start = datetime(2000, 1, 1, tzinfo=dt_timezone.utc)
+
+        with self.assertRaises(ValueError):
+            history.choose_bucket(start, start + timedelta(days=3650), 10)
+
+    def test_metric_projection(self):
+        self.assertEqual([key for key, _, _ in history.resolve_metrics('air', ['pm25', 'pm10'])], ['pm10', 'pm25'])
+        with self.assertRaises(ValueError):
+            history.resolve_metrics('air', ['p1'])
+        with self.assertRaises(ValueError):
+            history.resolve_metrics('air', [])
+
+
+class HistoryWindowTests(APITestCase):
+    url = '/api/history/'
+
+    def setUp(self):
+        super().setUp()
+        sensor = Sensor.objects.create(type='air', name='airrohr')
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        SensorDataAir.objects.bulk_create([
+            air_reading(sensor, start + timedelta(minutes=15 * i), float(i)) for i in range(8)
+        ])
+
+    def get(self, **params):
+        return self.client.get(self.url, {'sensor': 'outdoor', **params})
+
+    def test_window_is_averaged_in_buckets_that_fit_max_points(self):
+        response = self.get(start='2026-01-01T00:00:00Z', end='2026-01-01T02:00:00Z', max_points=2, metrics='pm10')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {'time': '2026-01-01T00:00:00+00:00', 'type': 'air', 'pm10': 1.5},
+            {'time': '2026-01-01T01:00:00+00:00', 'type': 'air', 'pm10': 5.5},
+        ])
+
+    def test_invalid_windows_are_rejected(self):
+        for params in (
+            {'start': '2026-01-01T02:00:00Z', 'end': '2026-01-01T00:00:00Z'},
+            {'start': 'yesterday'},
+            {'start': '2026-01-01T00:00:00Z', 'max_points': '0'},
+            {'start': '2026-01-01T00:00:00Z', 'max_points': 'all'},
+            {'start': '2026-01-01T00:00:00Z', 'metrics': 'wind'},
+            {'start': '2000-01-01T00:00:00Z', 'end': '2026-01-01T00:00:00Z', 'max_points': '1'},
+        ):
+            with self.subTest(params=params):
+                self.assertEqual(self.get(**params).status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS)
+class SnapshotTests(RedisKeysMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.sensors = [Sensor.objects.create(type='air', name=name) for name in ('airrohr', 'sds011')]
+        self.start = timezone.now() - timedelta(hours=1)
+        SensorDataAir.objects.bulk_create([
+            air_reading(sensor, self.start + timedelta(minutes=2 * i + offset), float(i))
+            for offset, sensor in enumerate(self.sensors) for i in range(3)
+        ])
+
+    def test_recent_readings_are_read_per_sensor(self):
+        readings = recent_readings(limit=2)
+
+        self.assertEqual(readings['temperature'], {})
+        self.assertEqual(
+            {sensor_id: [instance.p1 for instance in instances] for sensor_id, instances in readings['air'].items()},
+            {self.sensors[0].id: [2.0, 1.0], self.sensors[1].id: [2.0, 1.0]},
+        )
+
+    def test_only_sensors_in_the_latest_store_are_probed(self):
+        for kind in ('temperature', 'air', 'indoor'):
+            get_all_latest(kind)
+        stored = stored_sensor_ids(['air', 'temperature'])
+        self.assertEqual(sorted(stored['air']), [sensor.id for sensor in self.sensors])
+        self.assertEqual(stored['temperature'], [])
+
+        with self.assertNumQueries(1):
+            readings = recent_readings(limit=1)
+
+        self.assertEqual(
+            {sensor_id: [instance.p1 for instance in instances] for sensor_id, instances in readings['air'].items()},
+            {self.sensors[0].id: [2.0], self.sensors[1].id: [2.0]},
+        )
+
+    def test_dashboard_series_merge_the_sensors_of_a_type(self):
+        dashboard, latest = build_snapshot()
+
+        self.assertEqual(dashboard['outdoorSensor']['sensor_id'], self.sensors[1].id)
+        series = dashboard['outdoorHistory']
+        self.assertEqual(len(series), 6)
+        self.assertEqual(series, sorted(series, key=lambda reading: reading['time']))
+        self.assertEqual([reading['sensor_id'] for reading in latest['sensors']['air']], [s.id for s in self.sensors])
+        self.assertIsNone(latest['indoorSensor'])
+
+    def test_latest_endpoint_is_cached_until_the_next_ingest(self):
+        self.client.get('/api/sensors/latest/')
+        with self.assertNumQueries(0):
+            self.client.get('/api/sensors/latest/')
+
+        reading = {
+            'time': timezone.now().isoformat(), 'sensor_id': self.sensors[0].id, 'temperature': 1.0, 'humidity': 1.0,
+            'pressure': 1.0, 'p1': 99.0, 'p2': 1.0, 'signal': -60,
+        }
+        self.assertEqual(self.client.post('/api/sensors/air/data/', reading, format='json').status_code, 201)
+
+        data = self.client.get('/api/sensors/latest/').json()
+        self.assertEqual(data['outdoorSensor']['pm10'], 99.0)
+
+
+@override_settings(**TEST_SETTINGS)
+class ConditionalGetTests(RedisKeysMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.now = timezone.now()
+
+    def post(self, kind, reading):
+        response = self.client.post(f'/api/sensors/{kind}/data/', reading, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def assertRevalidates(self, url, change):
+        response = self.client.get(url)
+        etag = response.headers['ETag']
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('no-cache', response.headers['Cache-Control'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        change()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_latest_reading_is_not_modified_until_a_new_one_arrives(self):
+        sensor = Sensor.objects.create(type='temperature', name='bme280')
+        self.post('temperature', temp_reading(sensor.id, self.now - timedelta(minutes=1)))
+
+        self.assertRevalidates(
+            f'/api/sensors/temperature/data/latest/{sensor.id}/',
+            lambda: self.post('temperature', temp_reading(sensor.id, self.now)),
+        )
+
+    def test_history_is_not_modified_until_a_new_reading_arrives(self):
+        sensor = Sensor.objects.create(type='air', name='airrohr')
+        reading = {
+            'sensor_id': sensor.id, 'temperature': 1.0, 'humidity': 1.0, 'pressure': 1.0, 'p1': 1.0, 'p2': 1.0,
+            'signal': -60,
+        }
+        self.post('air', {**reading, 'time': (self.now - timedelta(minutes=1)).isoformat()})
+        get_all_latest('air')
+
+        self.assertRevalidates(
+            '/api/history/?sensor=outdoor&range=1d', lambda: self.post('air', {**reading, 'time': self.now.isoformat()})
+        )
+
+    def test_dashboard_snapshot_is_validated_by_its_cached_body(self):
+        sensor = Sensor.objects.create(type='temperature', name='bme280')
+        self.post('temperature', temp_reading(sensor.id, self.now - timedelta(minutes=1)))
+
+        self.assertRevalidates(
+            '/api/sensors/latest/', lambda: self.post('temperature', temp_reading(sensor.id, self.now)),
+        )
+
+    def test_formats_get_their_own_validators(self):
+        sensor = Sensor.objects.create(type='temperature', name='bme280')
+        self.post('temperature', temp_reading(sensor.id, self.now))
+        url = f'/api/sensors/temperature/data/latest/{sensor.id}/'
+        etag = self.client.get(url).headers['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag, HTTP_ACCEPT=MSGPACK_MEDIA_TYPE)
+
+        self.assertEqual(response.status_code, 200)
+
+
+class ParseStatsTests(SimpleTestCase):
+    def test_known_stats_and_percentiles_are_accepted_once(self):
+        self.assertEqual(history.parse_stats(['min', 'p95', 'min', 'p99.9']), ['min', 'p95', 'p99.9'])
+
+    def test_unknown_stats_are_rejected(self):
+        for name in ('median', 'p0', 'p100', 'p', 'p-5'):
+            with self.subTest(name=name), self.assertRaises(ValueError):
+                history.parse_stats([name])
+
+
+@override_settings(**TEST_SETTINGS)
+class HistoryStatsTests(APITestCase):
+    url = '/api/history/'
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        sensors = [Sensor.objects.create(type='air', name=name) for name in ('airrohr', 'sds011')]
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+        SensorDataAir.objects.bulk_create([
+            air_reading(sensors[0], self.hour, 10.0),
+            air_reading(sensors[1], self.hour, 20.0),
+        ])
+
+    def get(self, **params):
+        return self.client.get(self.url, {'sensor': 'outdoor', 'range': '1d', 'metrics': 'pm10', **params})
+
+    def test_mergeable_stats_come_from_the_aggregate(self):
+        response = self.get(stats='count,min,max,stddev')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [{
+            'time': self.hour.isoformat(), 'type': 'air', 'pm10': 15.0,
+            'pm10_count': 2, 'pm10_min': 10.0, 'pm10_max': 20.0, 'pm10_stddev': 7.07,
+        }])
+
+    def test_percentiles_read_the_raw_table(self):
+        response = self.get(stats='p50,stddev')
+
+        self.assertEqual(response.status_code, 200)
+        row, = response.json()
+        self.assertEqual((row['pm10'], row['pm10_p50'], row['pm10_stddev']), (15.0, 15.0, 7.07))
+
+    def test_invalid_stats_are_rejected(self):
+        self.assertEqual(self.get(stats='median').status_code, 400)
+        self.assertEqual(self.get(stats='max', downsample='lttb').status_code, 400)
+
+
+@override_settings(**TEST_SETTINGS)
+class WebSocketSubscriptionTests(RedisKeysMixin, APITransactionTestCase):
+    # The consumer reads the registry from another thread, which only sees committed rows
+
+    def setUp(self):
+        super().setUp()
+        sensor_registry.invalidate()
+        self.addCleanup(sensor_registry.invalidate)
+        self.outdoor = Sensor.objects.create(type='air', name='airrohr')
+        self.bme280 = Sensor.objects.create(type='temperature', name='bme280')
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(consumers.SensorsDataConsumer.as_asgi(), f'/ws/sensor_data/?{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from(timeout=5))['event'], 'snapshot')
+        return communicator
+
+    async def broadcast(self, *sensors):
+        await sync_to_async(broadcast_sensor_data)([
+            {'type': sensor.type, 'sensor_id': sensor.id, 'time': '2026-01-01T00:00:00+00:00'} for sensor in sensors
+        ])
+
+    async def received_sensors(self, communicator):
+        frame = await communicator.receive_json_from(timeout=5)
+        self.assertEqual(frame['event'], 'delta')
+        return [reading['sensor_id'] for reading in frame['readings']]
+
+    async def test_sockets_receive_every_reading_by_default(self):
+        communicator = await self.connect()
+
+        await self.broadcast(self.outdoor, self.bme280)
+
+        self.assertEqual(await self.received_sensors(communicator), [self.outdoor.id, self.bme280.id])
+        await communicator.disconnect()
+
+    async def test_query_string_narrows_the_subscription(self):
+        communicator = await self.connect(f'sensor={self.bme280.id}')
+
+        await self.broadcast(self.outdoor)
+        await self.broadcast(self.outdoor, self.bme280)
+
+        self.assertEqual(await self.received_sensors(communicator), [self.bme280.id])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.disconnect()
+
+    async def test_subscribe_and_unsubscribe_messages(self):
+        communicator = await self.connect()
+
+        await communicator.send_json_to({'action': 'subscribe', 'types': ['air']})
+        self.assertEqual(await communicator.receive_json_from(timeout=5), {
+            'event': 'subscriptions', 'all': False, 'sensors': [], 'types': ['air'],
+        })
+        self.assertEqual((await communicator.receive_json_from(timeout=5))['event'], 'snapshot')
+        await self.broadcast(self.bme280, self.outdoor)
+        self.assertEqual(await self.received_sensors(communicator), [self.outdoor.id])
+
+        await communicator.send_json_to({'action': 'unsubscribe', 'types': ['air']})
+        self.assertEqual((await communicator.receive_json_from(timeout=5))['types'], [])
+        await self.broadcast(self.outdoor)
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+
+        await communicator.send_json_to({'action': 'subscribe', 'all': True})
+        self.assertTrue((await communicator.receive_json_from(timeout=5))['all'])
+        await communicator.disconnect()
+
+    async def test_invalid_subscriptions_are_answered_with_an_error(self):
+        communicator = await self.connect()
+
+        for message in (
+            {'action': 'watch'},
+            {'action': 'subscribe', 'sensors': [self.bme280.id + 100]},
+            {'action': 'subscribe', 'types': 'air'},
+        ):
+            await communicator.send_json_to(message)
+            self.assertEqual((await communicator.receive_json_from(timeout=5))['event'], 'error')
+        await communicator.disconnect()
+
+    async def test_sensors_covered_by_a_subscribed_type_are_rejected(self):
+        communicator = await self.connect(f'sensor={self.bme280.id}')
+
+        await communicator.send_json_to({'action': 'subscribe', 'types': ['temperature']})
+        self.assertEqual(await communicator.receive_json_from(timeout=5), {
+            'event': 'error', 'error': f'sensor {self.bme280.id} is already covered by the temperature subscription',
+        })
+        await communicator.send_json_to({'action': 'subscribe', 'types': ['air']})
+        self.assertEqual((await communicator.receive_json_from(timeout=5))['types'], ['air'])
+        await communicator.receive_json_from(timeout=5)
+
+        # One frame from the air type group, one from the sensor group
+        await self.broadcast(self.outdoor, self.bme280)
+        received = [await self.received_sensors(communicator) for _ in range(2)]
+        self.assertEqual(sorted(received), sorted([[self.outdoor.id], [self.bme280.id]]))
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.disconnect()
+
+    async def test_overlapping_query_string_closes_the_socket(self):
+        communicator = WebsocketCommunicator(
+            consumers.SensorsDataConsumer.as_asgi(), f'/ws/sensor_data/?sensor={self.outdoor.id}&type=air',
+        )
+        await communicator.connect()
+
+        self.assertEqual((await communicator.receive_json_from(timeout=5))['event'], 'error')
+        self.assertEqual((await communicator.receive_output(timeout=5))['type'], 'websocket.close')
+
+    @mock.patch.object(consumers, 'MAX_SUBSCRIPTIONS', 1)
+    async def test_subscriptions_are_capped_per_socket(self):
+        communicator = await self.connect(f'sensor={self.bme280.id}')
+
+        await communicator.send_json_to({'action': 'subscribe', 'sensors': [self.outdoor.id]})
+
+        self.assertEqual(await communicator.receive_json_from(timeout=5), {
+            'event': 'error', 'error': 'too many subscriptions',
+        })
+        await communicator.disconnect()
+
+    async def test_unknown_sensors_in_the_query_string_close_the_socket(self):
+        communicator = WebsocketCommunicator(consumers.SensorsDataConsumer.as_asgi(), '/ws/sensor_data/?sensor=abc')
+        await communicator.connect()
+
+        self.assertEqual((await communicator.receive_json_from(timeout=5))['event'], 'error')
+        self.assertEqual((await communicator.receive_output(timeout=5))['type'], 'websocket.close')
+
+
+@override_settings(**TEST_SETTINGS)
+class BroadcastFrameTests(RedisKeysMixin, APITransactionTestCase):
+    reading = {'type': 'temperature', 'sensor_id': 1, 'time': '2026-01-01T00:00:00+00:00', 'temperature': 20.5}
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(consumers.SensorsDataConsumer.as_asgi(), '/ws/sensor_data/')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from(timeout=5)
+        return communicator
+
+    async def test_frames_are_encoded_once_per_group_and_forwarded_unchanged(self):
+        communicators = [await self.connect() for _ in range(3)]
+
+        with mock.patch.object(broadcast, 'encode_frame', wraps=broadcast.encode_frame) as encode_frame:
+            await sync_to_async(broadcast_sensor_data)([self.reading])
+
+        # The readings of the all-sensors, type and sensor groups
+        self.assertEqual(encode_frame.call_count, 3)
+        frames = [await communicator.receive_from(timeout=5) for communicator in communicators]
+        self.assertEqual(len(set(frames)), 1)
+        self.assertEqual(json.loads(frames[0]), {
+            'event': 'delta', 'group': 'sensors', 'seq': 1, 'readings': [self.reading],
+        })
+        for communicator in communicators:
+            await communicator.disconnect()
+
+    async def test_messages_of_the_previous_format_are_still_delivered(self):
+        communicator = await self.connect()
+
+        await get_channel_layer().group_send('sensors', {'type': 'sensor_update', 'data': self.reading})
+
+        self.assertEqual(await communicator.receive_json_from(timeout=5), {
+            'event': 'delta', 'group': None, 'seq': None, 'readings': [self.reading],
+        })
+        await communicator.disconnect()
+
+
+@override_settings(**TEST_SETTINGS)
+class WebSocketProtocolTests(RedisKeysMixin, APITransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        sensor_registry.invalidate()
+        self.addCleanup(sensor_registry.invalidate)
+        self.sensor = Sensor.objects.create(type='temperature', name='bme280')
+        self.group = broadcast.sensor_group(self.sensor.id)
+        self.start = timezone.now() - timedelta(hours=1)
+        SensorDataTemp.objects.create(sensor=self.sensor, time=self.start, temperature=19.0, humidity=50.0)
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(consumers.SensorsDataConsumer.as_asgi(), f'/ws/sensor_data/?{query}')
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def broadcast(self, minutes):
+        reading = {**temp_reading(self.sensor.id, self.start + timedelta(minutes=minutes)), 'type': 'temperature'}
+        await sync_to_async(broadcast_sensor_data)(reading)
+
+    async def test_snapshot_then_sequenced_deltas(self):
+        communicator = await self.connect(f'sensor={self.sensor.id}')
+
+        snapshot = await communicator.receive_json_from(timeout=5)
+        self.assertEqual(snapshot['event'], 'snapshot')
+        self.assertEqual(snapshot['seq'], {self.group: 0})
+        self.assertEqual([reading['temperature'] for reading in snapshot['readings']], [19.0])
+
+        await self.broadcast(1)
+        await self.broadcast(2)
+        deltas = [await communicator.receive_json_from(timeout=5) for _ in range(2)]
+        self.assertEqual([delta['event'] for delta in deltas], ['delta', 'delta'])
+        self.assertEqual([delta['seq'] for delta in deltas], [1, 2])
+        self.assertEqual({delta['group'] for delta in deltas}, {self.group})
+        await communicator.disconnect()
+
+    async def test_snapshot_action_resends_the_current_state(self):
+        communicator = await self.connect(f'sensor={self.sensor.id}')
+        await communicator.receive_json_from(timeout=5)
+        await self.broadcast(1)
+        await communicator.receive_json_from(timeout=5)
+
+        await communicator.send_json_to({'action': 'snapshot'})
+
+        snapshot = await communicator.receive_json_from(timeout=5)
+        self.assertEqual(snapshot['event'], 'snapshot')
+        self.assertEqual(snapshot['seq'], {self.group: 1})
+        await communicator.disconnect()
+
+    @mock.patch.object(consumers, 'HEARTBEAT_INTERVAL', 0.1)
+    async def test_idle_sockets_get_heartbeats_with_the_sequence_numbers(self):
+        await self.broadcast(1)
+        communicator = await self.connect(f'sensor={self.sensor.id}')
+        await communicator.receive_json_from(timeout=5)
+
+        self.assertEqual(await communicator.receive_json_from(timeout=5), {
+            'event': 'heartbeat', 'seq': {self.group: 1},
+        })
+        await communicator.disconnect()
+
+    async def test_resume_replays_the_missed_frames(self):
+        communicator = await self.connect(f'sensor={self.sensor.id}')
+        await communicator.receive_json_from(timeout=5)
+        await self.broadcast(1)
+        delta = await communicator.receive_json_from(timeout=5)
+        await communicator.disconnect()
+
+        await self.broadcast(2)
+        await self.broadcast(3)
+        resume = quote(json.dumps({self.group: delta['seq']}))
+        communicator = await self.connect(f'sensor={self.sensor.id}&resume={resume}')
+
+        frames = [await communicator.receive_json_from(timeout=5) for _ in range(2)]
+        self.assertEqual([frame['event'] for frame in frames], ['delta', 'delta'])
+        self.assertEqual([frame['seq'] for frame in frames], [delta['seq'] + 1, delta['seq'] + 2])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+        await communicator.disconnect()
+
+    async def test_resume_past_the_counter_gets_a_snapshot(self):
+        await self.broadcast(1)
+        resume = quote(json.dumps({self.group: 1000}))
+        communicator = await self.connect(f'sensor={self.sensor.id}&resume={resume}')
+
+        snapshot = await communicator.receive_json_from(timeout=5)
+        self.assertEqual(snapshot['event'], 'snapshot')
+        self.assertEqual(snapshot['seq'], {self.group: 1})
+        await communicator.disconnect()
+
+    @mock.patch.object(broadcast, 'REPLAY_MAXLEN', 1)
+    async def test_trimmed_replay_is_reported_as_missing(self):
+        for minutes in range(1, 4):
+            await self.broadcast(minutes)
+
+        self.assertEqual(len(await sync_to_async(replay_frames)(self.group, 2)), 1)
+        self.assertIsNone(await sync_to_async(replay_frames)(self.group, 0))
+
+    async def test_replay_stream_restarts_with_a_reset_counter(self):
+        for minutes in range(1, 4):
+            await self.broadcast(minutes)
+        await sync_to_async(get_redis().delete)(f'{broadcast.SEQUENCE_PREFIX}{self.group}')
+
+        await self.broadcast(4)
+
+        frames = await sync_to_async(replay_frames)(self.group, 0)
+        self.assertEqual([json.loads(frame)['seq'] for frame in frames], [1])
+
+    async def test_overtaken_frames_are_sent_in_order(self):
+        communicator = await self.connect(f'sensor={self.sensor.id}')
+        await communicator.receive_json_from(timeout=5)
+        published = []
+        for minutes in range(1, 4):
+            reading = {**temp_reading(self.sensor.id, self.start + timedelta(minutes=minutes)), 'type': 'temperature'}
+            published.append(await sync_to_async(broadcast.publish_frames)({self.group: [reading]}))
+
+        # The third broadcast reaches the channel layer first
+        for frames in reversed(published):
+            await broadcast._group_send(get_channel_layer(), frames)
+
+        frames = [await communicator.receive_json_from(timeout=5) for _ in range(3)]
+        self.assertEqual([frame['seq'] for frame in frames], [1, 2, 3])
+        self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+        await communicator.disconnect()
+
+    async def test_reset_counter_starts_the_group_over(self):
+        communicator = await self.connect(f'sensor={self.sensor.id}')
+        await communicator.receive_json_from(timeout=5)
+        await self.broadcast(1)
+        await self.broadcast(2)
+        await communicator.receive_json_from(timeout=5)
+        await communicator.receive_json_from(timeout=5)
+        await sync_to_async(get_redis().delete)(f'{broadcast.SEQUENCE_PREFIX}{self.group}')
+
+        await self.broadcast(3)
+        await self.broadcast(4)
+
+        frames = [await communicator.receive_json_from(timeout=5) for _ in range(2)]
+        self.assertEqual([frame['seq'] for frame in frames], [1, 2])
+        await communicator.disconnect()
+
+
+class ConflationTests(SimpleTestCase):
+    """
+    Drive ``sensor_frame`` directly with a socket send that blocks until
+    released, which a test client cannot do.
+    """
+    group = 'sensors'
+
+    def consumer(self):
+        consumer = consumers.SensorsDataConsumer()
+        consumer.sequences = {}
+        consumer.pending = {}
+        consumer.pending_count = 0
+        consumer.sender = None
+        consumer.send_started = None
+        consumer.over_since = None
+        consumer.closing = False
+        self.released = asyncio.Event()
+        self.sent = []
+        self.closed = []
+
+        async def send(text_data=None, bytes_data=None, close=False):
+            self.sent.append(json.loads(text_data))
+            await self.released.wait()
+
+        async def close(code=None, reason=None):
+            self.closed.append(code)
+
+        consumer.send = send
+        consumer.close = close
+        return consumer
+
+    def frame(self, seq, *readings):
+        readings = [
+            {'type': 'temperature', 'sensor_id': sensor_id, 'time': f'2026-01-01T00:00:{second:02d}+00:00'}
+            for sensor_id, second in readings
+        ]
+        text = broadcast.encode_frame({'event': 'delta', 'group': self.group, 'seq': seq, 'readings': readings})
+        return {'group': self.group, 'seq': seq, 'text': text}
+
+    async def test_frames_already_sent_are_dropped(self):
+        consumer = self.consumer()
+        self.released.set()
+
+        for seq in (1, 2, 2):
+            await consumer.sensor_frame(self.frame(seq, (1, seq)))
+            await consumer.sender
+
+        self.assertEqual([frame['seq'] for frame in self.sent], [1, 2])
+
+    async def test_frames_are_forwarded_while_the_socket_keeps_up(self):
+        consumer = self.consumer()
+        self.released.set()
+
+        await consumer.sensor_frame(self.frame(1, (1, 0)))
+        await consumer.sender
+        await consumer.sensor_frame(self.frame(2, (1, 1)))
+        await consumer.sender
+
+        self.assertEqual([frame['seq'] for frame in self.sent], [1, 2])
+        self.assertNotIn('conflated', self.sent[1])
+
+    async def test_frames_conflate_to_the_newest_reading_per_sensor(self):
+        consumer = self.consumer()
+        await consumer.sensor_frame(self.frame(1, (1, 0)))
+        await asyncio.sleep(0)  # The sender is now blocked in the first send
+
+        await consumer.sensor_frame(self.frame(2, (1, 1)))
+        await consumer.sensor_frame(self.frame(3, (1, 3), (2, 2)))
+        await consumer.sensor_frame(self.frame(4, (1, 2)))
+        self.released.set()
+        await consumer.sender
+
+        self.assertEqual(len(self.sent), 2)
+        conflated = self.sent[1]
+        self.assertEqual(conflated['seq'], 4)
+        self.assertTrue(conflated['conflated'])
+        self.assertEqual(
+            [(reading['sensor_id'], reading['time'][-8:]) for reading in conflated['readings']],
+            [(2, '02+00:00'), (1, '03+00:00')],
+        )
+
+    @override_settings(WEBSOCKET_BACKPRESSURE={'MAX_PENDING': 1, 'STALL_TIMEOUT': 30})
+    async def test_readings_beyond_the_buffer_are_dropped_as_a_gap(self):
+        consumer = self.consumer()
+        await consumer.sensor_frame(self.frame(1, (1, 0)))
+        await asyncio.sleep(0)
+
+        await consumer.sensor_frame(self.frame(2, (1, 1), (2, 1)))
+        self.released.set()
+        await consumer.sender
+
+        self.assertEqual([reading['sensor_id'] for reading in self.sent[1]['readings']], [1])
+        self.assertFalse(self.sent[1]['conflated'])
+
+    @override_settings(WEBSOCKET_BACKPRESSURE={'MAX_PENDING': 1000, 'STALL_TIMEOUT': 30})
+    async def test_stalled_socket_is_closed(self):
+        consumer = self.consumer()
+        await consumer.sensor_frame(self.frame(1, (1, 0)))
+        await asyncio.sleep(0)
+        consumer.send_started -= 60
+
+        await consumer.sensor_frame(self.frame(2, (1, 1)))
+        await asyncio.sleep(0)
+
+        self.assertEqual(self.closed, [4008])
+        self.assertTrue(consumer.sender.cancelled())
+        self.assertEqual(consumer.pending, {})
+        await consumer.sensor_frame(self.frame(3, (1, 2)))
+        self.assertEqual(len(self.sent), 1)
+
+
+@override_settings(**TEST_SETTINGS)
+class SocketStatsTests(RedisKeysMixin, APITestCase):
+    redis_patterns = [broadcast.SOCKET_STATS_KEY]
+
+    def test_counters_of_every_worker_are_summed(self):
+        broadcast.record_socket_stats({'forwarded': 3, 'dropped': 1})
+        broadcast.record_socket_stats({'forwarded': 2})
+
+        response = self.client.get('/api/ws/stats/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'forwarded': 5, 'dropped': 1})
@@ -1,11 +1,17 @@
 from django.urls import path
 
+from .export import export_data
 from .views import (
     SensorListCreateAPIView,  # For getting the last temperature data
     SensorDataTempListCreateAPIView,
     SensorDataTempLatestAPIView,
+    SensorDataAirLatestAPIView,
+    SensorDataIndoorLatestAPIView,
     SensorDataAirListCreateAPIView,
     SensorDataIndoorListCreateAPIView,
+    SensorDataCopyAPIView,
+    IngestQueueStatusAPIView,
+    SocketStatsAPIView,
     WeatherDataAPIView,
     AirPollutionDataAPIView,
     ToggleSchedulerAPIView,
@@ -17,7 +23,14 @@ urlpatterns = [
     path('sensors/temperature/data/latest/<int:sensor_id>/', SensorDataTempLatestAPIView.as_view(),
          name='temp-data-latest'),
     path('sensors/air/data/', SensorDataAirListCreateAPIView.as_view(), name='air-data'),
+    path('sensors/air/data/latest/<int:sensor_id>/', SensorDataAirLatestAPIView.as_view(), name='air-data-latest'),
     path('sensors/indoor/data/', SensorDataIndoorListCreateAPIView.as_view(), name='indoor-data'),
+    path('sensors/indoor/data/latest/<int:sensor_id>/', SensorDataIndoorLatestAPIView.as_view(),
+         name='indoor-data-latest'),
+    path('sensors/<str:kind>/data/copy/', SensorDataCopyAPIView.as_view(), name='data-copy'),
+    path('sensors/<str:kind>/data/export/', export_data, name='data-export'),
+    path('ingest/queue/', IngestQueueStatusAPIView.as_view(), name='ingest-queue'),
+    path('ws/stats/', SocketStatsAPIView.as_view(), name='ws-stats'),
     path('weather/', WeatherDataAPIView.as_view(), name='weather-data'),
     path('air-pollution/', AirPollutionDataAPIView.as_view(), name='air-pollution-data'),
     path('scheduler/', ToggleSchedulerAPIView.as_view(), name='toggle_scheduler'),
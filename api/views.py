@@ -1,31 +1,149 @@
-import os
+from functools import partial
 
-import requests
-from asgiref.sync import async_to_sync
-from channels.layers import get_channel_layer
-from dotenv import load_dotenv
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse
+from django.views import View
 from rest_framework import generics
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from core.models import Sensor, SensorDataTemp, SensorDataAir, SensorDataIndoor
+from core.models import SENSOR_DATA_MODELS, Sensor, SensorDataTemp, SensorDataAir, SensorDataIndoor
+from .broadcast import broadcast_sensor_data, socket_stats
+from .conditional import conditional_response, series_validators
+from .filters import filter_readings, parse_fields
+from .ingest import (
+    bulk_create_readings,
+    LineTooLong,
+    copy_readings,
+    latest_per_sensor,
+    read_lines,
+    readings_stored,
+    validate_readings,
+)
+from .ingest_queue import QueueFull, enqueue_readings, queue_depth
+from .latest import get_latest
+from .pagination import TimeKeysetPagination
+from .payloads import SENSOR_DATA_PAYLOADS
 from .serializers import (
     SensorSerializer,
     SensorDataTempSerializer,
     SensorDataAirSerializer,
     SensorDataIndoorSerializer,
 )
+from .weather import OPENWEATHERMAP_API_KEY, UpstreamError, openweathermap
 
 LAT, LON = 40.678967, 22.917712  # Thessaloniki, Greece
+MAX_BULK_ITEMS = 5000
+
+
+def _request_body(request):
+    """
+    Return a file object with the raw request body, or ``None`` without one.
+
+    DRF treats a body without ``Content-Length`` as empty, so chunked uploads
+    are read from the server's input stream instead.
+    """
+    if request.stream is not None:
+        return request.stream
+    if 'chunked' not in request.META.get('HTTP_TRANSFER_ENCODING', '').lower():
+        return None
+    # WSGIRequest limits its own stream to Content-Length, ASGIRequest does not
+    return request.META.get('wsgi.input') or request._request
+
+
+class BulkCreateMixin:
+    """
+    Accept a JSON array of readings as well as a single reading on POST.
+
+    Arrays are validated item by item, the valid readings are stored with one
+    batched INSERT and the newest reading per sensor is broadcast once. With
+    ``INGEST_MODE = 'queue'`` readings are queued for the flusher instead and
+    the response is ``202 Accepted``.
+    """
+    kind = None
+
+    def create(self, request, *args, **kwargs):
+        many = isinstance(request.data, list)
+        if not many and settings.INGEST_MODE != 'queue':
+            return super().create(request, *args, **kwargs)
+
+        items = request.data if many else [request.data]
+        if len(items) > MAX_BULK_ITEMS:
+            return Response(
+                {"error": f"Too many readings, the maximum is {MAX_BULK_ITEMS}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        if settings.INGEST_MODE == 'queue':
+            valid, errors = validate_readings(self.get_serializer_class(), items, self.get_serializer_context())
+            try:
+                enqueue_readings(self.kind, valid)
+            except QueueFull as e:
+                return Response(
+                    {"error": f"{e} Retry later."},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': str(settings.INGEST_QUEUE['RETRY_AFTER'])}
+                )
+            if not many:
+                if errors:
+                    return Response(errors[0]['errors'], status=status.HTTP_400_BAD_REQUEST)
+                return Response(request.data, status=status.HTTP_202_ACCEPTED)
+            return Response(
+                {'queued': len(valid), 'errors': errors},
+                status=status.HTTP_202_ACCEPTED if valid or not errors else status.HTTP_400_BAD_REQUEST
+            )
+
+        instances, errors = bulk_create_readings(
+            self.get_serializer_class(), items, self.get_serializer_context()
+        )
+        if instances:
+            readings_stored(self.kind, instances)
+            payload = SENSOR_DATA_PAYLOADS[self.kind]
+            broadcast_sensor_data([payload(instance) for instance in latest_per_sensor(instances)])
+
+        if not instances and errors:
+            response_status = status.HTTP_400_BAD_REQUEST
+        elif errors:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_201_CREATED
+        return Response({'created': len(instances), 'errors': errors}, status=response_status)
+
+    def perform_create(self, serializer):
+        instance = serializer.save()
+        readings_stored(self.kind, [instance])
+        broadcast_sensor_data(SENSOR_DATA_PAYLOADS[self.kind](instance))
 
 
-def broadcast_sensor_data(data):
+class ReadingFilterMixin:
     """
-    Broadcast sensor data to the WebSocket group for all sensors.
+    Filter list requests by ``sensor_id``, ``start`` and ``end`` and project
+    the columns named in ``fields`` in SQL and in the response.
     """
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)('sensors', {'type': 'sensor_update', 'data': data})
+
+    def get_fields(self):
+        if self.request.method != 'GET':
+            return None
+        serializer_class = self.get_serializer_class()
+        available = [
+            name for name, field in serializer_class().fields.items() if not field.write_only
+        ]
+        return parse_fields(self.request.query_params, available)
+
+    def get_queryset(self):
+        queryset = filter_readings(super().get_queryset(), self.request.query_params)
+        fields = self.get_fields()
+        if fields:
+            queryset = queryset.only('time', *fields)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        fields = self.get_fields()
+        if fields:
+            kwargs['fields'] = fields
+        return super().get_serializer(*args, **kwargs)
 
 
 class SensorListCreateAPIView(generics.ListCreateAPIView):
@@ -33,116 +151,145 @@ class SensorListCreateAPIView(generics.ListCreateAPIView):
     serializer_class = SensorSerializer
 
 
-class SensorDataTempListCreateAPIView(generics.ListCreateAPIView):
-    queryset = SensorDataTemp.objects.all().order_by('-time')
+class SensorDataTempListCreateAPIView(ReadingFilterMixin, BulkCreateMixin, generics.ListCreateAPIView):
+    queryset = SensorDataTemp.objects.all().order_by('-time', '-id')
     serializer_class = SensorDataTempSerializer
+    pagination_class = TimeKeysetPagination
+    kind = 'temperature'
 
-    def perform_create(self, serializer):
-        instance = serializer.save()
-        data = {
-            'sensor_id': instance.sensor_id,
-            'type': 'temperature',
-            'temperature': instance.temperature,
-            'humidity': instance.humidity,
-            'pressure': instance.pressure,
-            'time': instance.time.isoformat(),
-        }
-        broadcast_sensor_data(data)
-
-
-class SensorDataAirListCreateAPIView(generics.ListCreateAPIView):
-    queryset = SensorDataAir.objects.all().order_by('-time')
+
+class SensorDataAirListCreateAPIView(ReadingFilterMixin, BulkCreateMixin, generics.ListCreateAPIView):
+    queryset = SensorDataAir.objects.all().order_by('-time', '-id')
     serializer_class = SensorDataAirSerializer
+    pagination_class = TimeKeysetPagination
+    kind = 'air'
 
-    def perform_create(self, serializer):
-        instance = serializer.save()
-        data = {
-            'sensor_id': instance.sensor_id,
-            'type': 'air',
-            'pm10': instance.p1,
-            'pm25': instance.p2,
-            'temperature': instance.temperature,
-            'humidity': instance.humidity,
-            'pressure': instance.pressure,
-            'signal': instance.signal,
-            'time': instance.time.isoformat(),
-        }
-        broadcast_sensor_data(data)
-
-
-class SensorDataIndoorListCreateAPIView(generics.ListCreateAPIView):
-    queryset = SensorDataIndoor.objects.all().order_by('-time')
+
+class SensorDataIndoorListCreateAPIView(ReadingFilterMixin, BulkCreateMixin, generics.ListCreateAPIView):
+    queryset = SensorDataIndoor.objects.all().order_by('-time', '-id')
     serializer_class = SensorDataIndoorSerializer
+    pagination_class = TimeKeysetPagination
+    kind = 'indoor'
 
-    def perform_create(self, serializer):
-        instance = serializer.save()
-        data = {
-            'sensor_id': instance.sensor_id,
-            'type': 'indoor',
-            'aqi': instance.aqi,
-            'tvoc': instance.tvoc,
-            'eco2': instance.eco2,
-            'time': instance.time.isoformat(),
-        }
-        broadcast_sensor_data(data)
+
+class SensorDataCopyAPIView(APIView):
+    """
+    Stream an NDJSON or CSV body into a sensor data hypertable with COPY.
+
+    CSV bodies need a header row naming the columns (``time``, ``sensor_id``
+    and the reading fields). Invalid lines are skipped and reported.
+    """
+    content_types = {
+        'application/x-ndjson': 'ndjson',
+        'application/jsonl': 'ndjson',
+        'text/csv': 'csv',
+    }
+
+    def post(self, request, kind, *args, **kwargs):
+        if kind not in SENSOR_DATA_MODELS:
+            return Response({"error": "Unknown sensor data type."}, status=status.HTTP_404_NOT_FOUND)
+
+        content_type = request.content_type.split(';')[0].strip().lower()
+        fmt = self.content_types.get(content_type)
+        if fmt is None:
+            return Response(
+                {"error": f"Unsupported content type, use one of: {', '.join(self.content_types)}."},
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+
+        body = _request_body(request)
+        if body is None:
+            return Response({"error": "Request body is empty."}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            # Aborting the COPY rolls back every line already streamed
+            result = copy_readings(kind, read_lines(body), fmt)
+        except LineTooLong as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        response_status = status.HTTP_201_CREATED if result.accepted else status.HTTP_400_BAD_REQUEST
+        return Response(result.as_dict(), status=response_status)
+
+
+class IngestQueueStatusAPIView(APIView):
+    """
+    Report the depth of the write-behind ingest queue per reading type.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response({'mode': settings.INGEST_MODE, 'queues': queue_depth()})
+
+
+class SocketStatsAPIView(APIView):
+    """
+    Report the WebSocket send counters summed over all workers.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return Response(socket_stats())
 
 
 class SensorDataTempLatestAPIView(generics.RetrieveAPIView):
     serializer_class = SensorDataTempSerializer
     pagination_class = None  # Disable pagination for this view
+    kind = 'temperature'
 
     def get_object(self):
         sensor_id = self.kwargs.get('sensor_id')
-        return SensorDataTemp.objects.filter(
-            sensor_id=sensor_id
-        ).order_by('-time').first()
+        return get_latest(self.kind, sensor_id)
 
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = series_validators(request, [self.kind], self.kwargs.get('sensor_id'))
+        return conditional_response(
+            request, etag, last_modified, partial(super().retrieve, request, *args, **kwargs)
+        )
 
-# api/views.py
-class WeatherDataAPIView(APIView):
-    def get(self, request, *args, **kwargs):
-        load_dotenv()
-        API_KEY = os.getenv('OPENWEATHERMAP_API_KEY')
 
-        if not API_KEY:
-            return Response(
-                {"error": "Weather API key is missing. Please configure it."},
-                status=status.HTTP_200_OK
-            )
+class SensorDataAirLatestAPIView(SensorDataTempLatestAPIView):
+    serializer_class = SensorDataAirSerializer
+    kind = 'air'
 
-        url = f'https://api.openweathermap.org/data/2.5/weather?lat={LAT}&lon={LON}&appid={API_KEY}&units=metric'
-        response = requests.get(url)
 
-        if response.status_code != 200:
-            return Response(
-                {"error": f"Failed to fetch weather data: {response.status_code} {response.text}"},
-                status=status.HTTP_200_OK
-            )
+class SensorDataIndoorLatestAPIView(SensorDataTempLatestAPIView):
+    serializer_class = SensorDataIndoorSerializer
+    kind = 'indoor'
+
 
-        return Response(response.json())
+class OpenWeatherMapView(View):
+    """
+    Serve an OpenWeatherMap endpoint through the cached proxy.
 
+    The handler is async and runs the proxy on a thread of its own, so a
+    cold miss waits for the upstream without holding the thread that sync
+    views share under ASGI.
+    """
+    upstream_path = None
+    upstream_params = None
+    label = None
 
-class AirPollutionDataAPIView(APIView):
-    def get(self, request, *args, **kwargs):
-        load_dotenv()
-        API_KEY = os.getenv('OPENWEATHERMAP_API_KEY')
+    async def get(self, request, *args, **kwargs):
+        if not OPENWEATHERMAP_API_KEY:
+            return JsonResponse({"error": f"{self.label} API key is missing. Please configure it."})
 
-        if not API_KEY:
-            return Response(
-                {"error": "Air pollution API key is missing. Please configure it."},
-                status=status.HTTP_200_OK
+        try:
+            data = await sync_to_async(openweathermap.get, thread_sensitive=False)(
+                self.upstream_path, self.upstream_params
             )
+        except UpstreamError as e:
+            return JsonResponse({"error": f"Failed to fetch {self.label.lower()} data: {e}"})
 
-        url = f'https://api.openweathermap.org/data/2.5/air_pollution?lat={LAT}&lon={LON}&appid={API_KEY}'
-        response = requests.get(url)
+        return JsonResponse(data, safe=False)
+
+
+class WeatherDataAPIView(OpenWeatherMapView):
+    upstream_path = 'weather'
+    upstream_params = {'lat': LAT, 'lon': LON, 'units': 'metric'}
+    label = 'Weather'
 
-        if response.status_code != 200:
-            return Response(
-                {"error": f"Failed to fetch air pollution data: {response.status_code} {response.text}"},
-                status=status.HTTP_200_OK
-            )
 
-        return Response(response.json())
+class AirPollutionDataAPIView(OpenWeatherMapView):
+    upstream_path = 'air_pollution'
+    upstream_params = {'lat': LAT, 'lon': LON}
+    label = 'Air pollution'
 
 
 class ToggleSchedulerAPIView(APIView):
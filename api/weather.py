@@ -0,0 +1,176 @@
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+from django.core.cache import cache
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+OPENWEATHERMAP_API_KEY = os.getenv('OPENWEATHERMAP_API_KEY')
+OPENWEATHERMAP_URL = 'https://api.openweathermap.org/data/2.5/'
+
+CACHE_TTL = 300  # Seconds a response is served as fresh
+STALE_TTL = 3600  # Seconds a response may be served stale while it is refreshed
+REQUEST_TIMEOUT = (3.05, 5)  # Connect and read timeouts
+FLIGHT_TIMEOUT = 10  # Seconds a request waits for a concurrent fetch of the same URL
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """
+    Stop calling the upstream after repeated failures for ``reset_timeout``.
+
+    Once the timeout has passed a single trial call is let through; its
+    outcome closes the circuit again or restarts the timeout.
+    """
+
+    def __init__(self, failure_threshold=3, reset_timeout=60):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._opened_at = time.monotonic()  # Half open: one trial call
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class CachedProxy:
+    """
+    Cached, single-flight client for an upstream JSON API.
+
+    Responses are shared between workers through Django's cache. A fresh
+    entry is returned as is, a stale one is returned while one background
+    thread refreshes it, and concurrent misses for the same URL in this
+    process wait for a single upstream call.
+    """
+
+    def __init__(self, base_url, default_params=None, ttl=CACHE_TTL, stale_ttl=STALE_TTL, timeout=REQUEST_TIMEOUT):
+        self.base_url = base_url
+        self.default_params = default_params or {}
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.timeout = timeout
+        self.breaker = CircuitBreaker()
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=10))
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, params):
+        key = f"proxy:{self.base_url}{path}?{urlencode(sorted(params.items()))}"
+        entry = self._cache_get(key)
+        if entry is not None:
+            age = time.time() - entry['fetched_at']
+            if age < self.ttl:
+                return entry['data']
+            if age < self.ttl + self.stale_ttl:
+                self._start_flight(key, path, params, background=True)
+                return entry['data']
+        return self._start_flight(key, path, params)
+
+    def _start_flight(self, key, path, params, background=False):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if leader and background:
+            threading.Thread(target=self._fly, args=(key, path, params, flight), daemon=True).start()
+            return None
+        if leader:
+            self._fly(key, path, params, flight)
+        elif background:
+            return None
+        elif not flight.done.wait(FLIGHT_TIMEOUT):
+            raise UpstreamError("Timed out waiting for the upstream response")
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def _fly(self, key, path, params, flight):
+        try:
+            flight.result = self._fetch(path, params)
+            self._cache_set(key, {'data': flight.result, 'fetched_at': time.time()})
+        except UpstreamError as e:
+            flight.error = e
+        except Exception as e:
+            # Waiting requests must not mistake a failed flight for an empty response
+            logger.exception("Upstream fetch of %s failed", path)
+            flight.error = UpstreamError(f"Unexpected error: {e}")
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+    def _fetch(self, path, params):
+        if not self.breaker.allow():
+            raise UpstreamError("Upstream is unavailable, retrying later")
+        try:
+            response = self.session.get(
+                self.base_url + path, params={**self.default_params, **params}, timeout=self.timeout
+            )
+        except requests.RequestException as e:
+            self.breaker.record_failure()
+            raise UpstreamError(f"Request failed: {e}")
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if response.status_code != 200:
+            raise UpstreamError(f"{response.status_code} {response.text}")
+        try:
+            return response.json()
+        except ValueError as e:
+            raise UpstreamError(f"Invalid response: {e}")
+
+    def _cache_get(self, key):
+        try:
+            return cache.get(key)
+        except Exception as e:
+            logger.warning("Proxy cache read failed: %s", e)
+            return None
+
+    def _cache_set(self, key, entry):
+        try:
+            cache.set(key, entry, self.ttl + self.stale_ttl)
+        except Exception as e:
+            logger.warning("Proxy cache write failed: %s", e)
+
+
+openweathermap = CachedProxy(OPENWEATHERMAP_URL, {'appid': OPENWEATHERMAP_API_KEY})
@@ -46,7 +46,7 @@ def send_temp_data_to_api(sensor_id, temperature, humidity, pressure=None, time=
             "humidity": humidity
         }
         response = requests.post(CONFIG['api_temp_url'], json=payload)
-        if response.status_code == 201:
+        if response.status_code in (201, 202):
             print("Data sent to API successfully:", response.json())
             success = True
         else:
@@ -196,7 +196,7 @@ def send_indoor_data_to_api(sensor_id, aqi, tvoc, e_co2, time=None) -> bool:
             "eco2": e_co2
         }
         response = requests.post(CONFIG['api_indoor_url'], json=payload)
-        if response.status_code == 201:
+        if response.status_code in (201, 202):
             print("Data sent to API successfully:", response.json())
             success = True
         else:
@@ -261,7 +261,7 @@ def send_air_data_to_api(sensor_id, pm10, pm25, temperature=None, humidity=None,
             "signal": signal
         }
         response = requests.post(CONFIG['api_air_url'], json=payload)
-        if response.status_code == 201:
+        if response.status_code in (201, 202):
             print("Data sent to API successfully:", response.json())
             success = True
         else:
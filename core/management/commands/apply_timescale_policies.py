@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.timescale import apply_policies
+
+
+class Command(BaseCommand):
+    help = "Apply the chunk interval, compression and retention policies of TIMESCALE_POLICIES."
+
+    def add_arguments(self, parser):
+        parser.add_argument('tables', nargs='*', help="Hypertables to update (default: all configured).")
+        parser.add_argument(
+            '--compress-now', action='store_true',
+            help="Also compress every chunk already older than COMPRESS_AFTER instead of waiting for the policy.",
+        )
+
+    def handle(self, *args, **options):
+        policies = settings.TIMESCALE_POLICIES
+        tables = options['tables'] or list(policies)
+        unknown = [table for table in tables if table not in policies]
+        if unknown:
+            raise CommandError(f"No policy configured for: {', '.join(unknown)}")
+
+        for table in tables:
+            try:
+                statements = apply_policies(table, policies[table], compress_now=options['compress_now'])
+            except ValueError as e:
+                raise CommandError(str(e))
+            self.stdout.write(f"{table}:")
+            for statement in statements:
+                self.stdout.write(f"  {statement}")
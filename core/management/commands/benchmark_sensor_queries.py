@@ -0,0 +1,77 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.models import SENSOR_DATA_MODELS
+from core.partitioning import space_partitions
+
+QUERIES = {
+    'latest': "SELECT * FROM {table} WHERE sensor_id = %s ORDER BY time DESC LIMIT 1",
+    'history': """
+        SELECT time_bucket('1 hour', time) AS b, count(*) FROM {table}
+        WHERE sensor_id = %s AND time >= now() - %s::interval
+        GROUP BY b ORDER BY b
+    """,
+}
+
+
+def _chunks_in_plan(node):
+    # Chunk scans left in the plan after exclusion. A compressed chunk is read
+    # through a scan of its compress_hyper_ chunk, below a DecompressChunk
+    # node that may name the chunk itself, so a subtree counts at most once.
+    if node.get('Relation Name', '').startswith(('_hyper_', 'compress_hyper_')):
+        return 1
+    return sum(_chunks_in_plan(child) for child in node.get('Plans', []))
+
+
+class Command(BaseCommand):
+    help = (
+        "Time per-sensor latest and history queries. After partition_by_sensor the "
+        "<table>_unpartitioned copies are measured too, for a before/after comparison."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sensors', type=int, default=20, help="Number of sensors sampled.")
+        parser.add_argument('--repeat', type=int, default=5, help="Runs per sensor and query.")
+        parser.add_argument('--window', default='7 days', help="History window.")
+
+    def handle(self, *args, **options):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT id FROM sensors ORDER BY random() LIMIT %s", [options['sensors']])
+            sensor_ids = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT hypertable_name FROM timescaledb_information.hypertables")
+            hypertables = {row[0] for row in cursor.fetchall()}
+
+            self.stdout.write(f"{'table':<36} {'query':<8} {'p50 ms':>8} {'p95 ms':>8} {'chunks':>7}")
+            for model in SENSOR_DATA_MODELS.values():
+                table = model._meta.db_table
+                for candidate in (f"{table}_unpartitioned", table):
+                    if candidate in hypertables:
+                        self._benchmark(cursor, candidate, sensor_ids, options)
+
+    def _benchmark(self, cursor, table, sensor_ids, options):
+        label = f"{table} ({space_partitions(table) or 1} partitions)"
+        for name, sql in QUERIES.items():
+            sql = sql.format(table=table)
+            timings = []
+            chunks = []
+            for sensor_id in sensor_ids:
+                params = [sensor_id] if name == 'latest' else [sensor_id, options['window']]
+                cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+                plan = cursor.fetchone()[0]
+                plan = json.loads(plan) if isinstance(plan, str) else plan
+                chunks.append(_chunks_in_plan(plan[0]['Plan']))
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    cursor.execute(sql, params)
+                    cursor.fetchall()
+                    timings.append((time.perf_counter() - started) * 1000)
+            if not timings:
+                continue
+            p95 = statistics.quantiles(timings, n=20)[-1] if len(timings) > 1 else timings[0]
+            self.stdout.write(
+                f"{label:<36} {name:<8} {statistics.median(timings):>8.2f} {p95:>8.2f} {statistics.mean(chunks):>7.1f}"
+            )
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import SENSOR_DATA_MODELS
+from core.partitioning import SpacePartitioner
+from core.timescale import apply_policies
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild sensor hypertables with hash partitioning on sensor_id. Writes are blocked "
+        "during the final swap and history queries fail until the aggregates are recreated."
+    )
+
+    def add_arguments(self, parser):
+        tables = [model._meta.db_table for model in SENSOR_DATA_MODELS.values()]
+        parser.add_argument('tables', nargs='+', choices=tables, help="Hypertables to partition.")
+        parser.add_argument(
+            '--partitions', type=int, required=True,
+            help="Number of hash partitions, e.g. the number of data nodes or disks.",
+        )
+
+    def handle(self, *args, **options):
+        if options['partitions'] < 2:
+            raise CommandError("--partitions must be at least 2")
+        for table in options['tables']:
+            try:
+                SpacePartitioner(table, options['partitions'], log=self.stdout.write).run()
+            except ValueError as e:
+                raise CommandError(str(e))
+            policy = settings.TIMESCALE_POLICIES.get(table)
+            if policy is not None:
+                apply_policies(table, policy)
+            self.stdout.write(self.style.SUCCESS(f"{table} is partitioned by sensor_id"))
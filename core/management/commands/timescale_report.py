@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from core.models import SENSOR_DATA_MODELS
+from core.timescale import chunk_report
+
+
+class Command(BaseCommand):
+    help = "Show chunk counts, sizes and compression ratios of the sensor hypertables."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunks', action='store_true', help="List every chunk.")
+
+    def handle(self, *args, **options):
+        for model in SENSOR_DATA_MODELS.values():
+            table = model._meta.db_table
+            chunks = chunk_report(table)
+            compressed = [chunk for chunk in chunks if chunk[2]]
+            before = sum(chunk[3] or 0 for chunk in compressed)
+            after = sum(chunk[4] or 0 for chunk in compressed)
+            total = sum(chunk[4] or 0 for chunk in chunks)
+
+            self.stdout.write(self.style.MIGRATE_HEADING(table))
+            self.stdout.write(
+                f"  {len(chunks)} chunks, {len(compressed)} compressed, {filesizeformat(total)} on disk"
+            )
+            if compressed:
+                self.stdout.write(
+                    f"  compressed chunks: {filesizeformat(before)} -> {filesizeformat(after)}"
+                    f" ({before / after if after else 0:.1f}x)"
+                )
+            if options['chunks']:
+                for start, end, is_compressed, chunk_before, chunk_after in chunks:
+                    ratio = f"{chunk_before / chunk_after:.1f}x" if is_compressed and chunk_after else '-'
+                    self.stdout.write(
+                        f"  {start:%Y-%m-%d %H:%M} .. {end:%Y-%m-%d %H:%M}  "
+                        f"{filesizeformat(chunk_after or 0):>10}  {ratio}"
+                    )
@@ -0,0 +1,25 @@
+# Generated by Django 5.2 on 2026-10-18 10:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensordataair',
+            index=models.Index(fields=['sensor', '-time'], name='sensor_data_air_sensor_time'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordataindoor',
+            index=models.Index(fields=['sensor', '-time'], name='sensor_data_indoor_sensor_time'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordatatemp',
+            index=models.Index(fields=['sensor', '-time'], name='sensor_data_temp_sensor_time'),
+        ),
+    ]
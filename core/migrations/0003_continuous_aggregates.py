@@ -0,0 +1,68 @@
+from django.db import migrations
+
+# Frozen copy of core.timescale at the time of this migration:
+# (suffix, bucket width, refresh start offset, refresh schedule)
+LEVELS = [
+    ('1h', '1 hour', '3 days', '30 minutes'),
+    ('6h', '6 hours', '7 days', '1 hour'),
+    ('1d', '1 day', '30 days', '6 hours'),
+    ('1w', '1 week', '90 days', '1 day'),
+]
+
+TABLES = {
+    'sensor_data_temp': ['temperature', 'humidity', 'pressure'],
+    'sensor_data_air': ['temperature', 'humidity', 'pressure', 'p1', 'p2'],
+    'sensor_data_indoor': ['aqi', 'tvoc', 'eco2'],
+}
+
+
+def aggregate_operations():
+    operations = []
+    for table, columns in TABLES.items():
+        aggregates = ',\n'.join(
+            f"       sum({column}) AS {column}_sum, count({column}) AS {column}_count" for column in columns
+        )
+        for suffix, width, start_offset, schedule in LEVELS:
+            view = f"{table}_{suffix}"
+            operations += [
+                # materialized_only = false turns on real-time aggregation: the
+                # buckets past the last refresh are computed from raw rows
+                migrations.RunSQL(
+                    f"""
+                    CREATE MATERIALIZED VIEW {view}
+                    WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+                    SELECT time_bucket('{width}', time) AS bucket, sensor_id,
+                    {aggregates}
+                    FROM {table}
+                    GROUP BY bucket, sensor_id
+                    WITH NO DATA
+                    """,
+                    reverse_sql=f"DROP MATERIALIZED VIEW IF EXISTS {view}",
+                ),
+                # Only closed buckets are materialized, the open one stays real-time
+                migrations.RunSQL(
+                    f"""
+                    SELECT add_continuous_aggregate_policy('{view}',
+                        start_offset => INTERVAL '{start_offset}',
+                        end_offset => INTERVAL '{width}',
+                        schedule_interval => INTERVAL '{schedule}')
+                    """,
+                    reverse_sql=migrations.RunSQL.noop,
+                ),
+                migrations.RunSQL(
+                    f"CALL refresh_continuous_aggregate('{view}', NULL, time_bucket(INTERVAL '{width}', now()))",
+                    reverse_sql=migrations.RunSQL.noop,
+                ),
+            ]
+    return operations
+
+
+class Migration(migrations.Migration):
+    # Continuous aggregates cannot be created or refreshed inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0002_sensor_time_indexes'),
+    ]
+
+    operations = aggregate_operations()
@@ -0,0 +1,84 @@
+from django.db import migrations
+
+# Frozen copy of core.timescale at the time of this migration:
+# (suffix, bucket width, refresh start offset, refresh schedule)
+LEVELS = [
+    ('1h', '1 hour', '3 days', '30 minutes'),
+    ('6h', '6 hours', '7 days', '1 hour'),
+    ('1d', '1 day', '30 days', '6 hours'),
+    ('1w', '1 week', '90 days', '1 day'),
+]
+
+TABLES = {
+    'sensor_data_temp': ['temperature', 'humidity', 'pressure'],
+    'sensor_data_air': ['temperature', 'humidity', 'pressure', 'p1', 'p2'],
+    'sensor_data_indoor': ['aqi', 'tvoc', 'eco2'],
+}
+
+
+def sum_count(column):
+    return f"sum({column}) AS {column}_sum, count({column}) AS {column}_count"
+
+
+def statistics(column):
+    # Extremes and the sum of squares merge across buckets like sum and count,
+    # so min, max and stddev of any coarser bucket follow from them
+    return (
+        f"{sum_count(column)}, min({column}) AS {column}_min, max({column}) AS {column}_max, "
+        f"sum({column}::float8 * {column}) AS {column}_sumsq"
+    )
+
+
+def create_view(table, level, aggregate):
+    suffix, width, start_offset, schedule = level
+    view = f"{table}_{suffix}"
+    aggregates = ',\n'.join(f"       {aggregate(column)}" for column in TABLES[table])
+    return [
+        f"""
+        CREATE MATERIALIZED VIEW {view}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT time_bucket('{width}', time) AS bucket, sensor_id,
+        {aggregates}
+        FROM {table}
+        GROUP BY bucket, sensor_id
+        WITH NO DATA
+        """,
+        f"""
+        SELECT add_continuous_aggregate_policy('{view}',
+            start_offset => INTERVAL '{start_offset}',
+            end_offset => INTERVAL '{width}',
+            schedule_interval => INTERVAL '{schedule}')
+        """,
+        f"CALL refresh_continuous_aggregate('{view}', NULL, time_bucket(INTERVAL '{width}', now()))",
+    ]
+
+
+def recreate_operations():
+    operations = []
+    for table in TABLES:
+        for level in LEVELS:
+            view = f"{table}_{level[0]}"
+            # Continuous aggregates cannot be altered to add columns, and
+            # dropping one also drops its refresh policy
+            operations += [
+                migrations.RunSQL(
+                    f"DROP MATERIALIZED VIEW IF EXISTS {view}",
+                    reverse_sql=create_view(table, level, sum_count),
+                ),
+                migrations.RunSQL(
+                    create_view(table, level, statistics),
+                    reverse_sql=f"DROP MATERIALIZED VIEW IF EXISTS {view}",
+                ),
+            ]
+    return operations
+
+
+class Migration(migrations.Migration):
+    # Continuous aggregates cannot be created or refreshed inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('core', '0003_continuous_aggregates'),
+    ]
+
+    operations = recreate_operations()
@@ -0,0 +1,50 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLES = ['sensor_data_temp', 'sensor_data_air', 'sensor_data_indoor']
+
+
+def compression_operations():
+    # Compressed chunks store one segment per sensor, ordered newest first,
+    # which matches the (sensor_id, time DESC) access path of the API
+    return [
+        migrations.RunSQL(
+            f"""
+            ALTER TABLE {table} SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'sensor_id',
+                timescaledb.compress_orderby = 'time DESC'
+            )
+            """,
+            reverse_sql=f"ALTER TABLE {table} SET (timescaledb.compress = false)",
+        )
+        for table in TABLES
+    ]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_aggregate_statistics'),
+    ]
+
+    operations = [
+        # The standalone foreign key indexes duplicate the leading column of
+        # the (sensor, -time) indexes and are dropped before compression
+        migrations.AlterField(
+            model_name='sensordataair',
+            name='sensor',
+            field=models.ForeignKey(db_column='sensor_id', db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.sensor'),
+        ),
+        migrations.AlterField(
+            model_name='sensordataindoor',
+            name='sensor',
+            field=models.ForeignKey(db_column='sensor_id', db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.sensor'),
+        ),
+        migrations.AlterField(
+            model_name='sensordatatemp',
+            name='sensor',
+            field=models.ForeignKey(db_column='sensor_id', db_index=False, on_delete=django.db.models.deletion.CASCADE, to='core.sensor'),
+        ),
+        *compression_operations(),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # Keyset pages are read in (time DESC, id DESC) order, with or without a
+    # sensor filter; ending both indexes on id lets a page be one index range
+    # scan without sorting readings that share a time
+
+    dependencies = [
+        ('core', '0005_hypertable_compression'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='sensordataair',
+            name='sensor_data_air_sensor_time',
+        ),
+        migrations.AddIndex(
+            model_name='sensordataair',
+            index=models.Index(fields=['sensor', '-time', '-id'], name='sensor_data_air_sensor_time'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordataair',
+            index=models.Index(fields=['-time', '-id'], name='sensor_data_air_time_id'),
+        ),
+        migrations.RemoveIndex(
+            model_name='sensordataindoor',
+            name='sensor_data_indoor_sensor_time',
+        ),
+        migrations.AddIndex(
+            model_name='sensordataindoor',
+            index=models.Index(fields=['sensor', '-time', '-id'], name='sensor_data_indoor_sensor_time'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordataindoor',
+            index=models.Index(fields=['-time', '-id'], name='sensor_data_indoor_time_id'),
+        ),
+        migrations.RemoveIndex(
+            model_name='sensordatatemp',
+            name='sensor_data_temp_sensor_time',
+        ),
+        migrations.AddIndex(
+            model_name='sensordatatemp',
+            index=models.Index(fields=['sensor', '-time', '-id'], name='sensor_data_temp_sensor_time'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordatatemp',
+            index=models.Index(fields=['-time', '-id'], name='sensor_data_temp_time_id'),
+        ),
+    ]
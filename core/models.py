@@ -16,7 +16,8 @@ class Sensor(models.Model):
 
 
 class SensorDataTemp(TimescaleModel):
-    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_column='sensor_id')
+    # The (sensor, -time) index serves sensor_id lookups on every hypertable
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_column='sensor_id', db_index=False)
     temperature = models.FloatField()
     humidity = models.FloatField()
     pressure = models.FloatField(null=True, blank=True)
@@ -24,11 +25,15 @@ class SensorDataTemp(TimescaleModel):
     class Meta:
         db_table = 'sensor_data_temp'
         verbose_name_plural = "Temperature Data"
+        indexes = [
+            models.Index(fields=['sensor', '-time', '-id'], name='sensor_data_temp_sensor_time'),
+            models.Index(fields=['-time', '-id'], name='sensor_data_temp_time_id'),
+        ]
         # ordering = ['-time']
 
 
 class SensorDataAir(TimescaleModel):
-    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_column='sensor_id')
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_column='sensor_id', db_index=False)
     temperature = models.FloatField()
     humidity = models.FloatField()
     pressure = models.FloatField()
@@ -39,10 +44,14 @@ class SensorDataAir(TimescaleModel):
     class Meta:
         db_table = 'sensor_data_air'
         verbose_name_plural = "Air Quality Data (outdoor)"
+        indexes = [
+            models.Index(fields=['sensor', '-time', '-id'], name='sensor_data_air_sensor_time'),
+            models.Index(fields=['-time', '-id'], name='sensor_data_air_time_id'),
+        ]
 
 
 class SensorDataIndoor(TimescaleModel):
-    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_column='sensor_id')
+    sensor = models.ForeignKey(Sensor, on_delete=models.CASCADE, db_column='sensor_id', db_index=False)
     aqi = models.IntegerField()
     tvoc = models.IntegerField()
     eco2 = models.IntegerField()
@@ -50,3 +59,15 @@ class SensorDataIndoor(TimescaleModel):
     class Meta:
         db_table = 'sensor_data_indoor'
         verbose_name_plural = "Air Quality Data (indoor)"
+        indexes = [
+            models.Index(fields=['sensor', '-time', '-id'], name='sensor_data_indoor_sensor_time'),
+            models.Index(fields=['-time', '-id'], name='sensor_data_indoor_time_id'),
+        ]
+
+
+# Reading type (as used in URLs and WebSocket payloads) to hypertable model
+SENSOR_DATA_MODELS = {
+    'temperature': SensorDataTemp,
+    'air': SensorDataAir,
+    'indoor': SensorDataIndoor,
+}
@@ -0,0 +1,203 @@
+import logging
+import re
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+
+def _suffixed(name, suffix):
+    # PostgreSQL truncates identifiers to 63 bytes
+    return f"{name[:63 - len(suffix)]}{suffix}"
+
+
+def _fetch(cursor, sql, params=()):
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+
+def space_partitions(table):
+    """
+    Return the number of hash partitions on ``sensor_id``, or ``None``.
+    """
+    with connection.cursor() as cursor:
+        rows = _fetch(cursor, """
+            SELECT num_partitions FROM timescaledb_information.dimensions
+            WHERE hypertable_name = %s AND column_name = 'sensor_id'
+        """, [table])
+    return rows[0][0] if rows else None
+
+
+class SpacePartitioner:
+    """
+    Rebuild a hypertable with an additional hash dimension on ``sensor_id``.
+
+    TimescaleDB only adds dimensions to empty hypertables, so the rows are
+    copied chunk by chunk into a partitioned copy while the table stays
+    writable. The swap then locks the table, copies the rows written in the
+    meantime, and exchanges the tables along with their indexes, foreign keys
+    and id sequence. The hypertables have no primary key, django-timescaledb
+    drops it. Foreign keys are added ``NOT VALID`` under the lock and
+    validated after it. Continuous aggregates are captured from the catalog,
+    dropped, and recreated on the new table in the same transaction, so no
+    query ever finds them missing; they are refreshed once it commits. The
+    old table is kept as ``<table>_unpartitioned``.
+    """
+
+    def __init__(self, table, partitions, log=logger.info):
+        self.table = table
+        self.partitions = partitions
+        self.new_table = _suffixed(table, '_partitioned')
+        self.old_table = _suffixed(table, '_unpartitioned')
+        self.log = log
+
+    def run(self):
+        if space_partitions(self.table):
+            raise ValueError(f"{self.table} is already partitioned by sensor_id")
+        with connection.cursor() as cursor:
+            self.indexes = _fetch(
+                cursor, "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s", [self.table]
+            )
+            self.aggregates = self._aggregates(cursor)
+            high_water = _fetch(cursor, f"SELECT COALESCE(MAX(id), 0) FROM {self.table}")[0][0]
+            self._create(cursor)
+            self._copy(cursor, high_water)
+        self._swap(high_water)
+        with connection.cursor() as cursor:
+            for name, _ in self.foreign_keys:
+                self.log(f"Validating {name}")
+                cursor.execute(f"ALTER TABLE {self.table} VALIDATE CONSTRAINT {name}")
+            cursor.execute("SELECT remove_compression_policy(%s, if_exists => true)", [self.old_table])
+            cursor.execute("SELECT remove_retention_policy(%s, if_exists => true)", [self.old_table])
+            # Refreshing cannot run inside a transaction
+            for view, _, _, _ in self.aggregates:
+                self.log(f"Refreshing {view}")
+                cursor.execute("CALL refresh_continuous_aggregate(%s, NULL, now())", [view])
+
+    def _aggregates(self, cursor):
+        # (view, definition, materialized_only, [(start, end, schedule)])
+        aggregates = []
+        for view, definition, materialized_only in _fetch(cursor, """
+            SELECT view_name, view_definition, materialized_only
+            FROM timescaledb_information.continuous_aggregates
+            WHERE hypertable_name = %s
+        """, [self.table]):
+            policies = _fetch(cursor, """
+                SELECT config ->> 'start_offset', config ->> 'end_offset', schedule_interval::text
+                FROM timescaledb_information.jobs
+                WHERE proc_name = 'policy_refresh_continuous_aggregate'
+                  AND hypertable_name = (
+                      SELECT materialization_hypertable_name FROM timescaledb_information.continuous_aggregates
+                      WHERE view_name = %s
+                  )
+            """, [view])
+            aggregates.append((view, definition, materialized_only, policies))
+        return aggregates
+
+    def _create(self, cursor):
+        self.log(f"Creating {self.new_table} with {self.partitions} sensor_id partitions")
+        interval = _fetch(cursor, """
+            SELECT time_interval FROM timescaledb_information.dimensions
+            WHERE hypertable_name = %s AND column_name = 'time'
+        """, [self.table])[0][0]
+        cursor.execute(f"DROP TABLE IF EXISTS {self.new_table}")
+        cursor.execute(f"CREATE TABLE {self.new_table} (LIKE {self.table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+        cursor.execute(
+            "SELECT create_hypertable(%s, 'time', partitioning_column => 'sensor_id', number_partitions => %s,"
+            " chunk_time_interval => %s, create_default_indexes => false)",
+            [self.new_table, self.partitions, interval],
+        )
+        compression = _fetch(cursor, """
+            SELECT string_agg(attname, ', ') FILTER (WHERE segmentby_column_index IS NOT NULL),
+                   string_agg(attname || CASE WHEN orderby_asc THEN '' ELSE ' DESC' END, ', ')
+                       FILTER (WHERE orderby_column_index IS NOT NULL)
+            FROM timescaledb_information.compression_settings
+            WHERE hypertable_name = %s
+        """, [self.table])[0]
+        if compression[0] or compression[1]:
+            cursor.execute(
+                f"ALTER TABLE {self.new_table} SET (timescaledb.compress,"
+                f" timescaledb.compress_segmentby = %s, timescaledb.compress_orderby = %s)",
+                [compression[0] or '', compression[1] or ''],
+            )
+        # Indexes are built up front under temporary names so the swap only renames them
+        for name, definition in self.indexes:
+            match = re.match(r'(CREATE (?:UNIQUE )?INDEX) \S+ ON \S+ (.*)', definition)
+            cursor.execute(f"{match.group(1)} {_suffixed(name, '_p')} ON {self.new_table} {match.group(2)}")
+
+    def _copy(self, cursor, high_water):
+        chunks = _fetch(cursor, """
+            SELECT range_start, range_end FROM timescaledb_information.chunks
+            WHERE hypertable_name = %s ORDER BY range_start
+        """, [self.table])
+        for i, (start, end) in enumerate(chunks, 1):
+            cursor.execute(
+                f"INSERT INTO {self.new_table} SELECT * FROM {self.table} WHERE time >= %s AND time < %s AND id <= %s",
+                [start, end, high_water],
+            )
+            self.log(f"Copied chunk {i}/{len(chunks)} ({start:%Y-%m-%d}): {cursor.rowcount} rows")
+
+    def _swap(self, high_water):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {self.table} IN EXCLUSIVE MODE")
+            # Rows written during the copy, including late readings, have higher ids
+            cursor.execute(f"INSERT INTO {self.new_table} SELECT * FROM {self.table} WHERE id > %s", [high_water])
+            self.log(f"Copied {cursor.rowcount} rows written during the copy")
+
+            for view, _, _, _ in self.aggregates:
+                cursor.execute(f"DROP MATERIALIZED VIEW {view}")
+
+            self.foreign_keys = _fetch(cursor, """
+                SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint
+                WHERE conrelid = %s::regclass AND contype = 'f'
+            """, [self.table])
+            sequences = _fetch(cursor, """
+                SELECT attname, attidentity, pg_get_serial_sequence(%s, attname) FROM pg_attribute
+                WHERE attrelid = %s::regclass AND attnum > 0 AND NOT attisdropped
+                  AND pg_get_serial_sequence(%s, attname) IS NOT NULL
+            """, [self.table, self.table, self.table])
+
+            cursor.execute(f"ALTER TABLE {self.table} RENAME TO {self.old_table}")
+            for name, _ in self.indexes:
+                cursor.execute(f"ALTER INDEX {name} RENAME TO {_suffixed(name, '_unpart')}")
+            for name, _ in self.foreign_keys:
+                cursor.execute(f"ALTER TABLE {self.old_table} RENAME CONSTRAINT {name} TO {_suffixed(name, '_unpart')}")
+
+            cursor.execute(f"ALTER TABLE {self.new_table} RENAME TO {self.table}")
+            for name, _ in self.indexes:
+                cursor.execute(f"ALTER INDEX {_suffixed(name, '_p')} RENAME TO {name}")
+            # Checking every row would hold the lock for a full scan, see run()
+            for name, definition in self.foreign_keys:
+                cursor.execute(f"ALTER TABLE {self.table} ADD CONSTRAINT {name} {definition} NOT VALID")
+            for column, identity, sequence in sequences:
+                if identity:
+                    # Identity sequences belong to their column and are not copied by LIKE
+                    generated = 'ALWAYS' if identity == 'a' else 'BY DEFAULT'
+                    cursor.execute(
+                        f"ALTER TABLE {self.table} ALTER COLUMN {column} ADD GENERATED {generated} AS IDENTITY"
+                    )
+                    cursor.execute(
+                        f"SELECT setval(pg_get_serial_sequence(%s, %s),"
+                        f" (SELECT COALESCE(MAX({column}), 0) + 1 FROM {self.table}), false)",
+                        [self.table, column],
+                    )
+                else:
+                    cursor.execute(f"ALTER SEQUENCE {sequence} OWNED BY {self.table}.{column}")
+            self._recreate_aggregates(cursor)
+        self.log(f"Swapped {self.table}, the previous table is kept as {self.old_table}")
+
+    def _recreate_aggregates(self, cursor):
+        # Created empty, since materializing data cannot run inside a transaction
+        for view, definition, materialized_only, policies in self.aggregates:
+            self.log(f"Recreating {view}")
+            cursor.execute(
+                f"CREATE MATERIALIZED VIEW {view} WITH (timescaledb.continuous,"
+                f" timescaledb.materialized_only = {str(materialized_only).lower()})"
+                f" AS {definition.rstrip().rstrip(';')} WITH NO DATA"
+            )
+            for start_offset, end_offset, schedule in policies:
+                cursor.execute(
+                    "SELECT add_continuous_aggregate_policy(%s, start_offset => %s::interval,"
+                    " end_offset => %s::interval, schedule_interval => %s::interval)",
+                    [view, start_offset, end_offset, schedule],
+                )
@@ -0,0 +1,108 @@
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+from core.utils.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+MAX_REMEMBERED_MISSES = 10000  # Bounds the unknown ids kept when clients send random ones
+
+
+class SensorRegistry:
+    """
+    In-process map of sensor id to sensor type, loaded once per worker.
+
+    The map is dropped when a ``Sensor`` is saved or deleted in this process,
+    when another worker announces a change on the Redis channel, or after
+    ``SENSOR_REGISTRY_TTL`` seconds as a safety net. Unknown ids are
+    remembered for ``SENSOR_REGISTRY_MISS_TTL`` seconds.
+    """
+
+    def __init__(self):
+        self._sensors = None
+        self._misses = {}
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def _get(self):
+        sensors = self._sensors
+        if sensors is not None and time.monotonic() - self._loaded_at < settings.SENSOR_REGISTRY_TTL:
+            return sensors
+        from core.models import Sensor
+
+        with self._lock:
+            if self._sensors is None or time.monotonic() - self._loaded_at >= settings.SENSOR_REGISTRY_TTL:
+                self._sensors = dict(Sensor.objects.values_list('id', 'type'))
+                self._loaded_at = time.monotonic()
+                self._listen()
+            return self._sensors
+
+    def __contains__(self, sensor_id):
+        return self.get_type(sensor_id) is not None
+
+    def get_type(self, sensor_id):
+        """
+        Return the type of a sensor, or ``None`` if the id is unknown.
+        """
+        sensors = self._get()
+        if sensor_id in sensors:
+            return sensors[sensor_id]
+        # Unknown ids are re-checked so a sensor created by another worker is
+        # accepted before its invalidation message arrives, but only once per
+        # miss TTL, since a client sending a bogus id would query every time.
+        misses = self._misses
+        checked_at = misses.get(sensor_id)
+        if checked_at is not None and time.monotonic() - checked_at < settings.SENSOR_REGISTRY_MISS_TTL:
+            return None
+        from core.models import Sensor
+
+        sensor_type = Sensor.objects.filter(id=sensor_id).values_list('type', flat=True).first()
+        if sensor_type is not None:
+            sensors[sensor_id] = sensor_type
+        else:
+            if len(misses) >= MAX_REMEMBERED_MISSES:
+                misses.clear()
+            misses[sensor_id] = time.monotonic()
+        return sensor_type
+
+    def ids(self):
+        return set(self._get())
+
+    def invalidate(self):
+        self._sensors = None
+        self._misses = {}
+
+    def publish_invalidation(self):
+        """
+        Drop the local map and tell the other workers to drop theirs.
+        """
+        self.invalidate()
+        try:
+            get_redis().publish(settings.SENSOR_REGISTRY_CHANNEL, 'invalidate')
+        except Exception as e:
+            logger.warning("Could not publish sensor registry invalidation: %s", e)
+
+    def _listen(self):
+        if self._listener is not None:
+            return
+        try:
+            pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{settings.SENSOR_REGISTRY_CHANNEL: lambda message: self.invalidate()})
+            self._listener = pubsub.run_in_thread(
+                sleep_time=1, daemon=True, exception_handler=self._listener_failed
+            )
+        except Exception as e:
+            logger.warning("Sensor registry is not listening for invalidations: %s", e)
+
+    def _listener_failed(self, exc, pubsub, thread):
+        logger.warning("Sensor registry listener stopped: %s", exc)
+        thread.stop()
+        self._listener = None
+        self.invalidate()
+
+
+sensor_registry = SensorRegistry()
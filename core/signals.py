@@ -0,0 +1,12 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Sensor
+from .registry import sensor_registry
+
+
+@receiver(post_save, sender=Sensor)
+@receiver(post_delete, sender=Sensor)
+def invalidate_sensor_registry(sender, **kwargs):
+    transaction.on_commit(sensor_registry.publish_invalidation)
@@ -1 +1,64 @@
-# Create your tests here.
+from django.core.management import CommandError, call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from core.models import Sensor
+from core.registry import sensor_registry
+from core.timescale import apply_policies
+
+
+@override_settings(SENSOR_REGISTRY_MISS_TTL=60)
+class SensorRegistryTests(TestCase):
+    def setUp(self):
+        sensor_registry.invalidate()
+        self.addCleanup(sensor_registry.invalidate)
+        self.sensor = Sensor.objects.create(type='air', name='airrohr')
+
+    def test_known_sensor_is_served_from_memory(self):
+        self.assertEqual(sensor_registry.get_type(self.sensor.id), 'air')
+
+        with self.assertNumQueries(0):
+            self.assertIn(self.sensor.id, sensor_registry)
+            self.assertEqual(sensor_registry.ids(), {self.sensor.id})
+
+    def test_sensor_created_after_loading_is_looked_up(self):
+        sensor_registry.ids()
+        sensor = Sensor.objects.create(type='indoor', name='ens160')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(sensor_registry.get_type(sensor.id), 'indoor')
+        with self.assertNumQueries(0):
+            self.assertIn(sensor.id, sensor_registry)
+
+    def test_saving_a_sensor_drops_the_map_on_commit(self):
+        sensor_registry.ids()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sensor.type = 'temperature'
+            self.sensor.save()
+
+        self.assertEqual(sensor_registry.get_type(self.sensor.id), 'temperature')
+
+    def test_unknown_sensor_is_checked_once_per_miss_ttl(self):
+        sensor_registry.ids()
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(sensor_registry.get_type(999999))
+            self.assertIsNone(sensor_registry.get_type(999999))
+
+    def test_invalidation_forgets_the_misses(self):
+        self.assertNotIn(999999, sensor_registry)
+        sensor_registry.invalidate()
+
+        # The map is loaded again and the id re-checked
+        with self.assertNumQueries(2):
+            self.assertNotIn(999999, sensor_registry)
+
+
+class TimescalePolicyTests(SimpleTestCase):
+    def test_retention_must_outlive_the_aggregate_refresh_window(self):
+        with self.assertRaisesMessage(ValueError, 'RETAIN_FOR must exceed'):
+            apply_policies('sensor_data_air', {'RETAIN_FOR': '30 days'})
+
+    def test_unconfigured_tables_are_rejected(self):
+        with self.assertRaisesMessage(CommandError, 'sensors'):
+            call_command('apply_timescale_policies', 'sensors')
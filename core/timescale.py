@@ -0,0 +1,137 @@
+import re
+from datetime import datetime, timedelta, timezone
+
+from django.db import connection
+
+# Continuous aggregate resolutions created by migration 0003, finest first:
+# name suffix and bucket width of the ``<table>_<suffix>`` views
+AGGREGATE_LEVELS = [
+    ('1h', '1 hour'),
+    ('6h', '6 hours'),
+    ('1d', '1 day'),
+    ('1w', '1 week'),
+]
+
+# Columns of every hypertable kept as ``<column>_sum``/``_count``/``_min``/``_max``/``_sumsq``
+# (the last three since migration 0004)
+AGGREGATE_COLUMNS = {
+    'sensor_data_temp': ['temperature', 'humidity', 'pressure'],
+    'sensor_data_air': ['temperature', 'humidity', 'pressure', 'p1', 'p2'],
+    'sensor_data_indoor': ['aqi', 'tvoc', 'eco2'],
+}
+
+# Default origin of time_bucket(), buckets are aligned to this Monday
+BUCKET_ORIGIN = datetime(2000, 1, 3, tzinfo=timezone.utc)
+
+_UNIT_SECONDS = {'minute': 60, 'hour': 3600, 'day': 86400, 'week': 604800}
+
+
+def interval_seconds(interval):
+    """
+    Convert a PostgreSQL interval literal such as ``'6 hours'`` to seconds.
+    """
+    match = re.fullmatch(r'(\d+)\s*(minute|hour|day|week)s?', interval.strip())
+    if match is None:
+        raise ValueError(f"Unsupported interval: {interval}")
+    return int(match.group(1)) * _UNIT_SECONDS[match.group(2)]
+
+
+def pick_aggregate(table, bucket):
+    """
+    Return ``(view, width)`` of the coarsest continuous aggregate whose
+    buckets nest exactly in ``bucket``, or ``None`` to use the raw table.
+    """
+    bucket_seconds = interval_seconds(bucket)
+    for suffix, width in reversed(AGGREGATE_LEVELS):
+        if bucket_seconds % interval_seconds(width) == 0:
+            return f"{table}_{suffix}", width
+    return None
+
+
+def bucket_start(moment, seconds):
+    """
+    Return the start of the ``time_bucket`` of width ``seconds`` holding ``moment``.
+    """
+    offset = (moment - BUCKET_ORIGIN).total_seconds() // seconds * seconds
+    return BUCKET_ORIGIN + timedelta(seconds=offset)
+
+
+def refresh_aggregates(table, start, end):
+    """
+    Re-materialize the continuous aggregates of ``table`` between two times.
+
+    Used after backfills older than the refresh policies' start offsets. The
+    window is widened to whole buckets and stops before the open bucket.
+    Must run outside a transaction.
+    """
+    now = datetime.now(timezone.utc)
+    with connection.cursor() as cursor:
+        for suffix, width in AGGREGATE_LEVELS:
+            seconds = interval_seconds(width)
+            window_start = bucket_start(start, seconds)
+            window_end = min(bucket_start(end, seconds) + timedelta(seconds=seconds), bucket_start(now, seconds))
+            if window_end > window_start:
+                cursor.execute(
+                    "CALL refresh_continuous_aggregate(%s, %s, %s)",
+                    [f"{table}_{suffix}", window_start, window_end],
+                )
+
+
+# Largest start offset of the aggregate refresh policies. Raw chunks must
+# outlive it, or a refresh over a dropped range would empty the aggregates.
+AGGREGATE_REFRESH_WINDOW = '90 days'
+
+
+def apply_policies(table, policy, compress_now=False):
+    """
+    Apply a ``TIMESCALE_POLICIES`` entry to a hypertable and return the
+    statements that were run.
+
+    The chunk interval only applies to chunks created afterwards. Existing
+    compression and retention policies are replaced.
+    """
+    retain_for = policy.get('RETAIN_FOR')
+    if retain_for and interval_seconds(retain_for) <= interval_seconds(AGGREGATE_REFRESH_WINDOW):
+        raise ValueError(f"{table}: RETAIN_FOR must exceed {AGGREGATE_REFRESH_WINDOW}")
+
+    statements = []
+    if policy.get('CHUNK_INTERVAL'):
+        statements.append(("SELECT set_chunk_time_interval(%s, %s::interval)", [table, policy['CHUNK_INTERVAL']]))
+    statements.append(("SELECT remove_compression_policy(%s, if_exists => true)", [table]))
+    if policy.get('COMPRESS_AFTER'):
+        statements.append(("SELECT add_compression_policy(%s, %s::interval)", [table, policy['COMPRESS_AFTER']]))
+        if compress_now:
+            statements.append((
+                "SELECT count(compress_chunk(c, if_not_compressed => true))"
+                " FROM show_chunks(%s, older_than => %s::interval) c",
+                [table, policy['COMPRESS_AFTER']],
+            ))
+    statements.append(("SELECT remove_retention_policy(%s, if_exists => true)", [table]))
+    if retain_for:
+        statements.append(("SELECT add_retention_policy(%s, %s::interval)", [table, retain_for]))
+
+    with connection.cursor() as cursor:
+        for sql, params in statements:
+            cursor.execute(sql, params)
+    return [sql % tuple(repr(param) for param in params) for sql, params in statements]
+
+
+def chunk_report(table):
+    """
+    Return ``(range_start, range_end, compressed, bytes_before, bytes_after)``
+    for every chunk of a hypertable, oldest first.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.range_start, c.range_end, c.is_compressed,
+                   COALESCE(s.before_compression_total_bytes, d.total_bytes),
+                   COALESCE(s.after_compression_total_bytes, d.total_bytes)
+            FROM timescaledb_information.chunks c
+            JOIN chunks_detailed_size(%s) d
+              ON d.chunk_schema = c.chunk_schema AND d.chunk_name = c.chunk_name
+            LEFT JOIN chunk_compression_stats(%s) s
+              ON s.chunk_schema = c.chunk_schema AND s.chunk_name = c.chunk_name
+            WHERE c.hypertable_name = %s
+            ORDER BY c.range_start
+        """, [table, table, table])
+        return cursor.fetchall()
@@ -0,0 +1,14 @@
+import redis
+from django.conf import settings
+
+_client = None
+
+
+def get_redis():
+    """
+    Return a process-wide Redis client for the instance used by the channel layer.
+    """
+    global _client
+    if _client is None:
+        _client = redis.Redis(host=settings.REDIS_HOST, port=6379, decode_responses=True)
+    return _client
@@ -84,9 +84,56 @@ CHANNEL_LAYERS = {
         'BACKEND': 'channels_redis.core.RedisChannelLayer',
         'CONFIG': {
             'hosts': [(REDIS_HOST, 6379)],
+            # Consumers drain their channel into a conflating send buffer, so a
+            # full channel means a stalled worker; stale frames are replayable
+            'capacity': int(os.environ.get('CHANNEL_CAPACITY', 200)),
+            'expiry': int(os.environ.get('CHANNEL_EXPIRY', 10)),
         },
     },
 }
+
+# Per-socket send buffer: readings pending beyond MAX_PENDING are dropped, and
+# a socket over it, or stuck in one send, for STALL_TIMEOUT seconds is closed
+WEBSOCKET_BACKPRESSURE = {
+    'MAX_PENDING': int(os.environ.get('WS_MAX_PENDING', 1000)),
+    'STALL_TIMEOUT': int(os.environ.get('WS_STALL_TIMEOUT', 30)),
+}
+
+# Shared cache on the channel layer's Redis (database 1)
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f'redis://{REDIS_HOST}:6379/1',
+    },
+}
+
+# In-process sensor registry used by the ingest serializers
+SENSOR_REGISTRY_CHANNEL = 'sensors:registry'
+SENSOR_REGISTRY_TTL = int(os.environ.get('SENSOR_REGISTRY_TTL', 300))
+SENSOR_REGISTRY_MISS_TTL = int(os.environ.get('SENSOR_REGISTRY_MISS_TTL', 10))
+
+# Ingest mode: 'direct' writes readings on the request path, 'queue' pushes
+# them onto Redis streams drained by `manage.py flush_ingest_queue`
+INGEST_MODE = os.environ.get('INGEST_MODE', 'direct')
+INGEST_QUEUE = {
+    'STREAM_PREFIX': 'sensors:ingest:',
+    'GROUP': 'flusher',
+    'MAXLEN': 1_000_000,  # Unflushed readings per stream before ingest answers 503
+    'RETRY_AFTER': 5,  # Seconds, sent with 503 when a stream is full
+    'BATCH_SIZE': int(os.environ.get('INGEST_BATCH_SIZE', 500)),
+    'MAX_WAIT_MS': int(os.environ.get('INGEST_MAX_WAIT_MS', 1000)),
+}
+
+# Hypertable layout applied by `manage.py apply_timescale_policies`: chunk
+# interval of new chunks, age after which chunks are compressed and age after
+# which they are dropped (None keeps them). Intervals are in minutes, hours,
+# days or weeks; retention must exceed the 90 day aggregate refresh window.
+TIMESCALE_POLICIES = {
+    'sensor_data_temp': {'CHUNK_INTERVAL': '7 days', 'COMPRESS_AFTER': '14 days', 'RETAIN_FOR': None},
+    'sensor_data_air': {'CHUNK_INTERVAL': '7 days', 'COMPRESS_AFTER': '14 days', 'RETAIN_FOR': None},
+    'sensor_data_indoor': {'CHUNK_INTERVAL': '7 days', 'COMPRESS_AFTER': '14 days', 'RETAIN_FOR': None},
+}
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 DATABASES = {
@@ -149,4 +196,10 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+        'api.renderers.ColumnarJSONRenderer',
+        'api.renderers.MessagePackRenderer',
+    ],
 }
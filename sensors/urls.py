@@ -1,182 +1,136 @@
-import json
 import time as _time
 
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.db import connection
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import render
 from django.urls import path, include
+from django.utils import timezone
 from django.views.generic.base import RedirectView
-
-from core.models import SensorDataAir, SensorDataIndoor, SensorDataTemp
-
-
-def _serialize_air(obj):
-    if not obj:
-        return None
-    return {
-        'sensor_id': obj.sensor_id,
-        'type': 'air',
-        'pm10': obj.p1,
-        'pm25': obj.p2,
-        'temperature': obj.temperature,
-        'humidity': obj.humidity,
-        'pressure': obj.pressure,
-        'signal': obj.signal,
-        'time': obj.time.isoformat(),
-    }
-
-
-def _serialize_indoor(obj):
-    if not obj:
-        return None
-    return {
-        'sensor_id': obj.sensor_id,
-        'type': 'indoor',
-        'aqi': obj.aqi,
-        'tvoc': obj.tvoc,
-        'eco2': obj.eco2,
-        'time': obj.time.isoformat(),
-    }
-
-
-def _serialize_temp(obj):
-    if not obj:
-        return None
-    return {
-        'sensor_id': obj.sensor_id,
-        'type': 'temperature',
-        'temperature': obj.temperature,
-        'humidity': obj.humidity,
-        'pressure': obj.pressure,
-        'time': obj.time.isoformat(),
-    }
+from rest_framework.exceptions import ValidationError
+
+from api.conditional import conditional_response, series_validators
+from api.filters import parse_time_param
+from api.history import (
+    HISTORY_MAX_POINTS,
+    HISTORY_MAX_SERIES,
+    HISTORY_RANGES,
+    HISTORY_SERIES,
+    LTTB_MAX_POINTS,
+    choose_bucket,
+    downsampled_rows,
+    history_batch,
+    history_rows,
+    history_state,
+    parse_series,
+    parse_stats,
+    resolve_metrics,
+    window_rows,
+)
+from api.renderers import rows_response
+from api.snapshot import SNAPSHOT_KEY, SNAPSHOT_LATEST_KEY, cached_snapshot
 
 
 def latest_sensors(request):
-    latest_air = SensorDataAir.objects.order_by('-time').first()
-    latest_indoor = SensorDataIndoor.objects.order_by('-time').first()
-    latest_temp1 = SensorDataTemp.objects.filter(sensor_id=1).order_by('-time').first()
-    latest_temp2 = SensorDataTemp.objects.filter(sensor_id=2).order_by('-time').first()
-    return JsonResponse({
-        'outdoorSensor': _serialize_air(latest_air),
-        'indoorSensor': _serialize_indoor(latest_indoor),
-        'tempSensor1': _serialize_temp(latest_temp1),
-        'tempSensor2': _serialize_temp(latest_temp2),
-    })
-
-
-def _serialize_air_list(qs):
-    return [_serialize_air(obj) for obj in list(qs)[::-1]]
-
-
-def _serialize_indoor_list(qs):
-    return [_serialize_indoor(obj) for obj in list(qs)[::-1]]
-
-
-def _serialize_temp_list(qs):
-    return [_serialize_temp(obj) for obj in list(qs)[::-1]]
+    body, etag, last_modified = cached_snapshot(SNAPSHOT_LATEST_KEY)
+    return conditional_response(
+        request, etag, last_modified, lambda: HttpResponse(body, content_type='application/json'),
+    )
 
 
 def home(request):
-    latest_air_data = SensorDataAir.objects.order_by('-time').first()
-    latest_indoor_data = SensorDataIndoor.objects.order_by('-time').first()
-    latest_temp_sensor_1 = SensorDataTemp.objects.filter(sensor_id=1).order_by('-time').first()
-    latest_temp_sensor_2 = SensorDataTemp.objects.filter(sensor_id=2).order_by('-time').first()
-
-    # Last 60 readings for charts
-    air_history = SensorDataAir.objects.order_by('-time')[:60]
-    indoor_history = SensorDataIndoor.objects.order_by('-time')[:60]
-    temp1_history = SensorDataTemp.objects.filter(sensor_id=1).order_by('-time')[:60]
-    temp2_history = SensorDataTemp.objects.filter(sensor_id=2).order_by('-time')[:60]
-
-    initial_data = json.dumps({
-        'outdoorSensor': _serialize_air(latest_air_data),
-        'indoorSensor': _serialize_indoor(latest_indoor_data),
-        'tempSensor1': _serialize_temp(latest_temp_sensor_1),
-        'tempSensor2': _serialize_temp(latest_temp_sensor_2),
-        'outdoorHistory': _serialize_air_list(air_history),
-        'indoorHistory': _serialize_indoor_list(indoor_history),
-        'temp1History': _serialize_temp_list(temp1_history),
-        'temp2History': _serialize_temp_list(temp2_history),
+    body, _, _ = cached_snapshot(SNAPSHOT_KEY)
+    return render(request, 'home.html', {
+        'initial_data': body,
+        'cache_bust': int(_time.time()),
+        'version': settings.VERSION,
     })
 
-    return render(request, 'home.html', {'initial_data': initial_data, 'cache_bust': int(_time.time()), 'version': settings.VERSION})
-
 
 def history_data(request):
     sensor = request.GET.get('sensor', 'outdoor')
     range_param = request.GET.get('range', '1d')
 
-    ranges = {
-        '1d': ('1 day',    '1 hour'),
-        '1w': ('7 days',   '6 hours'),
-        '1m': ('30 days',  '1 day'),
-        '6m': ('180 days', '1 week'),
-        '1y': ('365 days', '2 weeks'),
-    }
+    if sensor not in HISTORY_SERIES:
+        return JsonResponse({'error': 'invalid sensor'}, status=400)
+
+    kind, sensor_id = HISTORY_SERIES[sensor]
+
+    metrics = request.GET.get('metrics')
+    stats = request.GET.get('stats')
+    try:
+        if metrics is not None:
+            metrics = metrics.split(',')
+            resolve_metrics(kind, metrics)
+        stats = parse_stats(stats.split(',')) if stats else []
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if 'start' in request.GET:
+        try:
+            start = parse_time_param(request.GET, 'start')
+            end = parse_time_param(request.GET, 'end') or timezone.now()
+        except ValidationError as e:
+            return JsonResponse(e.detail, status=400)
+        if start is None or start >= end:
+            return JsonResponse({'error': 'start must be before end'}, status=400)
+        try:
+            max_points = int(request.GET.get('max_points', 500))
+        except ValueError:
+            return JsonResponse({'error': 'invalid max_points'}, status=400)
+        if not 1 <= max_points <= HISTORY_MAX_POINTS:
+            return JsonResponse({'error': f'max_points must be between 1 and {HISTORY_MAX_POINTS}'}, status=400)
+        try:
+            bucket = choose_bucket(start, end, max_points)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        etag, last_modified = series_validators(request, [kind], sensor_id, history_state(kind))
+        return conditional_response(
+            request, etag, last_modified,
+            lambda: rows_response(request, window_rows(kind, sensor_id, start, end, bucket, metrics, stats)),
+        )
+
+    if range_param not in HISTORY_RANGES:
+        return JsonResponse({'error': 'invalid range'}, status=400)
 
-    if range_param not in ranges:
+    if request.GET.get('downsample') == 'lttb':
+        # The raw window slides with every request, so there is no validator
+        if stats:
+            return JsonResponse({'error': 'stats are not available with downsample'}, status=400)
+        try:
+            points = int(request.GET.get('points', 500))
+        except ValueError:
+            return JsonResponse({'error': 'invalid points'}, status=400)
+        if not 3 <= points <= LTTB_MAX_POINTS:
+            return JsonResponse({'error': f'points must be between 3 and {LTTB_MAX_POINTS}'}, status=400)
+        return rows_response(request, downsampled_rows(kind, sensor_id, range_param, points, metrics))
+
+    etag, last_modified = series_validators(request, [kind], sensor_id, history_state(kind, range_param))
+    return conditional_response(
+        request, etag, last_modified,
+        lambda: rows_response(request, history_rows(kind, sensor_id, range_param, metrics, stats)),
+    )
+
+
+def history_batch_data(request):
+    range_param = request.GET.get('range', '1d')
+    specs = request.GET.getlist('series')
+
+    if range_param not in HISTORY_RANGES:
         return JsonResponse({'error': 'invalid range'}, status=400)
 
-    interval, bucket = ranges[range_param]
-
-    with connection.cursor() as cursor:
-        if sensor == 'outdoor':
-            cursor.execute(f"""
-                SELECT time_bucket('{bucket}', time) AS b,
-                       AVG(temperature), AVG(humidity), AVG(pressure), AVG(p1), AVG(p2)
-                FROM sensor_data_air
-                WHERE time >= NOW() - INTERVAL '{interval}'
-                GROUP BY b ORDER BY b
-            """)
-            return JsonResponse([{
-                'time':        row[0].isoformat(),
-                'type':        'air',
-                'temperature': round(row[1], 2) if row[1] is not None else None,
-                'humidity':    round(row[2], 2) if row[2] is not None else None,
-                'pressure':    round(row[3], 2) if row[3] is not None else None,
-                'pm10':        round(row[4], 2) if row[4] is not None else None,
-                'pm25':        round(row[5], 2) if row[5] is not None else None,
-            } for row in cursor.fetchall()], safe=False)
-
-        if sensor == 'indoor':
-            cursor.execute(f"""
-                SELECT time_bucket('{bucket}', time) AS b,
-                       AVG(aqi), AVG(tvoc), AVG(eco2)
-                FROM sensor_data_indoor
-                WHERE time >= NOW() - INTERVAL '{interval}'
-                GROUP BY b ORDER BY b
-            """)
-            return JsonResponse([{
-                'time': row[0].isoformat(),
-                'type': 'indoor',
-                'aqi':  round(row[1], 1) if row[1] is not None else None,
-                'tvoc': round(row[2], 1) if row[2] is not None else None,
-                'eco2': round(row[3], 1) if row[3] is not None else None,
-            } for row in cursor.fetchall()], safe=False)
-
-        if sensor in ('temp1', 'temp2'):
-            sensor_id = 1 if sensor == 'temp1' else 2
-            cursor.execute(f"""
-                SELECT time_bucket('{bucket}', time) AS b,
-                       AVG(temperature), AVG(humidity), AVG(pressure)
-                FROM sensor_data_temp
-                WHERE time >= NOW() - INTERVAL '{interval}'
-                AND sensor_id = %s
-                GROUP BY b ORDER BY b
-            """, [sensor_id])
-            return JsonResponse([{
-                'time':        row[0].isoformat(),
-                'type':        'temperature',
-                'temperature': round(row[1], 2) if row[1] is not None else None,
-                'humidity':    round(row[2], 2) if row[2] is not None else None,
-                'pressure':    round(row[3], 2) if row[3] is not None else None,
-            } for row in cursor.fetchall()], safe=False)
-
-    return JsonResponse({'error': 'invalid sensor'}, status=400)
+    if not specs or len(specs) > HISTORY_MAX_SERIES:
+        return JsonResponse({'error': f'between 1 and {HISTORY_MAX_SERIES} series are required'}, status=400)
+
+    stats = request.GET.get('stats')
+    try:
+        series = {spec: parse_series(spec) for spec in specs}
+        stats = parse_stats(stats.split(',')) if stats else []
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    return JsonResponse({'range': range_param, 'series': history_batch(series, range_param, stats)})
 
 
 urlpatterns = [
@@ -185,6 +139,7 @@ urlpatterns = [
     path('', home, name='home'),
     path('api/sensors/latest/', latest_sensors, name='latest-sensors'),
     path('api/history/', history_data, name='history-data'),
+    path('api/history/batch/', history_batch_data, name='history-batch-data'),
     path('favicon.ico', RedirectView.as_view(url=settings.STATIC_URL + 'favicon.ico', permanent=True)),
 ]
 
@@ -21,6 +21,7 @@ window.sensorData = function sensorData() {
     // All non-reactive state lives here, outside Alpine's proxy
     const state = {
         lastTimes: { outdoor: null, indoor: null, temp1: null, temp2: null },
+        socket: { seq: {}, lastMessageAt: 0, heartbeatMs: 15000 },
         history: {
             outdoor: { labels: [], datasets: {} },
             indoor: { labels: [], datasets: {} },
@@ -271,7 +272,10 @@ window.sensorData = function sensorData() {
 
         connectWebSocket() {
             const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-            const socket = new WebSocket(protocol + '//' + window.location.host + '/ws/sensor_data/');
+            // After a drop, ask for the frames missed since the last sequence numbers
+            const seen = Object.fromEntries(Object.entries(state.socket.seq).filter(([, seq]) => seq != null));
+            const resume = Object.keys(seen).length ? '?resume=' + encodeURIComponent(JSON.stringify(seen)) : '';
+            const socket = new WebSocket(protocol + '//' + window.location.host + '/ws/sensor_data/' + resume);
 
             socket.onopen = () => { this.wsConnected = true; };
             socket.onclose = () => {
@@ -281,106 +285,105 @@ window.sensorData = function sensorData() {
             socket.onerror = () => { this.wsConnected = false; };
 
             socket.onmessage = (event) => {
-                const data = JSON.parse(event.data);
-                const liveCharts = this.selectedRange === 'live';
-
-                if (data.type === 'air') {
-                    this.outdoorSensor = this.formatSensorData(data);
-                    state.lastTimes.outdoor = data.time;
-                    if (liveCharts) {
-                        pushPoint(state.history.outdoor, data.time, {
-                            pm10: data.pm10, pm25: data.pm25,
-                            temperature: data.temperature, humidity: data.humidity,
-                            pressure: data.pressure,
-                        });
-                        updateChart(state.charts.outdoor, state.history.outdoor);
-                    }
-                } else if (data.type === 'indoor') {
-                    this.indoorSensor = this.formatSensorData(data);
-                    state.lastTimes.indoor = data.time;
-                    if (liveCharts) {
-                        pushPoint(state.history.indoor, data.time, {
-                            aqi: data.aqi, tvoc: data.tvoc, eco2: data.eco2,
-                        });
-                        updateChart(state.charts.indoor, state.history.indoor);
-                    }
-                } else if (data.type === 'temperature' && data.sensor_id === 1) {
-                    this.tempSensor1 = this.formatSensorData(data);
-                    state.lastTimes.temp1 = data.time;
-                    if (liveCharts) {
-                        pushPoint(state.history.temp1, data.time, {
-                            temperature: data.temperature, humidity: data.humidity,
-                            pressure: data.pressure,
-                        });
-                        updateChart(state.charts.temp1, state.history.temp1);
-                    }
-                } else if (data.type === 'temperature' && data.sensor_id === 2) {
-                    this.tempSensor2 = this.formatSensorData(data);
-                    state.lastTimes.temp2 = data.time;
-                    if (liveCharts) {
-                        pushPoint(state.history.temp2, data.time, {
-                            temperature: data.temperature, humidity: data.humidity,
-                            pressure: data.pressure,
-                        });
-                        updateChart(state.charts.temp2, state.history.temp2);
+                const message = JSON.parse(event.data);
+
+                if (message.event === 'snapshot') {
+                    state.socket.lastMessageAt = Date.now();
+                    Object.assign(state.socket.seq, message.seq);
+                    state.socket.heartbeatMs = message.heartbeat * 1000;
+                    for (const data of message.readings) this.handleReading(data);
+                } else if (message.event === 'delta') {
+                    state.socket.lastMessageAt = Date.now();
+                    // A jump in a group's sequence means frames were lost, unless the
+                    // server merged them into this frame while the tab fell behind.
+                    // The server sends each group in order, so a lower number means
+                    // its counters were reset.
+                    const last = state.socket.seq[message.group];
+                    if (message.seq != null && last != null) {
+                        if (message.seq === last) return;
+                        if (message.seq < last || (message.seq > last + 1 && !message.conflated)) {
+                            socket.send(JSON.stringify({ action: 'snapshot' }));
+                        }
                     }
+                    if (message.seq != null) state.socket.seq[message.group] = message.seq;
+                    for (const data of message.readings) this.handleReading(data);
+                } else if (message.event === 'heartbeat') {
+                    const stale = Object.entries(message.seq).some(
+                        ([group, seq]) => seq != null && state.socket.seq[group] != null && seq !== state.socket.seq[group]
+                    );
+                    if (stale) socket.send(JSON.stringify({ action: 'snapshot' }));
                 }
             };
         },
 
+        socketHealthy() {
+            // Polling is only a fallback for a socket that has gone quiet. Heartbeats
+            // do not count, they also arrive while every delta is being discarded.
+            return this.wsConnected && Date.now() - state.socket.lastMessageAt < 2 * state.socket.heartbeatMs;
+        },
+
+        handleReading(data) {
+            const liveCharts = this.selectedRange === 'live';
+            const series = data.type === 'air' ? 'outdoor'
+                : data.type === 'indoor' ? 'indoor'
+                : data.type === 'temperature' && data.sensor_id === 1 ? 'temp1'
+                : data.type === 'temperature' && data.sensor_id === 2 ? 'temp2'
+                : null;
+            // Snapshots, polls and overlapping subscriptions repeat readings
+            if (series === null || state.lastTimes[series] === data.time) return;
+
+            if (data.type === 'air') {
+                this.outdoorSensor = this.formatSensorData(data);
+                state.lastTimes.outdoor = data.time;
+                if (liveCharts) {
+                    pushPoint(state.history.outdoor, data.time, {
+                        pm10: data.pm10, pm25: data.pm25,
+                        temperature: data.temperature, humidity: data.humidity,
+                        pressure: data.pressure,
+                    });
+                    updateChart(state.charts.outdoor, state.history.outdoor);
+                }
+            } else if (data.type === 'indoor') {
+                this.indoorSensor = this.formatSensorData(data);
+                state.lastTimes.indoor = data.time;
+                if (liveCharts) {
+                    pushPoint(state.history.indoor, data.time, {
+                        aqi: data.aqi, tvoc: data.tvoc, eco2: data.eco2,
+                    });
+                    updateChart(state.charts.indoor, state.history.indoor);
+                }
+            } else if (data.type === 'temperature' && data.sensor_id === 1) {
+                this.tempSensor1 = this.formatSensorData(data);
+                state.lastTimes.temp1 = data.time;
+                if (liveCharts) {
+                    pushPoint(state.history.temp1, data.time, {
+                        temperature: data.temperature, humidity: data.humidity,
+                        pressure: data.pressure,
+                    });
+                    updateChart(state.charts.temp1, state.history.temp1);
+                }
+            } else if (data.type === 'temperature' && data.sensor_id === 2) {
+                this.tempSensor2 = this.formatSensorData(data);
+                state.lastTimes.temp2 = data.time;
+                if (liveCharts) {
+                    pushPoint(state.history.temp2, data.time, {
+                        temperature: data.temperature, humidity: data.humidity,
+                        pressure: data.pressure,
+                    });
+                    updateChart(state.charts.temp2, state.history.temp2);
+                }
+            }
+        },
+
         pollSensors() {
+            if (this.socketHealthy()) return;
             console.log('[poll] Fetching...');
             fetch('/api/sensors/latest/')
                 .then(r => r.json())
                 .then(data => {
                     console.log('[poll] OK');
-                    if (data.outdoorSensor) {
-                        const d = data.outdoorSensor;
-                        if (state.lastTimes.outdoor !== d.time) {
-                            state.lastTimes.outdoor = d.time;
-                            this.outdoorSensor = this.formatSensorData(d);
-                            pushPoint(state.history.outdoor, d.time, {
-                                pm10: d.pm10, pm25: d.pm25,
-                                temperature: d.temperature, humidity: d.humidity,
-                                pressure: d.pressure,
-                            });
-                            updateChart(state.charts.outdoor, state.history.outdoor);
-                        }
-                    }
-                    if (data.indoorSensor) {
-                        const d = data.indoorSensor;
-                        if (state.lastTimes.indoor !== d.time) {
-                            state.lastTimes.indoor = d.time;
-                            this.indoorSensor = this.formatSensorData(d);
-                            pushPoint(state.history.indoor, d.time, {
-                                aqi: d.aqi, tvoc: d.tvoc, eco2: d.eco2,
-                            });
-                            updateChart(state.charts.indoor, state.history.indoor);
-                        }
-                    }
-                    if (data.tempSensor1) {
-                        const d = data.tempSensor1;
-                        if (state.lastTimes.temp1 !== d.time) {
-                            state.lastTimes.temp1 = d.time;
-                            this.tempSensor1 = this.formatSensorData(d);
-                            pushPoint(state.history.temp1, d.time, {
-                                temperature: d.temperature, humidity: d.humidity,
-                                pressure: d.pressure,
-                            });
-                            updateChart(state.charts.temp1, state.history.temp1);
-                        }
-                    }
-                    if (data.tempSensor2) {
-                        const d = data.tempSensor2;
-                        if (state.lastTimes.temp2 !== d.time) {
-                            state.lastTimes.temp2 = d.time;
-                            this.tempSensor2 = this.formatSensorData(d);
-                            pushPoint(state.history.temp2, d.time, {
-                                temperature: d.temperature, humidity: d.humidity,
-                                pressure: d.pressure,
-                            });
-                            updateChart(state.charts.temp2, state.history.temp2);
-                        }
+                    for (const key of ['outdoorSensor', 'indoorSensor', 'tempSensor1', 'tempSensor2']) {
+                        if (data[key]) this.handleReading(data[key]);
                     }
                 })
                 .catch(err => console.error('[poll] Error:', err));
@@ -426,12 +429,20 @@ window.sensorData = function sensorData() {
                 return;
             }
 
-            const [outdoor, indoor, temp1, temp2] = await Promise.all([
-                fetch(`/api/history/?sensor=outdoor&range=${range}`).then(r => r.json()),
-                fetch(`/api/history/?sensor=indoor&range=${range}`).then(r => r.json()),
-                fetch(`/api/history/?sensor=temp1&range=${range}`).then(r => r.json()),
-                fetch(`/api/history/?sensor=temp2&range=${range}`).then(r => r.json()),
-            ]);
+            const params = new URLSearchParams({ range });
+            for (const name of ['outdoor', 'indoor', 'temp1', 'temp2']) params.append('series', name);
+            let series;
+            try {
+                const response = await fetch(`/api/history/batch/?${params}`);
+                const data = await response.json();
+                if (!response.ok) throw new Error(data.error || response.statusText);
+                series = data.series;
+            } catch (err) {
+                // Keep the charts of the previous range
+                console.error('Error fetching history:', err);
+                return;
+            }
+            const { outdoor, indoor, temp1, temp2 } = series;
 
             state.history.outdoor = buildHistory(outdoor, ['pm10', 'pm25', 'temperature', 'humidity', 'pressure'], range);
             state.history.indoor  = buildHistory(indoor,  ['aqi', 'tvoc', 'eco2'], range);